@@ -0,0 +1,215 @@
+"""
+全局异步 HTTP 客户端
+基于共享的 aiohttp 连接器，供事件循环直接驱动 I/O，无需切换到线程池
+"""
+import asyncio
+import json
+import logging
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Union
+
+import aiohttp
+import requests
+
+from config import (
+    ASYNC_HTTP_LIMIT,
+    ASYNC_HTTP_LIMIT_PER_HOST,
+    ASYNC_HTTP_DNS_CACHE_TTL,
+    ASYNC_HTTP_KEEPALIVE_TIMEOUT,
+)
+from retry_budget import retry_budgets
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class RetryProfile:
+    """重试策略，与 http_client 中各 Session 的 urllib3 Retry 配置保持一致（同样受全局重试预算约束）"""
+    retries: int
+    backoff_factor: float
+    status_forcelist: tuple = (502, 503, 504)
+    # 与 urllib3 默认值一致：仅对幂等方法按状态码重试，连接失败对所有方法重试
+    idempotent_methods: frozenset = frozenset({"GET", "HEAD", "PUT", "DELETE", "OPTIONS", "TRACE"})
+
+    def backoff(self, attempt: int) -> float:
+        """第 attempt 次重试前的等待时间(秒)"""
+        return self.backoff_factor * (2 ** (attempt - 1))
+
+
+class AsyncResponse:
+    """已读取完毕的响应，接口与 requests.Response 的常用部分保持一致"""
+
+    def __init__(self, status_code: int, headers: Dict[str, str], content: bytes, url: str):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.url = url
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        """与 requests 一致：4xx/5xx 时抛出 requests.HTTPError（e.response 为本对象），调用方按同一异常类型处理"""
+        if self.status_code >= 400:
+            kind = "Client" if self.status_code < 500 else "Server"
+            raise requests.HTTPError(f"{self.status_code} {kind} Error for url: {self.url}", response=self)
+
+
+class AsyncHttpClient:
+    """异步 HTTP 客户端，所有业务共享一个连接器（按主机限流、keep-alive、DNS 缓存）"""
+
+    PROFILES = {
+        "dingtalk": RetryProfile(retries=2, backoff_factor=0.5),
+        "codebuddy": RetryProfile(retries=0, backoff_factor=0),  # 重试由业务层控制
+        "download": RetryProfile(retries=3, backoff_factor=1.0),
+    }
+
+    def __init__(self):
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """获取当前事件循环上的共享 Session（惰性创建）"""
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            connector = aiohttp.TCPConnector(
+                limit=ASYNC_HTTP_LIMIT,
+                limit_per_host=ASYNC_HTTP_LIMIT_PER_HOST,
+                ttl_dns_cache=ASYNC_HTTP_DNS_CACHE_TTL,
+                keepalive_timeout=ASYNC_HTTP_KEEPALIVE_TIMEOUT,
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._loop = loop
+            logger.info(
+                f"异步 HTTP 连接器已初始化: limit={ASYNC_HTTP_LIMIT}, "
+                f"limit_per_host={ASYNC_HTTP_LIMIT_PER_HOST}"
+            )
+        return self._session
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        profile: str = "dingtalk",
+        timeout: Optional[float] = None,
+        **kwargs
+    ) -> AsyncResponse:
+        """
+        发送请求并读取完整响应
+
+        Args:
+            method: HTTP 方法
+            url: 请求地址
+            profile: 重试策略名称 ('dingtalk' / 'codebuddy' / 'download')
+            timeout: 总超时(秒)
+            **kwargs: 透传给 aiohttp（headers, json, data, params 等）
+
+        Returns:
+            AsyncResponse
+        """
+        retry = self.PROFILES[profile]
+        method = method.upper()
+        client_timeout = aiohttp.ClientTimeout(total=timeout)
+        attempt = 0
+
+        with retry_budgets.request(url) as logical:
+            while True:
+                try:
+                    async with self._get_session().request(method, url, timeout=client_timeout, **kwargs) as resp:
+                        content = await resp.read()
+                        response = AsyncResponse(resp.status, dict(resp.headers), content, str(resp.url))
+                    if (response.status_code in retry.status_forcelist
+                            and method in retry.idempotent_methods
+                            and attempt < retry.retries
+                            and logical.retry()):
+                        attempt += 1
+                        logger.warning(f"HTTP {response.status_code}, {retry.backoff(attempt):.1f}s 后重试 ({attempt}/{retry.retries}): {url}")
+                        await asyncio.sleep(retry.backoff(attempt))
+                        continue
+                    return response
+                except aiohttp.ClientConnectorError as e:
+                    if attempt >= retry.retries or not logical.retry():
+                        raise
+                    attempt += 1
+                    logger.warning(f"连接失败: {e}, {retry.backoff(attempt):.1f}s 后重试 ({attempt}/{retry.retries})")
+                    await asyncio.sleep(retry.backoff(attempt))
+
+    async def get(self, url: str, **kwargs) -> AsyncResponse:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> AsyncResponse:
+        return await self.request("POST", url, **kwargs)
+
+    async def download(
+        self,
+        url: str,
+        destination: Union[str, Callable[[bytes], None]],
+        profile: str = "download",
+        timeout: Optional[float] = None,
+        chunk_size: int = 65536,
+        on_response: Optional[Callable[[aiohttp.ClientResponse], None]] = None,
+        **kwargs
+    ) -> int:
+        """
+        流式下载
+
+        Args:
+            url: 下载地址
+            destination: 保存路径，或逐块接收数据的函数（如 downloader.StreamingFile.write）
+            profile: 重试策略名称
+            timeout: 总超时(秒)
+            chunk_size: 分块大小
+            on_response: 开始读取响应体前的回调（可抛出异常放弃下载）
+
+        Returns:
+            写入的字节数
+        """
+        retry = self.PROFILES[profile]
+        client_timeout = aiohttp.ClientTimeout(total=timeout)
+        attempt = 0
+
+        with retry_budgets.request(url) as logical:
+            while True:
+                try:
+                    async with self._get_session().get(url, timeout=client_timeout, **kwargs) as resp:
+                        if (resp.status in retry.status_forcelist
+                                and attempt < retry.retries
+                                and logical.retry()):
+                            attempt += 1
+                            await asyncio.sleep(retry.backoff(attempt))
+                            continue
+                        resp.raise_for_status()
+                        if on_response is not None:
+                            on_response(resp)
+                        if callable(destination):
+                            return await self._consume(resp, destination, chunk_size)
+                        with open(destination, "wb") as f:
+                            return await self._consume(resp, f.write, chunk_size)
+                except aiohttp.ClientConnectorError:
+                    if attempt >= retry.retries or not logical.retry():
+                        raise
+                    attempt += 1
+                    await asyncio.sleep(retry.backoff(attempt))
+
+    @staticmethod
+    async def _consume(resp: aiohttp.ClientResponse, write: Callable[[bytes], None], chunk_size: int) -> int:
+        written = 0
+        async for chunk in resp.content.iter_chunked(chunk_size):
+            write(chunk)
+            written += len(chunk)
+        return written
+
+    async def close(self):
+        """关闭连接器"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info("异步 HTTP 连接器已关闭")
+        self._session = None
+
+
+# 全局单例
+async_http_client = AsyncHttpClient()
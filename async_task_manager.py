@@ -36,6 +36,8 @@ class TaskInfo:
     error: Optional[str] = None
     created_at: float = None
     completed_at: Optional[float] = None
+    webhook_expires_at: Optional[float] = None  # session webhook 过期时间(秒级时间戳)
+    conversation_type: str = '1'  # '1' 单聊, '2' 群聊
     
     def __post_init__(self):
         if self.created_at is None:
@@ -63,7 +65,9 @@ class AsyncTaskManager:
         user_id: str,
         conversation_id: str,
         webhook_url: str,
-        prompt: str
+        prompt: str,
+        webhook_expires_at: Optional[float] = None,
+        conversation_type: str = '1'
     ) -> str:
         """
         创建新任务
@@ -73,6 +77,8 @@ class AsyncTaskManager:
             conversation_id: 会话ID
             webhook_url: Session webhook URL
             prompt: 用户消息
+            webhook_expires_at: Session webhook 过期时间(秒级时间戳，可选)
+            conversation_type: 会话类型 ('1' 单聊, '2' 群聊)
             
         Returns:
             任务ID
@@ -85,7 +91,9 @@ class AsyncTaskManager:
             conversation_id=conversation_id,
             webhook_url=webhook_url,
             status=TaskStatus.PENDING,
-            prompt=prompt
+            prompt=prompt,
+            webhook_expires_at=webhook_expires_at,
+            conversation_type=conversation_type
         )
         
         with self._lock:
@@ -28,11 +28,24 @@ from config import (
     LOG_LEVEL,
     LOG_FILE,
     INITIAL_REPLY,
+    MESSAGE_DEADLINE_SECONDS,
+    ASYNC_TASK_DEADLINE_SECONDS,
+    WORKER_CONCURRENCY,
+    IMAGE_DOWNLOAD_CONCURRENCY,
+    ENABLE_WARMUP,
+    WARMUP_KEEPALIVE_INTERVAL,
     ENABLE_MARKDOWN,
     USE_MARKDOWN_FOR_ASYNC,
     USE_MARKDOWN_FOR_LONG_TEXT,
+    MAX_MESSAGE_BYTES,
+    ENABLE_CARD_REPLY,
+    CARD_TEMPLATE_ID,
+    CARD_PROGRESS_INTERVAL,
     AUTO_ENHANCE_MARKDOWN,
     IMAGE_SERVER_URL,
+    IMAGE_SERVER_PORT,
+    EMBED_IMAGE_SERVER,
+    IMAGE_DIR,
     MSG_ASYNC_TASK_RECEIVED,
     MSG_IMAGE_ANALYZING,
     MSG_IMAGE_GENERATING,
@@ -50,20 +63,38 @@ from config import (
 )
 from codebuddy_client import codebuddy_client
 from http_client import http_client
-from image_manager import image_manager
+from async_http_client import async_http_client
+from deadline import Deadline, DeadlineExceeded, timeout_for
+from rate_limiter import (
+    openapi_limiter,
+    webhook_limiter,
+    call_with_throttle_retry,
+    call_with_throttle_retry_async,
+)
+from image_cache import image_cache
+from disk_janitor import disk_janitor
+from image_preprocessor import image_preprocessor
+from image_variants import thumbnail_url, variant_store
+from image_server import ImageServer
+from downloader import download_file, download_file_async
 from async_task_manager import task_manager, TaskStatus
 from dingtalk_sender import dingtalk_sender
+from delivery_router import delivery_router, DeliveryTarget, ROUTE_WEBHOOK, webhook_expires_at
+from message_splitter import split_message, number_parts, PART_HEADER_RESERVE
+from interactive_card import InteractiveCard, STATUS_PROCESSING
 from markdown_utils import markdown_formatter
 from image_generator import image_generator
+from warmup import warm_up, keep_warm
 import requests
 import json
-import time
 import uuid
 import re
 import os
 import shutil
 import threading
+import time
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 
 # 配置日志
@@ -96,6 +127,9 @@ def setup_logging():
 
 logger = logging.getLogger(__name__)
 
+# 钉钉机器人消息文件下载接口（由 downloadCode 换取下载链接）
+MESSAGE_FILE_DOWNLOAD_URL = "https://api.dingtalk.com/v1.0/robot/messageFiles/download"
+
 
 class MyCallbackHandler(ChatbotHandler):
     """自定义消息处理器 - 继承ChatbotHandler"""
@@ -109,6 +143,8 @@ class MyCallbackHandler(ChatbotHandler):
         # 活跃后台线程跟踪（用于优雅退出）
         self._active_threads: list = []
         self._active_threads_lock = threading.Lock()
+        # 内置图片服务器（EMBED_IMAGE_SERVER 开启时由 main 设置）
+        self.image_server = None
 
     def _check_and_mark_processed(self, msg_id: str) -> bool:
         """检查消息是否已处理，并标记为已处理。返回 True 表示已处理过（应跳过）"""
@@ -141,6 +177,9 @@ class MyCallbackHandler(ChatbotHandler):
                 logger.info(f"消息已处理过,跳过: {msg_id}")
                 return AckMessage.STATUS_OK, 'ok'
 
+            # 整条消息的处理预算，贯穿下载、后端调用和回复
+            deadline = Deadline(MESSAGE_DEADLINE_SECONDS)
+
             # 获取消息内容
             msg_type = message.message_type
             logger.info(f"收到消息类型: {msg_type}, 消息ID: {msg_id}")
@@ -148,28 +187,19 @@ class MyCallbackHandler(ChatbotHandler):
             # 获取用户消息文本
             user_text = self._extract_text_from_message(message)
             
-            # 检查是否有图片
+            # 检查是否有图片（富文本中的所有图片）
             has_image = message.message_type in ["picture", "richText"]
-            image_download_code = None
-            if has_image:
-                if message.message_type == "picture" and message.image_content:
-                    image_download_code = message.image_content.download_code
-                elif message.message_type == "richText" and hasattr(message, 'rich_text_content'):
-                    rich_text_list = message.rich_text_content.rich_text_list if hasattr(message.rich_text_content, 'rich_text_list') else []
-                    for item in rich_text_list:
-                        if isinstance(item, dict) and 'downloadCode' in item:
-                            image_download_code = item['downloadCode']
-                            break
+            image_download_codes = self._extract_image_codes(message) if has_image else []
+            image_download_code = image_download_codes[0] if image_download_codes else None
             
             # 新增逻辑1: 只有图片没有文字 -> 图片分析
             if has_image and image_download_code and not user_text.strip():
-                logger.info("检测到纯图片消息,进行图片分析")
-                self.reply_text(MSG_IMAGE_ANALYZING, message)
+                logger.info(f"检测到纯图片消息({len(image_download_codes)} 张),进行图片分析")
+                await self.reply_text_async(MSG_IMAGE_ANALYZING, message, deadline)
                 
                 # 使用缺省prompt分析图片
-                default_prompt = "请分析此图片"
-                loop = asyncio.get_event_loop()
-                await loop.run_in_executor(None, self._process_image_analysis, message, default_prompt, image_download_code)
+                default_prompt = "请分析此图片" if len(image_download_codes) == 1 else "请分析这些图片"
+                await self._process_image_analysis_async(message, default_prompt, image_download_codes, deadline)
                 
                 return AckMessage.STATUS_OK, 'ok'
             
@@ -184,11 +214,10 @@ class MyCallbackHandler(ChatbotHandler):
             if is_generation:
                 logger.info(f"检测到生图请求,类型: {gen_type}")
                 # 发送初始回复
-                self.reply_text(MSG_IMAGE_GENERATING, message)
+                await self.reply_text_async(MSG_IMAGE_GENERATING, message, deadline)
                 
                 # 处理生图请求
-                loop = asyncio.get_event_loop()
-                await loop.run_in_executor(None, self._process_image_generation, message, user_text, gen_type, image_download_code)
+                await self._process_image_generation_async(message, user_text, gen_type, image_download_code, deadline)
                 
                 return AckMessage.STATUS_OK, 'ok'
             
@@ -197,26 +226,37 @@ class MyCallbackHandler(ChatbotHandler):
             
             if should_async:
                 logger.info(f"检测到长时间任务，使用异步处理")
-                # 异步处理模式
-                await self._process_async(message, user_text)
+                # 异步处理模式（后台任务使用更长的处理预算）
+                await self._process_async(message, user_text, Deadline(ASYNC_TASK_DEADLINE_SECONDS))
             else:
                 # 同步处理模式（快速任务）
-                # 1. 立即发送初始回复
-                self.reply_text(INITIAL_REPLY, message)
+                # 1. 立即发送初始回复（启用互动卡片时投放进度卡片，之后原地更新）
+                loop = asyncio.get_event_loop()
+                card = await self._create_progress_card(message, deadline) if ENABLE_CARD_REPLY else None
+                if card is None:
+                    await self.reply_text_async(INITIAL_REPLY, message, deadline)
                 
                 # 2. 处理消息
-                loop = asyncio.get_event_loop()
-                result = await loop.run_in_executor(None, self._process_message_sync, message)
+                progress = asyncio.ensure_future(self._card_progress(card, deadline)) if card else None
+                try:
+                    result = await self._process_message_async(message, deadline)
+                finally:
+                    if progress:
+                        progress.cancel()
                 
                 # 3. 发送最终结果
-                if result:
+                if result and card and not self._extract_generated_image(result):
+                    await loop.run_in_executor(None, self._finish_card, card, result, message, deadline)
+                elif result:
                     # 检查响应中是否包含生成的图片路径
                     generated_image = self._extract_generated_image(result)
                     
                     if generated_image:
                         # 响应中包含生成的图片,发送图片
                         logger.info(f"检测到响应中包含生成的图片: {generated_image}")
-                        self._send_generated_image(message, generated_image, result)
+                        if card:
+                            await loop.run_in_executor(None, card.finish, "🎨 图片已生成", deadline)
+                        await self._send_generated_image_async(message, generated_image, result, deadline)
                     else:
                         # 普通文本响应
                         # 检查是否应该使用 Markdown 格式
@@ -228,10 +268,12 @@ class MyCallbackHandler(ChatbotHandler):
                                 result,
                                 auto_enhance=AUTO_ENHANCE_MARKDOWN
                             )
-                            self.reply_markdown(title, md_content, message)
+                            await self._send_plan_async(self._plan_markdown(title, md_content), message, deadline)
                         else:
                             # 使用 _send_long_text 处理长文本
-                            self._send_long_text(result, message)
+                            await self._send_long_text_async(result, message, deadline)
+                elif card:
+                    await loop.run_in_executor(None, card.fail, MSG_TASK_RESULT_EMPTY, deadline)
 
             return AckMessage.STATUS_OK, 'ok'
 
@@ -239,7 +281,7 @@ class MyCallbackHandler(ChatbotHandler):
             logger.error(f"处理消息失败: {e}", exc_info=True)
             try:
                 # 用户友好的错误消息，不暴露技术细节
-                self.reply_text(MSG_GENERAL_ERROR, message)
+                await self.reply_text_async(MSG_GENERAL_ERROR, message)
             except Exception:
                 logger.error("发送错误通知也失败了", exc_info=True)
             return AckMessage.STATUS_OK, 'ok'
@@ -270,7 +312,7 @@ class MyCallbackHandler(ChatbotHandler):
         if isinstance(e, _req.exceptions.HTTPError):
             return "服务暂时不可用，请稍后重试。"
         return MSG_GENERAL_ERROR
-    
+
     def shutdown(self, timeout: float = 30):
         """等待所有后台任务完成"""
         with self._active_threads_lock:
@@ -280,29 +322,32 @@ class MyCallbackHandler(ChatbotHandler):
             for t in threads:
                 t.join(timeout=timeout)
 
-    async def _process_async(self, message: ChatbotMessage, user_text: str):
+    async def _process_async(self, message: ChatbotMessage, user_text: str, deadline: Deadline = None):
         """
         异步处理长时间任务
         
         Args:
             message: 消息对象
             user_text: 用户消息文本
+            deadline: 后台任务处理截止时间(可选)
         """
         # 立即回复用户
-        self.reply_text(MSG_ASYNC_TASK_RECEIVED, message)
+        await self.reply_text_async(MSG_ASYNC_TASK_RECEIVED, message, deadline)
         
         # 创建异步任务
         task_id = task_manager.create_task(
             user_id=message.sender_staff_id,
             conversation_id=message.conversation_id,
             webhook_url=message.session_webhook,
-            prompt=user_text
+            prompt=user_text,
+            webhook_expires_at=webhook_expires_at(message),
+            conversation_type=message.conversation_type or '1'
         )
         
         # 在后台线程中处理（非守护线程，确保优雅退出时能等待完成）
         thread = threading.Thread(
             target=self._background_task_worker,
-            args=(task_id, message),
+            args=(task_id, message, deadline),
             daemon=False
         )
         thread.start()
@@ -313,20 +358,23 @@ class MyCallbackHandler(ChatbotHandler):
         
         logger.info(f"异步任务已启动: {task_id}")
     
-    def _background_task_worker(self, task_id: str, message: ChatbotMessage):
+    def _background_task_worker(self, task_id: str, message: ChatbotMessage, deadline: Deadline = None):
         """
         后台任务执行器
         
         Args:
             task_id: 任务ID
             message: 原始消息对象
+            deadline: 后台任务处理截止时间(可选)
         """
         try:
             logger.info(f"后台任务开始执行: {task_id}")
             task_manager.update_status(task_id, TaskStatus.PROCESSING)
+            # 结果按任务记录的 webhook 有效期投递，过期后改走 OpenAPI
+            target = DeliveryTarget.from_task(task_manager.get_task(task_id))
             
             # 执行实际的消息处理
-            result = self._process_message_sync(message)
+            result = self._process_message_sync(message, deadline)
             
             if result:
                 # 任务完成，保存结果
@@ -343,21 +391,11 @@ class MyCallbackHandler(ChatbotHandler):
                     )
                     
                     # 使用 Markdown 消息发送
-                    success = dingtalk_sender.send_message(
-                        conversation_id=message.conversation_id,
-                        user_id=message.sender_staff_id,
-                        msg_type='markdown',
-                        title=title,
-                        text=md_content
-                    )
+                    plan = self._plan_markdown(title, md_content)
                 else:
                     # 使用纯文本发送
-                    success = dingtalk_sender.send_message(
-                        conversation_id=message.conversation_id,
-                        user_id=message.sender_staff_id,
-                        msg_type='text',
-                        content=result
-                    )
+                    plan = self._plan_text(result)
+                success = self._send_plan(plan, message, deadline, target)
                 
                 if success:
                     logger.info(f"任务结果已推送: {task_id}")
@@ -373,36 +411,34 @@ class MyCallbackHandler(ChatbotHandler):
             
             # 尝试通知用户失败
             try:
-                dingtalk_sender.send_message(
-                    conversation_id=message.conversation_id,
-                    user_id=message.sender_staff_id,
-                    msg_type='text',
-                    content=MSG_GENERAL_ERROR
-                )
+                task = task_manager.get_task(task_id)
+                target = DeliveryTarget.from_task(task) if task else DeliveryTarget.from_message(message)
+                self._deliver(target, self._build_text_payload(MSG_GENERAL_ERROR, message), "文本消息")
             except Exception:
                 logger.error("发送后台任务失败通知也失败了", exc_info=True)
 
-    def _process_image_analysis(self, message: ChatbotMessage, prompt: str, image_download_code: str):
+    async def _process_image_analysis_async(self, message: ChatbotMessage, prompt: str, image_download_codes: list,
+                                            deadline: Deadline = None):
         """
         处理图片分析请求(纯图片,无文字)
         
+        图片下载与回复由事件循环驱动，只有 CodeBuddy 调用在线程池中执行
+        
         Args:
             message: 消息对象
             prompt: 分析提示词
-            image_download_code: 图片下载码
+            image_download_codes: 图片下载码列表
+            deadline: 消息处理截止时间(可选)
         """
         try:
-            # 下载图片
-            source_image_path = self._download_image(image_download_code)
-            if not source_image_path:
-                self.reply_text(MSG_IMAGE_DOWNLOAD_FAILED, message)
+            # 并发下载所有图片
+            image_paths = await self._download_images_async(image_download_codes, deadline)
+            if not image_paths:
+                await self.reply_text_async(MSG_IMAGE_DOWNLOAD_FAILED, message, deadline)
                 return
             
-            logger.info(f"图片分析: 使用提示词 '{prompt}' 分析图片 {source_image_path}")
-            
-            # 调用CodeBuddy API进行图片分析
-            from codebuddy_client import codebuddy_client
-            result = codebuddy_client.chat_with_image(prompt, source_image_path)
+            loop = asyncio.get_event_loop()
+            result = await loop.run_in_executor(None, self._analyze_images, message, prompt, image_paths, deadline)
             
             if result:
                 # 使用Markdown格式发送分析结果
@@ -411,25 +447,41 @@ class MyCallbackHandler(ChatbotHandler):
                         result,
                         auto_enhance=AUTO_ENHANCE_MARKDOWN
                     )
-                    self.reply_markdown(title, md_content, message)
+                    await self.reply_markdown_async(title, md_content, message, deadline)
                 else:
-                    self.reply_text(result, message)
+                    await self.reply_text_async(result, message, deadline)
             else:
-                self.reply_text(MSG_IMAGE_ANALYSIS_FAILED, message)
+                await self.reply_text_async(MSG_IMAGE_ANALYSIS_FAILED, message, deadline)
                 
         except Exception as e:
             logger.error(f"图片分析失败: {e}", exc_info=True)
-            self.reply_text(MSG_IMAGE_ANALYSIS_FAILED, message)
+            await self.reply_text_async(MSG_IMAGE_ANALYSIS_FAILED, message)
+
+    def _analyze_images(self, message: ChatbotMessage, prompt: str, image_paths: list, deadline: Deadline = None):
+        """预处理图片并调用 CodeBuddy 分析（在线程池中执行）"""
+        # 分析只需限制分辨率的副本，不把原图交给后端
+        image_paths = image_preprocessor.prepare_all(image_paths, IMAGE_DOWNLOAD_CONCURRENCY, keep_original=False)
+        logger.info(f"图片分析: 使用提示词 '{prompt}' 分析图片 {image_paths}")
+        
+        # 调用CodeBuddy API进行图片分析（所有图片一次调用），期间保护图片不被磁盘清理删除
+        with disk_janitor.pinned(*image_paths):
+            return codebuddy_client.chat_with_images(
+                prompt, image_paths, conversation_id=message.conversation_id, deadline=deadline
+            )
 
-    def _process_image_generation(self, message: ChatbotMessage, user_text: str, gen_type: str, image_download_code: str = None):
+    async def _process_image_generation_async(self, message: ChatbotMessage, user_text: str, gen_type: str,
+                                              image_download_code: str = None, deadline: Deadline = None):
         """
         处理图片生成请求
         
+        生成、源图片下载与回复都由事件循环驱动，不占用线程池
+        
         Args:
             message: 消息对象
             user_text: 用户消息文本
             gen_type: 生成类型 ('text-to-image' 或 'image-to-image')
             image_download_code: 图片下载码(图生图时需要)
+            deadline: 消息处理截止时间(可选)
         """
         try:
             # 提取提示词
@@ -441,19 +493,22 @@ class MyCallbackHandler(ChatbotHandler):
             
             if gen_type == 'text-to-image':
                 # 文生图
-                result = image_generator.generate_text_to_image(prompt)
+                result = await image_generator.generate_text_to_image_async(prompt, deadline=deadline)
             elif gen_type == 'image-to-image':
                 # 图生图 - 需要先下载源图片
                 if not image_download_code:
-                    self.reply_text(MSG_IMAGE_SOURCE_NEEDED, message)
+                    await self.reply_text_async(MSG_IMAGE_SOURCE_NEEDED, message, deadline)
                     return
                 
-                source_image_path = self._download_image(image_download_code)
+                source_image_path = await self._download_image_async(image_download_code, deadline)
                 if not source_image_path:
-                    self.reply_text(MSG_IMAGE_SOURCE_DOWNLOAD_FAILED, message)
+                    await self.reply_text_async(MSG_IMAGE_SOURCE_DOWNLOAD_FAILED, message, deadline)
                     return
                 
-                result = image_generator.generate_image_to_image(prompt, source_image_path)
+                with disk_janitor.pinned(source_image_path):
+                    result = await image_generator.generate_image_to_image_async(
+                        prompt, source_image_path, deadline=deadline
+                    )
             
             # 解包结果: (图片路径, 模型信息)
             if result:
@@ -464,6 +519,7 @@ class MyCallbackHandler(ChatbotHandler):
             # 发送生成的图片
             if generated_image_path:
                 logger.info(f"图片生成成功,准备发送: {generated_image_path}, 模型: {model_info}")
+                await asyncio.to_thread(self._prepare_generated_image, generated_image_path)
                 
                 # 获取图片文件名
                 filename = os.path.basename(generated_image_path)
@@ -483,12 +539,13 @@ class MyCallbackHandler(ChatbotHandler):
                 logger.info(f"准备发送图片 [会话类型: {'群聊' if is_group_chat else '单聊'}]")
                 
                 # 单聊和群聊都使用图文消息(FeedCard)
-                self.reply_feed_card(
+                await self.reply_feed_card_async(
                     title=card_title,
                     text="点击查看大图",
                     image_url=image_url,
                     link_url=image_url,
-                    incoming_message=message
+                    incoming_message=message,
+                    deadline=deadline
                 )
                 logger.info("已通过图文消息发送图片")
             else:
@@ -502,96 +559,143 @@ class MyCallbackHandler(ChatbotHandler):
             # 只在明确的错误情况下回复用户
             # 超时错误不回复,避免重复消息
 
-    def _process_message_sync(self, message: ChatbotMessage) -> str:
+    def _process_message_sync(self, message: ChatbotMessage, deadline: Deadline = None) -> str:
         """同步处理消息 - 在线程池中执行"""
         try:
-            msg_type = message.message_type
-            logger.info(f"消息类型: {msg_type}")
-
-            if msg_type == "text":
-                # 纯文字消息
-                text_content = message.text.content if message.text else ""
-                logger.info(f"处理纯文字消息: {text_content[:50]}...")
-                return codebuddy_client.chat_text_only(text_content)
-
-            elif msg_type == "picture":
-                # 纯图片消息
-                if message.image_content:
-                    download_code = message.image_content.download_code
-                    logger.info(f"处理纯图片消息: download_code={download_code}")
-                    local_path = self._download_image(download_code)
-                    if local_path:
-                        return codebuddy_client.chat_image_only(local_path)
-                    else:
-                        return MSG_IMAGE_DOWNLOAD_FAILED
+            image_paths = self._download_images(self._extract_image_codes(message), deadline)
+            return self._chat_message(message, image_paths, deadline)
+        except Exception as e:
+            logger.error(f"处理消息异常: {e}", exc_info=True)
+            return MSG_GENERAL_ERROR
+
+    async def _process_message_async(self, message: ChatbotMessage, deadline: Deadline = None) -> str:
+        """处理消息（协程版本）：图片由事件循环并发下载，只有 CodeBuddy 调用在线程池中执行"""
+        try:
+            image_paths = await self._download_images_async(self._extract_image_codes(message), deadline)
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(None, self._chat_message, message, image_paths, deadline)
+        except Exception as e:
+            logger.error(f"处理消息异常: {e}", exc_info=True)
+            return MSG_GENERAL_ERROR
+
+    def _chat_message(self, message: ChatbotMessage, image_paths: list, deadline: Deadline = None) -> str:
+        """
+        将消息与已下载的图片交给 CodeBuddy
+
+        Args:
+            message: 消息对象
+            image_paths: 消息中已下载成功的图片路径
+            deadline: 消息处理截止时间(可选)
+        """
+        msg_type = message.message_type
+        logger.info(f"消息类型: {msg_type}")
+
+        if msg_type == "text":
+            # 纯文字消息
+            text_content = message.text.content if message.text else ""
+            logger.info(f"处理纯文字消息: {text_content[:50]}...")
+            return codebuddy_client.chat_text_only(text_content, conversation_id=message.conversation_id, deadline=deadline)
+
+        elif msg_type == "picture":
+            # 纯图片消息
+            if not message.image_content:
                 return MSG_IMAGE_CONTENT_UNAVAILABLE
+            logger.info(f"处理纯图片消息: download_code={message.image_content.download_code}")
+            if not image_paths:
+                return MSG_IMAGE_DOWNLOAD_FAILED
+            local_path = image_preprocessor.prepare(image_paths[0], keep_original=False)
+            with disk_janitor.pinned(local_path):
+                return codebuddy_client.chat_image_only(local_path, conversation_id=message.conversation_id, deadline=deadline)
+
+        elif msg_type == "richText":
+            # 富文本消息（文字+图片，可能包含多张图片），所有图片一次调用传给后端
+            content = self._extract_text_from_message(message).strip()
+            has_images = bool(self._extract_image_codes(message))
+            logger.info(f"处理富文本消息: text={content[:50]}..., images={len(image_paths)}")
+
+            if image_paths:
+                image_paths = image_preprocessor.prepare_all(image_paths, IMAGE_DOWNLOAD_CONCURRENCY, keep_original=False)
+                with disk_janitor.pinned(*image_paths):
+                    return codebuddy_client.chat_with_images(content, image_paths, conversation_id=message.conversation_id, deadline=deadline)
+            elif has_images:
+                return MSG_IMAGE_DOWNLOAD_FAILED
+            elif content:
+                return codebuddy_client.chat_text_only(content, conversation_id=message.conversation_id, deadline=deadline)
+
+            return MSG_PROCESS_ERROR
 
-            elif msg_type == "richText":
-                # 富文本消息（文字+图片）
-                content = ""
-                image_download_code = None
-
-                if hasattr(message, 'rich_text_content') and message.rich_text_content:
-                    rich_text_list = message.rich_text_content.rich_text_list if hasattr(message.rich_text_content, 'rich_text_list') else []
-                    logger.info(f"rich_text_list: {rich_text_list}")
-                    for item in rich_text_list:
-                        # item是字典不是对象
-                        if isinstance(item, dict):
-                            if 'text' in item:
-                                content += item['text'].get('content', '') if isinstance(item['text'], dict) else str(item['text'])
-                            if 'downloadCode' in item:
-                                image_download_code = item['downloadCode']
-
-                if not content and hasattr(message, 'image_content') and message.image_content:
-                    image_download_code = message.image_content.download_code
-
-                content = content.strip()
-                logger.info(f"处理富文本消息: text={content[:50]}..., image_code={image_download_code}")
-
-                if content and image_download_code:
-                    local_path = self._download_image(image_download_code)
-                    if local_path:
-                        return codebuddy_client.chat_with_image(content, local_path)
-                    else:
-                        return MSG_IMAGE_DOWNLOAD_FAILED
-                elif image_download_code:
-                    local_path = self._download_image(image_download_code)
-                    if local_path:
-                        return codebuddy_client.chat_image_only(local_path)
-                    else:
-                        return MSG_IMAGE_DOWNLOAD_FAILED
-                elif content:
-                    return codebuddy_client.chat_text_only(content)
+        else:
+            logger.warning(f"未知消息类型: {msg_type}")
+            return MSG_UNSUPPORTED_MSG_TYPE
 
-                return MSG_PROCESS_ERROR
+    @staticmethod
+    def _extract_image_codes(message: ChatbotMessage) -> list:
+        """提取消息中所有图片的下载码（按出现顺序去重）"""
+        codes = []
+        if message.message_type == "picture" and message.image_content:
+            codes.append(message.image_content.download_code)
+        elif message.message_type == "richText" and getattr(message, 'rich_text_content', None):
+            rich_text_list = getattr(message.rich_text_content, 'rich_text_list', None) or []
+            for item in rich_text_list:
+                # item是字典不是对象
+                if isinstance(item, dict) and item.get('downloadCode'):
+                    codes.append(item['downloadCode'])
+            if not codes and getattr(message, 'image_content', None):
+                codes.append(message.image_content.download_code)
+        return list(dict.fromkeys(code for code in codes if code))
+
+    def _download_images(self, download_codes: list, deadline: Deadline = None) -> list:
+        """
+        并发下载多张图片（单条消息内并发数不超过 IMAGE_DOWNLOAD_CONCURRENCY）
 
-            else:
-                logger.warning(f"未知消息类型: {msg_type}")
-                return MSG_UNSUPPORTED_MSG_TYPE
+        Returns:
+            下载成功的本地路径列表（保持原顺序，跳过失败的图片）
+        """
+        if len(download_codes) <= 1:
+            paths = [self._download_image(code, deadline) for code in download_codes]
+        else:
+            workers = min(IMAGE_DOWNLOAD_CONCURRENCY, len(download_codes))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-download") as pool:
+                paths = list(pool.map(lambda code: self._download_image(code, deadline), download_codes))
+        failed = sum(1 for path in paths if not path)
+        if failed:
+            logger.warning(f"{len(download_codes)} 张图片中有 {failed} 张下载失败")
+        return [path for path in paths if path]
 
-        except Exception as e:
-            logger.error(f"处理消息异常: {e}", exc_info=True)
-            return MSG_GENERAL_ERROR
+    @staticmethod
+    def _message_file_request(download_code: str, access_token: str):
+        """构建获取图片下载链接的请求头与请求体（钉钉图片下载接口，参考SDK实现）"""
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "*/*",
+            "x-acs-dingtalk-access-token": access_token,
+        }
+        payload = {
+            "robotCode": DINGTALK_CLIENT_ID,
+            "downloadCode": download_code
+        }
+        return headers, payload
 
-    def _download_image(self, download_code: str) -> str:
+    def _download_image(self, download_code: str, deadline: Deadline = None) -> str:
         """下载图片到本地"""
         try:
-            # 复用 dingtalk_sender 的 token 缓存（线程安全）
-            access_token = dingtalk_sender._get_access_token()
-
-            # 使用正确的钉钉图片下载接口 - 参考SDK实现
-            headers = {
-                "Content-Type": "application/json",
-                "Accept": "*/*",
-                "x-acs-dingtalk-access-token": access_token,
-            }
-            payload = {
-                "robotCode": DINGTALK_CLIENT_ID,
-                "downloadCode": download_code
-            }
-            image_url = "https://api.dingtalk.com/v1.0/robot/messageFiles/download"
+            # 同一 downloadCode 已下载过时直接复用，不再获取下载链接和下载
+            cached_path = image_cache.get(download_code)
+            if cached_path:
+                return cached_path
 
-            resp = http_client.dingtalk_session.post(image_url, headers=headers, json=payload, timeout=30)
+            # 复用 dingtalk_sender 的 token 缓存（线程安全）
+            access_token = dingtalk_sender._get_access_token(deadline)
+            headers, payload = self._message_file_request(download_code, access_token)
+
+            resp = call_with_throttle_retry(
+                openapi_limiter, MESSAGE_FILE_DOWNLOAD_URL,
+                lambda: http_client.dingtalk_session.post(
+                    MESSAGE_FILE_DOWNLOAD_URL, headers=headers, json=payload,
+                    timeout=timeout_for(deadline, 30, "获取图片下载链接")
+                ),
+                "获取图片下载链接", deadline
+            )
             logger.info(f"图片下载响应: status={resp.status_code}, text={resp.text[:200]}")
 
             if resp.status_code == 200:
@@ -601,41 +705,24 @@ class MyCallbackHandler(ChatbotHandler):
                     logger.info(f"获取到下载链接: {download_url}")
 
                     if download_url:
-                        # 使用下载链接获取图片 - 增加超时时间和重试
-                        max_retries = 3
-                        for attempt in range(max_retries):
-                            try:
-                                logger.info(f"开始下载图片 (尝试 {attempt + 1}/{max_retries}): {download_url[:100]}...")
-                                img_resp = http_client.download_session.get(download_url, timeout=120, stream=True)
-                                if img_resp.status_code == 200:
-                                    filename = f"{uuid.uuid4().hex}.jpg"
-                                    local_path = image_manager.get_image_path(filename)
-                                    
-                                    # 分块写入,避免内存占用过大
-                                    with open(local_path, 'wb') as f:
-                                        for chunk in img_resp.iter_content(chunk_size=8192):
-                                            if chunk:
-                                                f.write(chunk)
-                                    
-                                    logger.info(f"图片下载成功: {local_path}")
-                                    return local_path
-                                else:
-                                    logger.warning(f"图片下载失败: HTTP {img_resp.status_code}")
-                                    if attempt < max_retries - 1:
-                                        time.sleep(2)  # 重试前等待2秒
-                                        continue
-                            except requests.exceptions.Timeout:
-                                logger.warning(f"图片下载超时 (尝试 {attempt + 1}/{max_retries})")
-                                if attempt < max_retries - 1:
-                                    time.sleep(2)
-                                    continue
-                                else:
-                                    logger.error("图片下载失败: 多次超时")
-                            except Exception as e:
-                                logger.error(f"图片下载异常 (尝试 {attempt + 1}/{max_retries}): {e}")
-                                if attempt < max_retries - 1:
-                                    time.sleep(2)
-                                    continue
+                        # 重试由 download_session 完成（受全局重试预算约束），这里不再叠加重试循环
+                        try:
+                            logger.info(f"开始下载图片: {download_url[:100]}...")
+                            # 流式写入临时文件，限制大小、边下载边计算哈希并识别格式，按内容哈希保存
+                            result = download_file(
+                                download_url, IMAGE_DIR, timeout=120, deadline=deadline,
+                                finalize=lambda tmp_path, r: image_cache.put(download_code, tmp_path, r.sha256, r.ext)
+                            )
+                            logger.info(f"图片下载成功: {result.path}")
+                            return result.path
+                        except requests.exceptions.Timeout:
+                            logger.error("图片下载超时")
+                        except DeadlineExceeded:
+                            raise
+                        except Exception as e:
+                            logger.error(f"图片下载异常: {e}")
+                except DeadlineExceeded:
+                    raise
                 except Exception as e:
                     logger.error(f"解析下载响应失败: {e}")
 
@@ -646,46 +733,138 @@ class MyCallbackHandler(ChatbotHandler):
             logger.error(f"下载图片失败: {e}", exc_info=True)
             return None
 
-    def reply_text(self, text: str, incoming_message: ChatbotMessage):
-        """发送文本消息 - 覆盖父类方法确保UTF-8编码"""
+    async def _download_images_async(self, download_codes: list, deadline: Deadline = None) -> list:
+        """
+        并发下载多张图片（协程版本），单条消息内并发数不超过 IMAGE_DOWNLOAD_CONCURRENCY
+
+        Returns:
+            下载成功的本地路径列表（保持原顺序，跳过失败的图片）
+        """
+        semaphore = asyncio.Semaphore(IMAGE_DOWNLOAD_CONCURRENCY)
+
+        async def download(code):
+            async with semaphore:
+                return await self._download_image_async(code, deadline)
+
+        paths = await asyncio.gather(*(download(code) for code in download_codes))
+        failed = sum(1 for path in paths if not path)
+        if failed:
+            logger.warning(f"{len(download_codes)} 张图片中有 {failed} 张下载失败")
+        return [path for path in paths if path]
+
+    async def _download_image_async(self, download_code: str, deadline: Deadline = None) -> str:
+        """下载图片到本地（协程版本），参数同 _download_image"""
+        try:
+            cached_path = image_cache.get(download_code)
+            if cached_path:
+                return cached_path
+
+            access_token = await dingtalk_sender._get_access_token_async(deadline)
+            headers, payload = self._message_file_request(download_code, access_token)
+
+            resp = await call_with_throttle_retry_async(
+                openapi_limiter, MESSAGE_FILE_DOWNLOAD_URL,
+                lambda: async_http_client.post(
+                    MESSAGE_FILE_DOWNLOAD_URL, headers=headers, json=payload,
+                    timeout=timeout_for(deadline, 30, "获取图片下载链接")
+                ),
+                "获取图片下载链接", deadline
+            )
+            logger.info(f"图片下载响应: status={resp.status_code}, text={resp.text[:200]}")
+            if resp.status_code != 200:
+                logger.error(f"图片下载失败: HTTP {resp.status_code}")
+                return None
+
+            download_url = resp.json().get("downloadUrl")
+            logger.info(f"获取到下载链接: {download_url}")
+            if not download_url:
+                logger.error("图片下载失败: 响应中没有下载链接")
+                return None
+
+            # 重试由 async_http_client 的 download 策略完成（受全局重试预算约束）
+            logger.info(f"开始下载图片: {download_url[:100]}...")
+            result = await download_file_async(
+                download_url, IMAGE_DIR, timeout=120, deadline=deadline,
+                finalize=lambda tmp_path, r: image_cache.put(download_code, tmp_path, r.sha256, r.ext)
+            )
+            logger.info(f"图片下载成功: {result.path}")
+            return result.path
+
+        except Exception as e:
+            logger.error(f"下载图片失败: {e}", exc_info=True)
+            return None
+
+    @staticmethod
+    def _at_sender(incoming_message: ChatbotMessage) -> dict:
+        """构建 @ 发送者字段"""
+        return {'atUserIds': [incoming_message.sender_staff_id] if incoming_message.sender_staff_id else []}
+
+    def _build_text_payload(self, text: str, incoming_message: ChatbotMessage) -> dict:
+        """构建文本消息 payload"""
         if isinstance(text, bytes):
             text = text.decode('utf-8')
         logger.info(f"准备发送消息，长度: {len(text)} 字符")
-        payload = {
+        return {
             'msgtype': 'text',
             'text': {'content': text},
-            'at': {'atUserIds': [incoming_message.sender_staff_id] if incoming_message.sender_staff_id else []}
+            'at': self._at_sender(incoming_message)
         }
-        return self._send_webhook_message(incoming_message.session_webhook, payload, "文本消息")
 
-    def reply_markdown(self, title: str, text: str, incoming_message: ChatbotMessage):
-        """发送 Markdown 消息"""
+    def _build_markdown_payload(self, title: str, text: str, incoming_message: ChatbotMessage) -> dict:
+        """构建 Markdown 消息 payload"""
         if isinstance(text, bytes):
             text = text.decode('utf-8')
         if isinstance(title, bytes):
             title = title.decode('utf-8')
         logger.info(f"准备发送 Markdown 消息: 标题={title}, 内容长度={len(text)} 字符")
-        payload = {
+        return {
             'msgtype': 'markdown',
             'markdown': {'title': title, 'text': text},
-            'at': {'atUserIds': [incoming_message.sender_staff_id] if incoming_message.sender_staff_id else []}
+            'at': self._at_sender(incoming_message)
         }
-        return self._send_webhook_message(incoming_message.session_webhook, payload, "Markdown 消息")
+
+    @staticmethod
+    def _build_feed_card_payload(title: str, image_url: str, link_url: str) -> dict:
+        """构建图文消息(FeedCard) payload，预览图使用缩略图，点击打开原图"""
+        logger.info(f"准备发送图文消息(FeedCard): 标题={title}, 图片={image_url}")
+        return {
+            'msgtype': 'feedCard',
+            'feedCard': {
+                'links': [{'title': title, 'messageURL': link_url, 'picURL': thumbnail_url(image_url)}]
+            }
+        }
+
+    def reply_text(self, text: str, incoming_message: ChatbotMessage, deadline: Deadline = None):
+        """发送文本消息 - 覆盖父类方法确保UTF-8编码"""
+        payload = self._build_text_payload(text, incoming_message)
+        return self._deliver(DeliveryTarget.from_message(incoming_message), payload, "文本消息", deadline)
+
+    def reply_markdown(self, title: str, text: str, incoming_message: ChatbotMessage, deadline: Deadline = None):
+        """发送 Markdown 消息"""
+        payload = self._build_markdown_payload(title, text, incoming_message)
+        return self._deliver(DeliveryTarget.from_message(incoming_message), payload, "Markdown 消息", deadline)
     
-    def reply_link_card(self, title: str, text: str, image_url: str, link_url: str, incoming_message: ChatbotMessage):
-        """发送链接卡片消息 - 支持图片预览"""
+    @staticmethod
+    def _build_link_card_payload(title: str, text: str, image_url: str, link_url: str) -> dict:
+        """构建链接卡片 payload，预览图使用缩略图，点击打开原图"""
         if isinstance(text, bytes):
             text = text.decode('utf-8')
         if isinstance(title, bytes):
             title = title.decode('utf-8')
         logger.info(f"准备发送链接卡片: 标题={title}, 图片={image_url}")
-        payload = {
+        return {
             'msgtype': 'link',
-            'link': {'title': title, 'text': text, 'messageUrl': link_url, 'picUrl': image_url}
+            'link': {'title': title, 'text': text, 'messageUrl': link_url, 'picUrl': thumbnail_url(image_url)}
         }
-        return self._send_webhook_message(incoming_message.session_webhook, payload, "链接卡片")
 
-    def reply_action_card(self, title: str, text: str, image_url: str, btn_text: str, btn_url: str, incoming_message: ChatbotMessage):
+    def reply_link_card(self, title: str, text: str, image_url: str, link_url: str, incoming_message: ChatbotMessage,
+                        deadline: Deadline = None):
+        """发送链接卡片消息 - 支持图片预览（预览图使用缩略图，点击打开原图）"""
+        payload = self._build_link_card_payload(title, text, image_url, link_url)
+        return self._deliver(DeliveryTarget.from_message(incoming_message), payload, "链接卡片", deadline)
+
+    def reply_action_card(self, title: str, text: str, image_url: str, btn_text: str, btn_url: str,
+                          incoming_message: ChatbotMessage, deadline: Deadline = None):
         """发送交互式卡片消息 - 支持嵌入图片且不显示URL"""
         logger.info(f"准备发送交互式卡片: 标题={title}, 图片={image_url}")
         full_text = f"{text}\n\n![图片]({image_url})"
@@ -696,20 +875,79 @@ class MyCallbackHandler(ChatbotHandler):
                 'btnOrientation': '0', 'singleTitle': btn_text, 'singleURL': btn_url
             }
         }
-        return self._send_webhook_message(incoming_message.session_webhook, payload, "交互式卡片")
+        return self._deliver(DeliveryTarget.from_message(incoming_message), payload, "交互式卡片", deadline)
 
-    def reply_feed_card(self, title: str, text: str, image_url: str, link_url: str, incoming_message: ChatbotMessage):
+    def reply_feed_card(self, title: str, text: str, image_url: str, link_url: str, incoming_message: ChatbotMessage,
+                        deadline: Deadline = None):
         """发送图文消息(FeedCard) - 单聊和群聊都支持"""
-        logger.info(f"准备发送图文消息(FeedCard): 标题={title}, 图片={image_url}")
-        payload = {
-            'msgtype': 'feedCard',
-            'feedCard': {
-                'links': [{'title': title, 'messageURL': link_url, 'picURL': image_url}]
-            }
-        }
-        return self._send_webhook_message(incoming_message.session_webhook, payload, "图文消息")
+        payload = self._build_feed_card_payload(title, image_url, link_url)
+        return self._deliver(DeliveryTarget.from_message(incoming_message), payload, "图文消息", deadline)
+
+    async def reply_text_async(self, text: str, incoming_message: ChatbotMessage, deadline: Deadline = None):
+        """发送文本消息（协程版本）"""
+        payload = self._build_text_payload(text, incoming_message)
+        return await self._deliver_async(DeliveryTarget.from_message(incoming_message), payload, "文本消息", deadline)
+
+    async def reply_markdown_async(self, title: str, text: str, incoming_message: ChatbotMessage,
+                                   deadline: Deadline = None):
+        """发送 Markdown 消息（协程版本）"""
+        payload = self._build_markdown_payload(title, text, incoming_message)
+        return await self._deliver_async(
+            DeliveryTarget.from_message(incoming_message), payload, "Markdown 消息", deadline
+        )
+
+    async def reply_feed_card_async(self, title: str, text: str, image_url: str, link_url: str,
+                                    incoming_message: ChatbotMessage, deadline: Deadline = None):
+        """发送图文消息(FeedCard)（协程版本）"""
+        payload = self._build_feed_card_payload(title, image_url, link_url)
+        return await self._deliver_async(DeliveryTarget.from_message(incoming_message), payload, "图文消息", deadline)
+
+    async def reply_link_card_async(self, title: str, text: str, image_url: str, link_url: str,
+                                    incoming_message: ChatbotMessage, deadline: Deadline = None):
+        """发送链接卡片消息（协程版本）"""
+        payload = self._build_link_card_payload(title, text, image_url, link_url)
+        return await self._deliver_async(DeliveryTarget.from_message(incoming_message), payload, "链接卡片", deadline)
 
-    def _send_webhook_message(self, webhook_url: str, payload: dict, msg_type_label: str):
+    WEBHOOK_HEADERS = {
+        'Content-Type': 'application/json; charset=utf-8',
+        'Accept': '*/*',
+    }
+
+    @staticmethod
+    def _check_webhook_errcode(response):
+        """webhook 以 HTTP 200 + errcode 返回业务错误（包括限流重试后仍失败），转为异常"""
+        try:
+            body = response.json()
+        except ValueError:
+            return
+        if isinstance(body, dict) and body.get("errcode", 0) != 0:
+            raise RuntimeError(f"errcode={body.get('errcode')}, errmsg={body.get('errmsg')}")
+
+    def _deliver(self, target: DeliveryTarget, payload: dict, msg_type_label: str, deadline: Deadline = None):
+        """
+        投递消息：webhook 有效时经 webhook 发送，过期后改走 OpenAPI
+        
+        Args:
+            target: 投递目标
+            payload: webhook 消息 payload
+            msg_type_label: 消息类型标签（用于日志）
+            deadline: 消息处理截止时间(可选)
+        
+        Returns:
+            webhook 响应 JSON，或 OpenAPI 是否发送成功；失败返回 None/False
+        """
+        if delivery_router.route(target) == ROUTE_WEBHOOK:
+            return self._send_webhook_message(target.webhook_url, payload, msg_type_label, deadline)
+        return delivery_router.send_openapi(target, payload, deadline)
+
+    async def _deliver_async(self, target: DeliveryTarget, payload: dict, msg_type_label: str,
+                             deadline: Deadline = None):
+        """投递消息（协程版本），参数同 _deliver"""
+        if delivery_router.route(target) == ROUTE_WEBHOOK:
+            return await self._send_webhook_message_async(target.webhook_url, payload, msg_type_label, deadline)
+        return await delivery_router.send_openapi_async(target, payload, deadline)
+
+    def _send_webhook_message(self, webhook_url: str, payload: dict, msg_type_label: str, deadline: Deadline = None):
         """
         公共 webhook 消息发送方法
         
@@ -717,100 +955,199 @@ class MyCallbackHandler(ChatbotHandler):
             webhook_url: Session webhook URL
             payload: 消息 payload 字典
             msg_type_label: 消息类型标签（用于日志）
+            deadline: 消息处理截止时间(可选)，预算耗尽后放弃发送
         
         Returns:
             响应 JSON 或 None
         """
-        headers = {
-            'Content-Type': 'application/json; charset=utf-8',
-            'Accept': '*/*',
-        }
         response = None
         try:
-            response = http_client.dingtalk_session.post(
-                webhook_url,
-                headers=headers,
-                data=json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            response = call_with_throttle_retry(
+                webhook_limiter, webhook_url,
+                lambda: http_client.dingtalk_session.post(
+                    webhook_url,
+                    headers=self.WEBHOOK_HEADERS,
+                    data=data,
+                    timeout=timeout_for(deadline, 10, msg_type_label)
+                ),
+                msg_type_label, deadline
             )
             response.raise_for_status()
+            self._check_webhook_errcode(response)
             logger.info(f"{msg_type_label}发送成功，钉钉响应: {response.text}")
         except Exception as e:
             logger.error(f"{msg_type_label}发送失败: {e}, response={response.text if response else 'None'}")
             return None
         return response.json() if response.text else None
 
-    def _send_long_text(self, content: str, message: ChatbotMessage):
-        """发送长文本消息 - 支持 Markdown 格式"""
+    async def _send_webhook_message_async(self, webhook_url: str, payload: dict, msg_type_label: str,
+                                          deadline: Deadline = None):
+        """公共 webhook 消息发送方法（协程版本），参数同 _send_webhook_message"""
+        response = None
+        try:
+            data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            response = await call_with_throttle_retry_async(
+                webhook_limiter, webhook_url,
+                lambda: async_http_client.post(
+                    webhook_url,
+                    headers=self.WEBHOOK_HEADERS,
+                    data=data,
+                    timeout=timeout_for(deadline, 10, msg_type_label)
+                ),
+                msg_type_label, deadline
+            )
+            response.raise_for_status()
+            self._check_webhook_errcode(response)
+            logger.info(f"{msg_type_label}发送成功，钉钉响应: {response.text}")
+        except Exception as e:
+            logger.error(f"{msg_type_label}发送失败: {e}, response={response.text if response else 'None'}")
+            return None
+        return response.json() if response.content else None
+
+    async def _create_progress_card(self, message: ChatbotMessage, deadline: Deadline = None):
+        """
+        投放进度卡片
+
+        Returns:
+            InteractiveCard，未配置模板或投放失败时返回 None（回退到普通消息）
+        """
+        if not CARD_TEMPLATE_ID:
+            logger.warning("已启用互动卡片回复但未配置 CARD_TEMPLATE_ID，使用普通消息")
+            return None
+        card = InteractiveCard(DeliveryTarget.from_message(message), title="处理中")
+        loop = asyncio.get_event_loop()
+        created = await loop.run_in_executor(None, card.create, INITIAL_REPLY, deadline)
+        return card if created else None
+
+    async def _card_progress(self, card: InteractiveCard, deadline: Deadline = None):
+        """
+        处理期间定期更新卡片进度
+
+        后端（CodeBuddy CLI）不返回流式输出，进度内容为已用时间
+        """
+        if CARD_PROGRESS_INTERVAL <= 0:
+            return
+        started = time.monotonic()
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(CARD_PROGRESS_INTERVAL)
+            elapsed = time.monotonic() - started
+            await loop.run_in_executor(
+                None, card.update, f"{INITIAL_REPLY}\n\n已处理 {elapsed:.0f} 秒", STATUS_PROCESSING, deadline
+            )
+
+    def _finish_card(self, card: InteractiveCard, result: str, message: ChatbotMessage, deadline: Deadline = None):
+        """
+        用最终结果原地更新卡片
+
+        超出单条上限的部分在卡片之后按顺序以普通消息补发；卡片更新失败时整体回退到普通消息
+        """
+        if ENABLE_MARKDOWN and markdown_formatter.is_markdown_format(result):
+            title, md_content = markdown_formatter.convert_to_markdown(result, auto_enhance=AUTO_ENHANCE_MARKDOWN)
+        else:
+            title, md_content = markdown_formatter.convert_to_markdown(result, auto_enhance=False)
+        plan = self._plan_markdown(title, md_content)
+        card.title = plan[0][0]
+        if not card.finish(plan[0][1], deadline):
+            logger.warning("互动卡片更新失败，改用普通消息发送结果")
+            self._send_plan(plan, message, deadline)
+            return
+        logger.info(f"互动卡片已更新为最终结果: {card.out_track_id}, 更新 {card.updates} 次")
+        if len(plan) > 1:
+            self._send_plan(plan[1:], message, deadline)
+
+    def _plan_long_text(self, content: str) -> list:
+        """
+        将长文本规划为若干条待发送消息
+
+        Returns:
+            [(title, text)] 列表，title 为 None 表示纯文本消息
+        """
         # 确保content是UTF-8编码的字符串
         if isinstance(content, bytes):
             content = content.decode('utf-8')
 
-        max_length = 20000
-        
         # 检查是否应该使用 Markdown 格式
         use_markdown = ENABLE_MARKDOWN and USE_MARKDOWN_FOR_LONG_TEXT
-        
-        if len(content) <= max_length:
-            if use_markdown and markdown_formatter.is_markdown_format(content):
-                # 使用 Markdown 格式发送
-                title, md_content = markdown_formatter.convert_to_markdown(
-                    content,
-                    auto_enhance=AUTO_ENHANCE_MARKDOWN
-                )
-                self.reply_markdown(title, md_content, message)
-            else:
-                # 使用纯文本发送
-                self.reply_text(content, message)
-        else:
-            # 长文本处理
-            if use_markdown:
-                # Markdown 模式：尝试按逻辑段落分割
-                title, md_content = markdown_formatter.convert_to_markdown(
-                    content,
-                    auto_enhance=AUTO_ENHANCE_MARKDOWN
-                )
-                
-                # 按章节分割（如果有 Markdown 标题）
-                sections = self._split_markdown_by_section(md_content, max_length)
-                for i, section in enumerate(sections):
-                    if i == 0:
-                        self.reply_markdown(title, section, message)
-                    else:
-                        self.reply_markdown(f"{title} (续)", section, message)
+        fits = len(content.encode('utf-8')) <= MAX_MESSAGE_BYTES
+
+        if use_markdown and (not fits or markdown_formatter.is_markdown_format(content)):
+            title, md_content = markdown_formatter.convert_to_markdown(
+                content,
+                auto_enhance=AUTO_ENHANCE_MARKDOWN
+            )
+            return self._plan_markdown(title, md_content)
+        return self._plan_text(content)
+
+    def _plan_text(self, content: str) -> list:
+        """纯文本按字节上限分割，多条时在每条开头编号"""
+        parts = split_message(content, MAX_MESSAGE_BYTES - PART_HEADER_RESERVE)
+        return [(None, f"{label}\n{part}" if label else part) for label, part in number_parts(parts)]
+
+    def _plan_markdown(self, title: str, md_content: str) -> list:
+        """Markdown 优先在标题、段落处分割，代码块跨条时闭合后重开，多条时在标题后编号"""
+        sections = self._split_markdown_by_section(md_content, MAX_MESSAGE_BYTES - PART_HEADER_RESERVE)
+        return [(f"{title} {label}" if label else title, section) for label, section in number_parts(sections)]
+
+    def _plan_payloads(self, plan: list, message: ChatbotMessage):
+        """依次构建各段消息的 (payload, 日志标签)"""
+        for title, text in plan:
+            if title is None:
+                yield self._build_text_payload(text, message), "文本消息"
             else:
-                # 文本模式：按行分割
-                lines = content.split("\n")
-                current_msg = ""
-
-                for line in lines:
-                    if len(current_msg) + len(line) + 1 > max_length:
-                        if current_msg:
-                            self.reply_text(current_msg, message)
-                            current_msg = ""
-                    current_msg += line + "\n"
-
-                if current_msg:
-                    self.reply_text(current_msg, message)
-    
+                yield self._build_markdown_payload(title, text, message), "Markdown 消息"
+
+    def _send_plan(self, plan: list, message: ChatbotMessage, deadline: Deadline = None,
+                   target: DeliveryTarget = None) -> bool:
+        """
+        按顺序发送分段消息
+
+        Args:
+            plan: _plan_* 返回的 [(title, text)]
+            message: 原始消息（用于 @ 发送者）
+            deadline: 消息处理截止时间(可选)
+            target: 投递目标，默认由 message 构建
+
+        Returns:
+            是否全部发送成功
+        """
+        target = target or DeliveryTarget.from_message(message)
+        success = True
+        for payload, label in self._plan_payloads(plan, message):
+            success = bool(self._deliver(target, payload, label, deadline)) and success
+        return success
+
+    async def _send_plan_async(self, plan: list, message: ChatbotMessage, deadline: Deadline = None,
+                               target: DeliveryTarget = None) -> bool:
+        """
+        按顺序发送分段消息（协程版本），参数同 _send_plan
+
+        流水线发送：上一段在途时构建下一段的 payload，上一段完成后才发出下一段，保证顺序
+        """
+        target = target or DeliveryTarget.from_message(message)
+        success = True
+        in_flight = None
+        for payload, label in self._plan_payloads(plan, message):
+            if in_flight is not None:
+                success = bool(await in_flight) and success
+            in_flight = asyncio.ensure_future(self._deliver_async(target, payload, label, deadline))
+        if in_flight is not None:
+            success = bool(await in_flight) and success
+        return success
+
+    def _send_long_text(self, content: str, message: ChatbotMessage, deadline: Deadline = None):
+        """发送长文本消息 - 支持 Markdown 格式"""
+        return self._send_plan(self._plan_long_text(content), message, deadline)
+
+    async def _send_long_text_async(self, content: str, message: ChatbotMessage, deadline: Deadline = None):
+        """发送长文本消息（协程版本）"""
+        return await self._send_plan_async(self._plan_long_text(content), message, deadline)
+
     def _split_markdown_by_section(self, content: str, max_length: int) -> list:
-        """按 Markdown 章节分割内容"""
-        sections = []
-        current_section = ""
-        lines = content.split("\n")
-        
-        for line in lines:
-            # 如果当前段落加上这一行会超过限制，且当前段落不为空
-            if len(current_section) + len(line) + 1 > max_length and current_section:
-                sections.append(current_section)
-                current_section = ""
-            
-            current_section += line + "\n"
-        
-        if current_section:
-            sections.append(current_section)
-        
-        return sections if sections else [content]
-    
+        """按 Markdown 章节分割内容（max_length 为 UTF-8 字节数）"""
+        return split_message(content, max_length)
+
     def _extract_generated_image(self, response_text: str) -> str:
         """
         从CodeBuddy响应中提取生成的图片路径
@@ -836,21 +1173,35 @@ class MyCallbackHandler(ChatbotHandler):
         
         return None
     
-    def _send_generated_image(self, message: ChatbotMessage, image_path: str, original_response: str):
+    def _prepare_generated_image(self, image_path):
         """
-        发送CodeBuddy生成的图片
+        为生成的图片预热图片服务：后台预先编码 WebP/AVIF 版本与卡片缩略图；
+        使用内置图片服务器时同时把原图读入其内存缓存，钉钉首次抓取不再读盘（失败只记录日志）
+        """
+        try:
+            variant_store.prepare_generated(str(image_path))
+            if self.image_server is not None:
+                self.image_server.cache.load(image_path)
+        except Exception as e:
+            logger.warning(f"预热生成的图片失败: {image_path}, {e}")
+    
+    async def _send_generated_image_async(self, message: ChatbotMessage, image_path: str, original_response: str,
+                                          deadline: Deadline = None):
+        """
+        发送CodeBuddy生成的图片（文件复制在线程中执行，回复由事件循环发送）
         
         Args:
             message: 消息对象
             image_path: 生成的图片路径
             original_response: 原始响应文本
+            deadline: 消息处理截止时间(可选)
         """
         try:
             # 检查图片是否存在
             if not os.path.exists(image_path):
                 logger.warning(f"图片文件不存在: {image_path}")
                 # 发送原始响应
-                self.reply_text(original_response, message)
+                await self.reply_text_async(original_response, message, deadline)
                 return
             
             # 复制图片到 imagegen 目录
@@ -862,8 +1213,9 @@ class MyCallbackHandler(ChatbotHandler):
             new_filename = f"codebuddy-generated_{uuid.uuid4().hex[:16]}{file_ext}"
             target_path = imagegen_dir / new_filename
             
-            shutil.copy2(image_path, target_path)
+            await asyncio.to_thread(shutil.copy2, image_path, target_path)
             logger.info(f"图片已复制到: {target_path}")
+            await asyncio.to_thread(self._prepare_generated_image, target_path)
             
             # 构建图片 URL
             image_url = f"{IMAGE_SERVER_URL}/{new_filename}"
@@ -884,19 +1236,20 @@ class MyCallbackHandler(ChatbotHandler):
             card_title = "🎨 图片生成完成!"
             card_text = f"{description}\n图片保存在:\n图片信息:\n• 文件大小: {file_size:.1f} KB\n• 访问链接: {new_filename}\n提示: 点击图片可查看大图"
             
-            self.reply_link_card(
+            await self.reply_link_card_async(
                 title=card_title,
                 text=card_text,
                 image_url=image_url,
                 link_url=image_url,
-                incoming_message=message
+                incoming_message=message,
+                deadline=deadline
             )
             logger.info(f"已通过链接卡片发送生成的图片: {image_url}")
             
         except Exception as e:
             logger.error(f"发送生成的图片失败: {e}", exc_info=True)
             # 出错时发送原始响应
-            self.reply_text(original_response, message)
+            await self.reply_text_async(original_response, message, deadline)
 
 
 async def main():
@@ -920,6 +1273,23 @@ async def main():
     logger.info(f"Client ID: {DINGTALK_CLIENT_ID[:10]}...")
     logger.info(f"App ID: {DINGTALK_APP_ID}")
 
+    # 工作线程数与 HTTP 连接池大小保持一致，避免线程争抢连接
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=WORKER_CONCURRENCY, thread_name_prefix="bot-worker")
+    )
+    logger.info(f"工作线程数: {WORKER_CONCURRENCY}")
+
+    # 预热 access_token 与上游长连接，避免第一条消息承担握手开销
+    if ENABLE_WARMUP:
+        await warm_up()
+    keep_warm_task = None
+    if WARMUP_KEEPALIVE_INTERVAL > 0:
+        keep_warm_task = asyncio.create_task(keep_warm(WARMUP_KEEPALIVE_INTERVAL))
+
+    # 后台磁盘清理；被清理的收到图片同时从缓存索引中移除
+    disk_janitor.add_listener(image_cache.discard)
+    disk_janitor.start()
+
     # 创建客户端
     credential = Credential(DINGTALK_CLIENT_ID, DINGTALK_CLIENT_SECRET)
     client = DingTalkStreamClient(credential)
@@ -928,11 +1298,25 @@ async def main():
     handler = MyCallbackHandler()
     client.register_callback_handler(ChatbotMessage.TOPIC, handler)
 
+    # 内置图片服务器：与 Stream 客户端共用事件循环，省去单独的 image-server 进程
+    image_server = None
+    if EMBED_IMAGE_SERVER:
+        image_server = ImageServer()
+        try:
+            await image_server.start(port=IMAGE_SERVER_PORT)
+            handler.image_server = image_server
+        except OSError as e:
+            logger.error(f"内置图片服务器启动失败（端口 {IMAGE_SERVER_PORT} 是否已被 image-server 占用?）: {e}")
+            await image_server.stop()
+            image_server = None
+
     # 信号处理 - 优雅退出
     def signal_handler(signum, frame):
         sig_name = signal.Signals(signum).name
         logger.info(f"收到 {sig_name} 信号，等待后台任务完成...")
         handler.shutdown(timeout=30)
+        disk_janitor.stop()
+        variant_store.close()
         http_client.close()
         logger.info("清理完成，退出")
         sys.exit(0)
@@ -946,8 +1330,15 @@ async def main():
         await client.start()
     except KeyboardInterrupt:
         logger.info("收到中断信号，正在停止...")
+        if keep_warm_task:
+            keep_warm_task.cancel()
         handler.shutdown(timeout=30)
+        if image_server:
+            await image_server.stop()
+        disk_janitor.stop()
+        variant_store.close()
         http_client.close()
+        await async_http_client.close()
     except Exception as e:
         logger.error(f"运行异常: {e}")
         raise
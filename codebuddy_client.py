@@ -4,10 +4,16 @@ CodeBuddy API 客户端
 """
 import json
 import logging
+import threading
+import uuid
 import requests
-from typing import Optional, Dict, Any
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional, Dict, Any, List
 
 from http_client import http_client
+from deadline import Deadline, DeadlineExceeded, timeout_for
+from retry_budget import retry_budgets, LogicalRequest
 
 from config import (
     CODEBUDDY_API_URL, 
@@ -18,11 +24,25 @@ from config import (
     CODEBUDDY_MODEL,
     CODEBUDDY_CONTINUE,
     CODEBUDDY_PRINT,
-    CODEBUDDY_SKIP_PERMISSIONS
+    CODEBUDDY_SKIP_PERMISSIONS,
+    CODEBUDDY_SESSION_SCOPE,
+    CODEBUDDY_MAX_SESSIONS
 )
 
 logger = logging.getLogger(__name__)
 
+# 请求超时（含超出处理预算）时返回给用户的提示
+TIMEOUT_REPLY = "请求超时,服务器响应时间过长。已尝试多次重试,请稍后再试或联系管理员检查服务器状态。"
+
+
+@dataclass
+class ConversationSession:
+    """钉钉会话对应的 CodeBuddy 后端会话"""
+    session_id: str
+    started: bool = False  # 后端是否可能已创建该会话（首轮请求发出后置为 True）
+    lock: threading.Lock = field(default_factory=threading.Lock)  # 同一会话内串行，不同会话可并行
+    active: int = 0  # 正在使用该会话的请求数（含等待锁的请求），大于 0 时不会被淘汰
+
 
 class CodebuddyClient:
     """CodeBuddy API 客户端"""
@@ -36,14 +56,67 @@ class CodebuddyClient:
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.api_token}"
         }
+        # 钉钉 conversation_id -> 后端会话，使用 OrderedDict 实现 LRU
+        self._sessions: "OrderedDict[str, ConversationSession]" = OrderedDict()
+        self._sessions_lock = threading.Lock()
+        self.max_sessions = CODEBUDDY_MAX_SESSIONS
 
-    def _build_payload(self, prompt: str, image_path: str = None) -> Dict[str, Any]:
+    def _get_session(self, conversation_id: Optional[str]) -> Optional[ConversationSession]:
+        """
+        获取（必要时创建）会话对应的后端会话
+
+        仅在 CODEBUDDY_CONTINUE 开启且作用域为 conversation 时生效，
+        否则返回 None，沿用全局 continue 行为。
+
+        Args:
+            conversation_id: 钉钉会话ID
+
+        Returns:
+            ConversationSession 或 None
+        """
+        if not conversation_id or not CODEBUDDY_CONTINUE or CODEBUDDY_SESSION_SCOPE != "conversation":
+            return None
+
+        with self._sessions_lock:
+            session = self._sessions.get(conversation_id)
+            if session is not None:
+                self._sessions.move_to_end(conversation_id)  # 刷新位置
+                session.active += 1
+                return session
+
+            session = ConversationSession(session_id=str(uuid.uuid4()), active=1)
+            self._sessions[conversation_id] = session
+            logger.info(f"为会话 {conversation_id} 创建后端会话: {session.session_id}")
+            if len(self._sessions) > self.max_sessions:
+                self._evict_idle_sessions()
+            return session
+
+    def _release_session(self, session: ConversationSession):
+        """请求结束，释放 _get_session 返回的会话"""
+        with self._sessions_lock:
+            session.active -= 1
+
+    def _evict_idle_sessions(self):
+        """
+        按最久未使用淘汰会话直到不超过上限（调用方需持有 _sessions_lock）
+
+        正在使用的会话不淘汰，全部在使用时允许暂时超出上限
+        """
+        for conversation_id in list(self._sessions):
+            if len(self._sessions) <= self.max_sessions:
+                break
+            if self._sessions[conversation_id].active == 0:
+                del self._sessions[conversation_id]
+
+    def _build_payload(self, prompt: str, image_path: str = None,
+                       session: Optional[ConversationSession] = None) -> Dict[str, Any]:
         """
         构建请求载荷
 
         Args:
             prompt: 文字提示
             image_path: 图片本地路径（可选）
+            session: 会话对应的后端会话（可选，为空时使用全局 continue）
 
         Returns:
             请求载荷字典
@@ -63,9 +136,17 @@ class CodebuddyClient:
             "print": CODEBUDDY_PRINT,
             "dangerouslySkipPermissions": CODEBUDDY_SKIP_PERMISSIONS,
             "model": CODEBUDDY_MODEL,
-            "continue": CODEBUDDY_CONTINUE
         }
 
+        # 会话隔离：首轮指定 sessionId 创建会话，之后 resume 该会话；否则使用全局 continue
+        if session is not None:
+            if session.started:
+                payload["resume"] = session.session_id
+            else:
+                payload["sessionId"] = session.session_id
+        else:
+            payload["continue"] = CODEBUDDY_CONTINUE
+
         # 添加工作目录（支持多个目录）
         if CODEBUDDY_ADD_DIR:
             # 支持逗号分隔的多个目录
@@ -75,7 +156,8 @@ class CodebuddyClient:
 
         return payload
 
-    def chat(self, text: str, image_path: str = None, retry_count: int = None) -> str:
+    def chat(self, text: str, image_path: str = None, retry_count: int = None,
+             conversation_id: str = None, deadline: Optional[Deadline] = None) -> str:
         """
         发送消息到CodeBuddy并获取回复
 
@@ -83,18 +165,61 @@ class CodebuddyClient:
             text: 文字内容
             image_path: 图片本地路径(可选)
             retry_count: 重试次数(默认使用配置中的值)
+            conversation_id: 钉钉会话ID(可选，用于隔离上下文)
+            deadline: 消息处理截止时间(可选)，每次请求的超时取剩余预算
 
         Returns:
             CodeBuddy的回复内容
         """
         if retry_count is None:
             retry_count = self.retry_count
-            
+
+        session = self._get_session(conversation_id)
+        if session is None:
+            return self._chat_with_retry(text, image_path, retry_count, None, deadline)
+
+        try:
+            # 同一会话内的请求串行执行，避免并发 resume 同一个后端会话
+            lock_timeout = deadline.remaining() if deadline else -1
+            if not session.lock.acquire(timeout=lock_timeout):
+                logger.error(f"等待会话 {conversation_id} 的上一条请求超出时间预算")
+                return TIMEOUT_REPLY
+            try:
+                return self._chat_with_retry(text, image_path, retry_count, session, deadline)
+            finally:
+                session.lock.release()
+        finally:
+            self._release_session(session)
+
+    @staticmethod
+    def _can_wait(deadline: Optional[Deadline], wait_time: float) -> bool:
+        """重试前判断剩余预算是否还够等待并再发起一次请求"""
+        return deadline is None or deadline.remaining() > wait_time
+
+    def _chat_with_retry(self, text: str, image_path: Optional[str], retry_count: int,
+                         session: Optional[ConversationSession],
+                         deadline: Optional[Deadline] = None) -> str:
+        """带重试地调用 CodeBuddy API（重试次数同时受全局重试预算约束）"""
+        with retry_budgets.request(self.api_url) as logical:
+            return self._chat_attempts(text, image_path, retry_count, session, deadline, logical)
+
+    def _chat_attempts(self, text: str, image_path: Optional[str], retry_count: int,
+                       session: Optional[ConversationSession],
+                       deadline: Optional[Deadline], logical: LogicalRequest,
+                       session_fallback: bool = True) -> str:
+        """
+        执行 CodeBuddy API 调用的各次尝试
+
+        session_fallback: 会话请求返回 4xx 时，是否切换 sessionId / resume 再试一次
+        （本地记录的会话状态可能与后端不一致，如首轮超时但后端已创建会话）
+        """
         last_error = None
         
         for attempt in range(retry_count + 1):
             try:
-                payload = self._build_payload(text, image_path)
+                # 预算耗尽时不再发起请求
+                request_timeout = timeout_for(deadline, self.timeout, "CodeBuddy")
+                payload = self._build_payload(text, image_path, session)
 
                 if attempt > 0:
                     logger.info(f"第 {attempt + 1} 次尝试...")
@@ -111,8 +236,10 @@ class CodebuddyClient:
                     self.api_url,
                     headers=self.headers,
                     json=payload,
-                    timeout=self.timeout
+                    timeout=request_timeout
                 )
+                if session is not None:
+                    session.started = True  # 后端已收到请求，之后 resume 该会话
 
                 # 强制使用UTF-8编码解析响应
                 response.encoding = 'utf-8'
@@ -147,17 +274,23 @@ class CodebuddyClient:
                 else:
                     return str(result)
 
+            except DeadlineExceeded as e:
+                logger.error(f"CodeBuddy API 调用放弃: {e}")
+                return TIMEOUT_REPLY
+
             except requests.exceptions.Timeout as e:
                 last_error = e
+                if session is not None and not isinstance(e, requests.exceptions.ConnectTimeout):
+                    session.started = True  # 请求已发出，后端可能已创建会话
                 logger.warning(f"第 {attempt + 1} 次请求超时", exc_info=True)
-                if attempt < retry_count:
+                wait_time = min(2 ** attempt, 10)  # 指数退避: 1s, 2s, 4s, 最大10s
+                if attempt < retry_count and self._can_wait(deadline, wait_time) and logical.retry():
                     import time
-                    wait_time = min(2 ** attempt, 10)  # 指数退避: 1s, 2s, 4s, 最大10s
                     logger.info(f"等待 {wait_time} 秒后重试...")
                     time.sleep(wait_time)
                     continue
                 logger.error(f"CodeBuddy API 请求超时(已重试{retry_count+1}次): {self.api_url}", exc_info=True)
-                return "请求超时,服务器响应时间过长。已尝试多次重试,请稍后再试或联系管理员检查服务器状态。"
+                return TIMEOUT_REPLY
                 
             except requests.exceptions.HTTPError as e:
                 # HTTP错误(包括502, 503, 504, 500)
@@ -167,10 +300,10 @@ class CodebuddyClient:
                 
                 # 对可重试的网关错误和服务器错误进行重试
                 if status_code in [500, 502, 503, 504]:
-                    if attempt < retry_count:
+                    # 根据错误类型调整等待时间
+                    wait_time = {500: 2, 502: 3, 503: 2, 504: 5}.get(status_code, 2)
+                    if attempt < retry_count and self._can_wait(deadline, wait_time) and logical.retry():
                         import time
-                        # 根据错误类型调整等待时间
-                        wait_time = {500: 2, 502: 3, 503: 2, 504: 5}.get(status_code, 2)
                         logger.info(f"等待 {wait_time} 秒后重试...")
                         time.sleep(wait_time)
                         continue
@@ -184,6 +317,13 @@ class CodebuddyClient:
                     }
                     logger.error(f"CodeBuddy API 错误(已重试{retry_count+1}次): HTTP {status_code}, URL: {self.api_url}", exc_info=True)
                     return error_messages.get(status_code, f"服务器错误({status_code}),请稍后再试。")
+                elif session is not None and session_fallback and status_code in (400, 404, 409):
+                    # 会话已存在（重复 sessionId）或不存在（resume 未创建的会话）：切换方式再试一次
+                    session.started = "resume" not in payload
+                    logger.warning(f"后端会话 {session.session_id} 状态不一致(HTTP {status_code})，"
+                                   f"改用 {'resume' if session.started else 'sessionId'} 重试")
+                    return self._chat_attempts(text, image_path, retry_count - attempt, session,
+                                               deadline, logical, session_fallback=False)
                 else:
                     # 其他HTTP错误不重试(如400, 401, 403, 404等)
                     logger.error(f"CodeBuddy API HTTP错误: {status_code} - {str(e)}", exc_info=True)
@@ -192,7 +332,7 @@ class CodebuddyClient:
             except requests.exceptions.RequestException as e:
                 last_error = e
                 logger.warning(f"第 {attempt + 1} 次请求异常: {str(e)}", exc_info=True)
-                if attempt < retry_count:
+                if attempt < retry_count and self._can_wait(deadline, 2) and logical.retry():
                     import time
                     time.sleep(2)
                     continue
@@ -212,45 +352,77 @@ class CodebuddyClient:
             return f"请求失败(已重试 {retry_count} 次): {str(last_error)}"
         return "未知错误"
 
-    def chat_text_only(self, text: str) -> str:
+    def chat_text_only(self, text: str, conversation_id: str = None,
+                       deadline: Optional[Deadline] = None) -> str:
         """
         处理纯文字消息
 
         Args:
             text: 文字内容
+            conversation_id: 钉钉会话ID(可选)
+            deadline: 消息处理截止时间(可选)
 
         Returns:
             CodeBuddy的回复内容
         """
-        return self.chat(text, image_path=None)
+        return self.chat(text, image_path=None, conversation_id=conversation_id, deadline=deadline)
 
-    def chat_with_image(self, text: str, image_path: str) -> str:
+    def chat_with_image(self, text: str, image_path: str, conversation_id: str = None,
+                        deadline: Optional[Deadline] = None) -> str:
         """
         处理文字+图片消息
 
         Args:
             text: 文字内容
             image_path: 图片本地路径
+            conversation_id: 钉钉会话ID(可选)
+            deadline: 消息处理截止时间(可选)
 
         Returns:
             CodeBuddy的回复内容
         """
         # 组合文字和图片路径
         combined_prompt = f"{text} 图片路径：{image_path}"
-        return self.chat(combined_prompt, image_path=None)
+        return self.chat(combined_prompt, image_path=None, conversation_id=conversation_id, deadline=deadline)
 
-    def chat_image_only(self, image_path: str) -> str:
+    def chat_with_images(self, text: str, image_paths: List[str], conversation_id: str = None,
+                         deadline: Optional[Deadline] = None) -> str:
+        """
+        处理文字+多张图片消息，所有图片在一次调用中传给后端
+
+        Args:
+            text: 文字内容(可为空)
+            image_paths: 图片本地路径列表
+            conversation_id: 钉钉会话ID(可选)
+            deadline: 消息处理截止时间(可选)
+
+        Returns:
+            CodeBuddy的回复内容
+        """
+        if len(image_paths) == 1:
+            if text:
+                return self.chat_with_image(text, image_paths[0], conversation_id, deadline)
+            return self.chat_image_only(image_paths[0], conversation_id, deadline)
+        paths = "、".join(image_paths)
+        prompt = f"{text} 图片路径：{paths}" if text else f"分析这些图片：{paths}"
+        logger.info(f"附加 {len(image_paths)} 张图片")
+        return self.chat(prompt, image_path=None, conversation_id=conversation_id, deadline=deadline)
+
+    def chat_image_only(self, image_path: str, conversation_id: str = None,
+                        deadline: Optional[Deadline] = None) -> str:
         """
         处理纯图片消息
 
         Args:
             image_path: 图片本地路径
+            conversation_id: 钉钉会话ID(可选)
+            deadline: 消息处理截止时间(可选)
 
         Returns:
             CodeBuddy的回复内容
         """
         # 纯图片时，只传图片路径，prompt会在_build_payload中处理
-        return self.chat("", image_path=image_path)
+        return self.chat("", image_path=image_path, conversation_id=conversation_id, deadline=deadline)
 
 
 # 创建全局实例
@@ -11,6 +11,12 @@ BASE_DIR = Path(__file__).parent
 # 图片存储目录
 IMAGE_DIR = BASE_DIR / "images"
 
+# 生成图片目录（由图片服务器对外提供）
+IMAGEGEN_DIR = BASE_DIR / "imagegen"
+
+# 缓存目录（media_id、压缩图等可重建的数据）
+CACHE_DIR = BASE_DIR / "cache"
+
 
 def _safe_int(env_var: str, default: int) -> int:
     """安全地将环境变量转换为整数"""
@@ -22,10 +28,54 @@ def _safe_int(env_var: str, default: int) -> int:
         return default
 
 
+def _safe_float(env_var: str, default: float) -> float:
+    """安全地将环境变量转换为浮点数"""
+    value = os.getenv(env_var, str(default))
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        logging.warning(f"环境变量 {env_var}='{value}' 无法转换为浮点数，使用默认值 {default}")
+        return default
+
+
+def _parse_host_sizes(env_var: str) -> dict:
+    """解析 'host:size,host:size' 格式的环境变量为 {host: size}"""
+    result = {}
+    for item in os.getenv(env_var, "").split(","):
+        host, _, size = item.strip().rpartition(":")
+        if not host:
+            continue
+        try:
+            result[host] = int(size)
+        except ValueError:
+            logging.warning(f"环境变量 {env_var} 中的 '{item}' 无法解析，已忽略")
+    return result
+
+
 # 钉钉配置
 DINGTALK_CLIENT_ID = os.getenv("DINGTALK_CLIENT_ID", "")
 DINGTALK_CLIENT_SECRET = os.getenv("DINGTALK_CLIENT_SECRET", "")
 DINGTALK_APP_ID = os.getenv("DINGTALK_APP_ID", "")
+DINGTALK_TOKEN_REFRESH_MARGIN = _safe_int("DINGTALK_TOKEN_REFRESH_MARGIN", 300)  # access token 提前后台刷新的时间(秒)
+MEDIA_CACHE_FILE = CACHE_DIR / "media_ids.json"  # 图片 media_id 缓存文件
+MEDIA_ID_TTL = _safe_int("MEDIA_ID_TTL", 2 * 24 * 3600)  # media_id 缓存有效期(秒)，钉钉临时素材有效期为 3 天
+COMPRESS_WORKERS = _safe_int("COMPRESS_WORKERS", 2)  # 图片压缩进程数
+COMPRESS_MAX_DIMENSION = _safe_int("COMPRESS_MAX_DIMENSION", 2048)  # 发送前压缩的最大边长(像素)
+IMAGE_CACHE_TTL = _safe_int("IMAGE_CACHE_TTL", 7 * 24 * 3600)  # 收到图片的本地缓存有效期(秒)
+IMAGE_CACHE_MAX_MB = _safe_int("IMAGE_CACHE_MAX_MB", 1024)  # 收到图片的本地缓存总大小上限(MB)
+DOWNLOAD_MAX_MB = _safe_int("DOWNLOAD_MAX_MB", 20)  # 单个图片下载的大小上限(MB)，超出时中止下载
+ANALYSIS_MAX_DIMENSION = _safe_int("ANALYSIS_MAX_DIMENSION", 1568)  # 交给 CodeBuddy 分析的图片最大边长(像素)
+ANALYSIS_JPEG_QUALITY = _safe_int("ANALYSIS_JPEG_QUALITY", 85)  # 分析副本的 JPEG 质量
+
+# 磁盘清理配置（按目录配额与保留时间淘汰最久未使用的文件）
+JANITOR_INTERVAL = _safe_int("JANITOR_INTERVAL", 600)  # 清理间隔(秒)，0 表示关闭
+JANITOR_GRACE_SECONDS = _safe_int("JANITOR_GRACE_SECONDS", 300)  # 最近该时间内写入或使用过的文件不清理(秒)
+IMAGE_DIR_QUOTA_MB = _safe_int("IMAGE_DIR_QUOTA_MB", 2048)  # images/ 字节配额(MB)，0 表示不限制
+IMAGE_DIR_MAX_AGE_HOURS = _safe_int("IMAGE_DIR_MAX_AGE_HOURS", 7 * 24)  # images/ 文件最长保留时间(小时)
+IMAGEGEN_DIR_QUOTA_MB = _safe_int("IMAGEGEN_DIR_QUOTA_MB", 5120)  # imagegen/ 字节配额(MB)，0 表示不限制
+IMAGEGEN_DIR_MAX_AGE_HOURS = _safe_int("IMAGEGEN_DIR_MAX_AGE_HOURS", 30 * 24)  # imagegen/ 文件最长保留时间(小时)，过期后卡片中的图片链接失效
+COMPRESSED_DIR_QUOTA_MB = _safe_int("COMPRESSED_DIR_QUOTA_MB", 512)  # cache/compressed/ 压缩结果配额(MB)，0 表示不限制
+COMPRESSED_DIR_MAX_AGE_HOURS = _safe_int("COMPRESSED_DIR_MAX_AGE_HOURS", 7 * 24)  # 压缩结果最长保留时间(小时)
 
 # CodeBuddy API配置
 CODEBUDDY_API_URL = os.getenv("CODEBUDDY_API_URL", "http://your-server-ip:port/agent")
@@ -39,6 +89,38 @@ CODEBUDDY_MODEL = os.getenv("CODEBUDDY_MODEL", "kimi-k2.5-ioa")  # 可配置的
 CODEBUDDY_CONTINUE = os.getenv("CODEBUDDY_CONTINUE", "true").lower() == "true"  # 是否继续对话
 CODEBUDDY_PRINT = os.getenv("CODEBUDDY_PRINT", "true").lower() == "true"  # 是否打印输出
 CODEBUDDY_SKIP_PERMISSIONS = os.getenv("CODEBUDDY_SKIP_PERMISSIONS", "true").lower() == "true"  # 是否跳过权限检查
+CODEBUDDY_SESSION_SCOPE = os.getenv("CODEBUDDY_SESSION_SCOPE", "conversation").lower()  # 会话作用域: 'conversation'(每个钉钉会话独立) 或 'global'(全局共享)
+CODEBUDDY_MAX_SESSIONS = _safe_int("CODEBUDDY_MAX_SESSIONS", 1000)  # 最多跟踪的会话数(LRU 淘汰)
+
+# 并发与连接池配置
+# 工作线程数（事件循环默认线程池大小），默认与 asyncio 默认线程池一致
+WORKER_CONCURRENCY = _safe_int("WORKER_CONCURRENCY", min(32, (os.cpu_count() or 1) + 4))
+# 每个主机的连接池大小，默认跟随工作线程数，确保每个工作线程都能复用连接
+HTTP_POOL_MAXSIZE_DINGTALK = _safe_int("HTTP_POOL_MAXSIZE_DINGTALK", WORKER_CONCURRENCY)
+HTTP_POOL_MAXSIZE_CODEBUDDY = _safe_int("HTTP_POOL_MAXSIZE_CODEBUDDY", WORKER_CONCURRENCY)
+HTTP_POOL_MAXSIZE_DOWNLOAD = _safe_int("HTTP_POOL_MAXSIZE_DOWNLOAD", WORKER_CONCURRENCY)
+IMAGE_DOWNLOAD_CONCURRENCY = _safe_int("IMAGE_DOWNLOAD_CONCURRENCY", 4)  # 单条消息内图片的并发下载数
+HTTP_POOL_HOST_MAXSIZE = _parse_host_sizes("HTTP_POOL_HOST_MAXSIZE")  # 按主机覆盖，例如 api.dingtalk.com:20
+HTTP_POOL_BLOCK = os.getenv("HTTP_POOL_BLOCK", "true").lower() == "true"  # 连接池满时等待而不是新建后丢弃
+HTTP_POOL_TIMEOUT = _safe_float("HTTP_POOL_TIMEOUT", 10)  # block 模式下等待空闲连接的上限(秒)，不超过请求的连接超时
+HTTP_POOL_STATS_INTERVAL = _safe_int("HTTP_POOL_STATS_INTERVAL", 300)  # 连接池统计日志间隔(秒)，0 表示关闭
+# 重试预算：按上游主机限制重试量占正常流量的比例，所有重试层共享
+RETRY_BUDGET_RATIO = _safe_float("RETRY_BUDGET_RATIO", 0.1)  # 重试最多占请求量的比例
+RETRY_BUDGET_MIN_PER_SEC = _safe_float("RETRY_BUDGET_MIN_PER_SEC", 0.2)  # 每秒保底重试令牌，保证低流量时仍可重试
+RETRY_BUDGET_MAX_TOKENS = _safe_float("RETRY_BUDGET_MAX_TOKENS", 10)  # 令牌上限，限制故障初期的突发重试
+# 钉钉接口限流（OpenAPI 与 session webhook 分别限流），识别到限流响应时退避重试
+DINGTALK_OPENAPI_QPS = _safe_float("DINGTALK_OPENAPI_QPS", 20)  # OpenAPI 每秒调用数
+DINGTALK_WEBHOOK_QPS = _safe_float("DINGTALK_WEBHOOK_QPS", 10)  # session webhook 每秒调用数
+DINGTALK_THROTTLE_RETRIES = _safe_int("DINGTALK_THROTTLE_RETRIES", 3)  # 被限流后的最大重试次数
+# 异步 HTTP 连接器（aiohttp）配置
+ASYNC_HTTP_LIMIT = _safe_int("ASYNC_HTTP_LIMIT", 100)  # 总连接数上限
+ASYNC_HTTP_LIMIT_PER_HOST = _safe_int("ASYNC_HTTP_LIMIT_PER_HOST", WORKER_CONCURRENCY)  # 每个主机的连接数上限
+ASYNC_HTTP_DNS_CACHE_TTL = _safe_int("ASYNC_HTTP_DNS_CACHE_TTL", 300)  # DNS 缓存时间(秒)
+ASYNC_HTTP_KEEPALIVE_TIMEOUT = _safe_int("ASYNC_HTTP_KEEPALIVE_TIMEOUT", 60)  # 空闲连接保活时间(秒)
+# 启动预热：在接收消息前获取 access_token 并建立到各上游主机的长连接
+ENABLE_WARMUP = os.getenv("ENABLE_WARMUP", "true").lower() == "true"
+WARMUP_TIMEOUT = _safe_int("WARMUP_TIMEOUT", 10)  # 单个主机预热超时(秒)
+WARMUP_KEEPALIVE_INTERVAL = _safe_int("WARMUP_KEEPALIVE_INTERVAL", 0)  # 空闲保活探测间隔(秒)，0 表示关闭；应小于服务端空闲断开时间
 
 # 日志配置
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
@@ -46,7 +128,18 @@ LOG_FILE = "/var/log/dingtalk-bot.log"
 
 # 消息配置
 MAX_MESSAGE_LENGTH = 20000
+MAX_MESSAGE_BYTES = _safe_int("MAX_MESSAGE_BYTES", 20000)  # 单条文本/Markdown 消息内容上限(UTF-8 字节)，超出时分段发送
+
+# 互动卡片回复：每个请求投放一张卡片并原地更新（需在开发者后台创建包含 title/content/status 变量的卡片模板）
+ENABLE_CARD_REPLY = os.getenv("ENABLE_CARD_REPLY", "false").lower() == "true"
+CARD_TEMPLATE_ID = os.getenv("CARD_TEMPLATE_ID", "")
+CARD_PROGRESS_INTERVAL = _safe_int("CARD_PROGRESS_INTERVAL", 15)  # 处理中进度更新间隔(秒)，0 表示不更新进度
+CARD_UPDATE_MIN_INTERVAL = _safe_float("CARD_UPDATE_MIN_INTERVAL", 2)  # 同一卡片两次进度更新的最小间隔(秒)
 INITIAL_REPLY = "收到任务，正在处理中...\n\n请稍候，我会尽快返回结果。"
+MESSAGE_DEADLINE_SECONDS = _safe_int("MESSAGE_DEADLINE_SECONDS", 900)  # 单条消息处理总预算(秒)
+ASYNC_TASK_DEADLINE_SECONDS = _safe_int("ASYNC_TASK_DEADLINE_SECONDS", 1800)  # 后台长任务处理总预算(秒)
+OUTBOUND_BATCH_WINDOW_MS = _safe_int("OUTBOUND_BATCH_WINDOW_MS", 0)  # 主动消息合并窗口(毫秒)，0 表示不经队列直接发送（默认）
+WEBHOOK_EXPIRY_MARGIN_SECONDS = _safe_int("WEBHOOK_EXPIRY_MARGIN_SECONDS", 60)  # session webhook 提前视为过期的时间(秒)，过期后改走 OpenAPI
 
 # 消息模板
 MSG_ASYNC_TASK_RECEIVED = (
@@ -82,6 +175,21 @@ AUTO_ENHANCE_MARKDOWN = os.getenv("AUTO_ENHANCE_MARKDOWN", "true").lower() == "t
 # 图片服务器配置
 IMAGE_SERVER_URL = os.getenv("IMAGE_SERVER_URL", "http://localhost:8090")  # 图片服务器 URL
 IMAGE_SERVER_PORT = _safe_int("IMAGE_SERVER_PORT", 8090)  # 图片服务器端口
+EMBED_IMAGE_SERVER = os.getenv("EMBED_IMAGE_SERVER", "false").lower() == "true"  # 在机器人进程的事件循环中运行图片服务器
+IMAGE_SERVER_CACHE_MB = _safe_int("IMAGE_SERVER_CACHE_MB", 64)  # 图片服务器内存热点缓存总大小(MB)，0 表示关闭
+IMAGE_SERVER_CACHE_MAX_OBJECT_KB = _safe_int("IMAGE_SERVER_CACHE_MAX_OBJECT_KB", 4096)  # 可缓存的单个文件大小上限(KB)
+# 缩放版本(?w=<宽度>)允许的宽度白名单
+IMAGE_VARIANT_WIDTHS = tuple(
+    int(w) for w in os.getenv("IMAGE_VARIANT_WIDTHS", "240,480,960").split(",") if w.strip().isdigit()
+)
+IMAGE_THUMB_WIDTH = _safe_int("IMAGE_THUMB_WIDTH", 480)  # 卡片 picURL 使用的缩略图宽度，0 表示使用原图
+IMAGE_VARIANT_WORKERS = _safe_int("IMAGE_VARIANT_WORKERS", 2)  # 生成缩放版本的进程数，0 表示在线程池中生成
+IMAGE_VARIANT_QUALITY = _safe_int("IMAGE_VARIANT_QUALITY", 82)  # 缩放版本的 JPEG 质量
+IMAGE_VARIANT_CACHE_MB = _safe_int("IMAGE_VARIANT_CACHE_MB", 512)  # 派生版本磁盘缓存配额(MB)，由磁盘清理维护
+# 按 Accept 协商的编码版本格式（webp/avif，Pillow 不支持的格式自动跳过），留空表示关闭
+IMAGE_SIBLING_FORMATS = tuple(
+    fmt.strip().lower() for fmt in os.getenv("IMAGE_SIBLING_FORMATS", "webp,avif").split(",") if fmt.strip()
+)
 
 # 图片生成配置
 IMAGE_GENERATOR_TYPE = os.getenv("IMAGE_GENERATOR_TYPE", "gemini")  # 图片生成方式: 'gemini' 或 'codebuddy'
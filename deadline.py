@@ -0,0 +1,86 @@
+"""
+消息处理截止时间
+为单条消息的整个处理链路（下载、后端调用、回复）提供统一的时间预算
+"""
+import time
+from typing import Optional
+
+
+class DeadlineExceeded(TimeoutError):
+    """处理预算已耗尽"""
+
+
+class Deadline:
+    """
+    单条消息的截止时间
+
+    在 process() 中创建，沿调用链向下传递。每个阶段用剩余预算作为超时，
+    预算耗尽后所有后续工作直接放弃。
+    """
+
+    def __init__(self, budget_seconds: float):
+        """
+        Args:
+            budget_seconds: 总时间预算(秒)
+        """
+        self.budget = budget_seconds
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + budget_seconds
+
+    def remaining(self) -> float:
+        """剩余预算(秒)，不小于 0"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def elapsed(self) -> float:
+        """已用时间(秒)"""
+        return time.monotonic() - self.started_at
+
+    def expired(self) -> bool:
+        """预算是否已耗尽"""
+        return time.monotonic() >= self.expires_at
+
+    def check(self, stage: str = ""):
+        """
+        检查预算，耗尽时抛出 DeadlineExceeded
+
+        Args:
+            stage: 当前阶段名称（用于异常信息）
+        """
+        if self.expired():
+            where = f" ({stage})" if stage else ""
+            raise DeadlineExceeded(f"处理超出时间预算 {self.budget:.0f}s{where}")
+
+    def timeout(self, cap: Optional[float] = None, stage: str = "") -> float:
+        """
+        计算当前阶段可用的超时时间
+
+        Args:
+            cap: 该阶段自身的超时上限(秒)
+            stage: 当前阶段名称
+
+        Returns:
+            min(cap, 剩余预算)
+        """
+        self.check(stage)
+        remaining = self.remaining()
+        return remaining if cap is None else min(cap, remaining)
+
+    def __repr__(self):
+        return f"Deadline(budget={self.budget}, remaining={self.remaining():.1f})"
+
+
+def timeout_for(deadline: Optional[Deadline], default: float, stage: str = "") -> float:
+    """
+    根据截止时间计算超时；未传入截止时间时使用默认值
+
+    Args:
+        deadline: 截止时间(可选)
+        default: 默认超时(秒)，同时作为上限
+        stage: 当前阶段名称
+
+    Returns:
+        超时时间(秒)
+    """
+    if deadline is None:
+        return default
+    return deadline.timeout(default, stage)
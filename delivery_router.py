@@ -0,0 +1,185 @@
+"""
+消息投递路由
+session webhook 免 token、成本最低，但有有效期（sessionWebhookExpiredTime）；
+有效期内走 webhook，过期后改走 OpenAPI：群聊用 groupMessages/send，单聊用 oToMessages/batchSend，
+避免后台长任务的结果发往已过期的 webhook 后失败重试
+"""
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from config import WEBHOOK_EXPIRY_MARGIN_SECONDS
+from deadline import Deadline
+from dingtalk_sender import dingtalk_sender
+
+logger = logging.getLogger(__name__)
+
+# 投递方式
+ROUTE_WEBHOOK = "webhook"
+ROUTE_GROUP = "group"  # groupMessages/send
+ROUTE_OTO = "oto"  # oToMessages/batchSend
+
+GROUP_CONVERSATION_TYPE = '2'
+
+
+@dataclass
+class DeliveryTarget:
+    """消息投递目标"""
+    conversation_id: str
+    user_id: str
+    conversation_type: str = '1'  # '1' 单聊, '2' 群聊
+    webhook_url: Optional[str] = None
+    webhook_expires_at: Optional[float] = None  # 秒级时间戳，None 表示未知
+
+    @property
+    def is_group(self) -> bool:
+        return self.conversation_type == GROUP_CONVERSATION_TYPE
+
+    @classmethod
+    def from_message(cls, message) -> "DeliveryTarget":
+        """由 ChatbotMessage 构建"""
+        return cls(
+            conversation_id=message.conversation_id,
+            user_id=message.sender_staff_id,
+            conversation_type=message.conversation_type or '1',
+            webhook_url=message.session_webhook,
+            webhook_expires_at=webhook_expires_at(message),
+        )
+
+    @classmethod
+    def from_task(cls, task) -> "DeliveryTarget":
+        """由 TaskInfo 构建"""
+        return cls(
+            conversation_id=task.conversation_id,
+            user_id=task.user_id,
+            conversation_type=task.conversation_type,
+            webhook_url=task.webhook_url,
+            webhook_expires_at=task.webhook_expires_at,
+        )
+
+
+def webhook_expires_at(message) -> Optional[float]:
+    """读取消息的 session webhook 过期时间（钉钉返回毫秒时间戳）"""
+    expired_time = getattr(message, 'session_webhook_expired_time', None)
+    if not expired_time:
+        return None
+    return expired_time / 1000
+
+
+def to_openapi_message(payload: dict) -> Tuple[str, dict]:
+    """
+    将 webhook 消息 payload 转换为 OpenAPI 消息模板参数
+
+    Returns:
+        (msg_type, msg_param)，msg_type 为 DingTalkSender.MESSAGE_TYPES 的键
+    """
+    msg_type = payload.get('msgtype')
+    if msg_type == 'text':
+        return 'text', {"content": payload['text']['content']}
+    if msg_type == 'markdown':
+        return 'markdown', {"title": payload['markdown']['title'], "text": payload['markdown']['text']}
+    if msg_type == 'link':
+        link = payload['link']
+        return 'link', {
+            "title": link['title'], "text": link['text'],
+            "picUrl": link['picUrl'], "messageUrl": link['messageUrl'],
+        }
+    if msg_type == 'actionCard':
+        card = payload['actionCard']
+        return 'actionCard', {
+            "title": card['title'], "text": card['text'],
+            "singleTitle": card['singleTitle'], "singleURL": card['singleURL'],
+        }
+    if msg_type == 'feedCard':
+        # OpenAPI 没有 FeedCard 模板，取第一条改用链接消息
+        link = payload['feedCard']['links'][0]
+        return 'link', {
+            "title": link['title'], "text": link['title'],
+            "picUrl": link['picURL'], "messageUrl": link['messageURL'],
+        }
+    raise ValueError(f"不支持转换为 OpenAPI 消息的类型: {msg_type}")
+
+
+class DeliveryRouter:
+    """按 webhook 有效期选择投递方式"""
+
+    def __init__(self, expiry_margin: float = WEBHOOK_EXPIRY_MARGIN_SECONDS):
+        """
+        Args:
+            expiry_margin: 提前视为过期的时间(秒)，覆盖请求排队与传输耗时
+        """
+        self.expiry_margin = expiry_margin
+        self._lock = threading.Lock()
+        self._counts = {ROUTE_WEBHOOK: 0, ROUTE_GROUP: 0, ROUTE_OTO: 0}
+
+    def webhook_valid(self, target: DeliveryTarget, now: Optional[float] = None) -> bool:
+        """webhook 是否仍可使用；未提供过期时间时视为可用（与原有行为一致）"""
+        if not target.webhook_url:
+            return False
+        if target.webhook_expires_at is None:
+            return True
+        now = time.time() if now is None else now
+        return now < target.webhook_expires_at - self.expiry_margin
+
+    def route(self, target: DeliveryTarget, now: Optional[float] = None) -> str:
+        """
+        选择投递方式
+
+        Returns:
+            ROUTE_WEBHOOK / ROUTE_GROUP / ROUTE_OTO
+        """
+        if self.webhook_valid(target, now):
+            route = ROUTE_WEBHOOK
+        else:
+            route = ROUTE_GROUP if target.is_group else ROUTE_OTO
+        with self._lock:
+            self._counts[route] += 1
+        return route
+
+    def send_openapi(self, target: DeliveryTarget, payload: dict, deadline: Optional[Deadline] = None) -> bool:
+        """
+        通过 OpenAPI 发送 webhook 格式的消息（群聊发到群，单聊发给用户）
+
+        Args:
+            target: 投递目标
+            payload: webhook 消息 payload
+            deadline: 消息处理截止时间(可选)
+
+        Returns:
+            是否发送成功
+        """
+        msg_type, msg_param = to_openapi_message(payload)
+        if target.is_group:
+            logger.info(f"webhook 已过期，改用群消息接口发送 {msg_type} 消息: {target.conversation_id}")
+            return dingtalk_sender.send_group_message(
+                target.conversation_id, msg_type, msg_param, deadline=deadline
+            )
+        logger.info(f"webhook 已过期，改用单聊消息接口发送 {msg_type} 消息: {target.user_id}")
+        return dingtalk_sender.send_message(
+            target.conversation_id, target.user_id, msg_type, msg_param, deadline=deadline
+        )
+
+    async def send_openapi_async(self, target: DeliveryTarget, payload: dict,
+                                 deadline: Optional[Deadline] = None) -> bool:
+        """send_openapi 的协程版本，由事件循环驱动，不占用线程"""
+        msg_type, msg_param = to_openapi_message(payload)
+        if target.is_group:
+            logger.info(f"webhook 已过期，改用群消息接口发送 {msg_type} 消息: {target.conversation_id}")
+            return await dingtalk_sender.send_group_message_async(
+                target.conversation_id, msg_type, msg_param, deadline=deadline
+            )
+        logger.info(f"webhook 已过期，改用单聊消息接口发送 {msg_type} 消息: {target.user_id}")
+        return await dingtalk_sender.send_message_async(
+            target.conversation_id, target.user_id, msg_type, msg_param, deadline=deadline
+        )
+
+    def stats(self) -> dict:
+        """返回各投递方式的使用次数"""
+        with self._lock:
+            return dict(self._counts)
+
+
+# 全局单例
+delivery_router = DeliveryRouter()
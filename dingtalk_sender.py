@@ -2,19 +2,38 @@
 钉钉主动推送消息客户端
 使用钉钉 OpenAPI 主动发送消息,不依赖 session webhook
 """
+import asyncio
 import json
 import logging
 import os
 import base64
-import threading
-import requests
-from typing import Optional
+import mimetypes
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Dict, List, Optional, Tuple
 
 from http_client import http_client
-from config import DINGTALK_CLIENT_ID, DINGTALK_CLIENT_SECRET
+from async_http_client import async_http_client
+from deadline import Deadline, timeout_for
+from outbound_queue import OutboundQueue
+from token_manager import AccessTokenManager
+from media_cache import MediaCache
+from image_compressor import image_compressor
+from rate_limiter import openapi_limiter, call_with_throttle_retry, call_with_throttle_retry_async
+from config import (
+    DINGTALK_CLIENT_ID,
+    DINGTALK_CLIENT_SECRET,
+    DINGTALK_TOKEN_REFRESH_MARGIN,
+    OUTBOUND_BATCH_WINDOW_MS,
+    MEDIA_CACHE_FILE,
+    MEDIA_ID_TTL,
+)
 
 logger = logging.getLogger(__name__)
 
+ACCESS_TOKEN_URL = "https://api.dingtalk.com/v1.0/oauth2/accessToken"
+BATCH_SEND_URL = "https://api.dingtalk.com/v1.0/robot/oToMessages/batchSend"
+GROUP_SEND_URL = "https://api.dingtalk.com/v1.0/robot/groupMessages/send"
+
 
 class DingTalkSender:
     """钉钉消息发送器"""
@@ -24,61 +43,77 @@ class DingTalkSender:
         'text': 'sampleText',
         'markdown': 'sampleMarkdown',
         'image': 'sampleImageMsg',
+        'link': 'sampleLink',
+        'actionCard': 'sampleActionCard',
     }
     
     def __init__(self):
         self.client_id = DINGTALK_CLIENT_ID
         self.client_secret = DINGTALK_CLIENT_SECRET
-        self._access_token: Optional[str] = None
-        self._token_expires_at: float = 0
-        self._token_lock = threading.Lock()  # Token 缓存线程锁
+        # access token 按服务端返回的有效期在后台提前刷新
+        self._token_manager = AccessTokenManager(
+            self._fetch_access_token, refresh_margin=DINGTALK_TOKEN_REFRESH_MARGIN
+        )
+        # 图片按内容哈希上传一次，之后以 media_id 引用
+        self._media_cache = MediaCache(self.upload_media, MEDIA_CACHE_FILE, MEDIA_ID_TTL)
+        # 主动消息发送队列（合并相同内容、单线程依次发送），窗口为 0 时直接发送
+        self._outbound: Optional[OutboundQueue] = None
+        if OUTBOUND_BATCH_WINDOW_MS > 0:
+            self._outbound = OutboundQueue(self._post_batch_send, OUTBOUND_BATCH_WINDOW_MS / 1000)
+
+    def _fetch_access_token(self) -> Tuple[str, float]:
+        """
+        调用接口获取 access token（由 AccessTokenManager 在刷新线程中调用）
         
-    def _get_access_token(self) -> str:
+        Returns:
+            (access token, 有效期秒数)
         """
-        获取 access token（线程安全）
+        response = call_with_throttle_retry(
+            openapi_limiter, ACCESS_TOKEN_URL,
+            lambda: http_client.dingtalk_session.post(
+                ACCESS_TOKEN_URL,
+                json={
+                    "appKey": self.client_id,
+                    "appSecret": self.client_secret
+                },
+                timeout=10
+            ),
+            "获取 access token"
+        )
+        response.raise_for_status()
+        data = response.json()
+        return data["accessToken"], float(data.get("expireIn", 7200))
+        
+    def _get_access_token(self, deadline: Optional[Deadline] = None) -> str:
+        """
+        获取 access token（线程安全，当前 token 有效时不会等待刷新）
+        
+        Args:
+            deadline: 消息处理截止时间(可选)
         
         Returns:
             access token
         """
-        import time
+        return self._token_manager.get(deadline)
+
+    async def _get_access_token_async(self, deadline: Optional[Deadline] = None) -> str:
+        """
+        获取 access token（协程版本，等待刷新时不占用线程）
         
-        with self._token_lock:
-            # 如果 token 还有效，直接返回
-            if self._access_token and time.time() < self._token_expires_at:
-                return self._access_token
-            
-            # 获取新 token
-            url = "https://api.dingtalk.com/v1.0/oauth2/accessToken"
-            
-            try:
-                response = http_client.dingtalk_session.post(
-                    url,
-                    json={
-                        "appKey": self.client_id,
-                        "appSecret": self.client_secret
-                    },
-                    timeout=10
-                )
-                
-                response.raise_for_status()
-                data = response.json()
-                
-                self._access_token = data.get("accessToken")
-                # Token 有效期 2 小时，提前 5 分钟刷新
-                self._token_expires_at = time.time() + 7200 - 300
-                
-                logger.info("成功获取 access token")
-                return self._access_token
-                
-            except Exception as e:
-                logger.error(f"获取 access token 失败: {e}")
-                raise
+        Args:
+            deadline: 消息处理截止时间(可选)
+        
+        Returns:
+            access token
+        """
+        return await self._token_manager.get_async(deadline)
     
     def send_text_message(
         self,
         conversation_id: str,
         user_id: str,
-        content: str
+        content: str,
+        deadline: Optional[Deadline] = None
     ) -> bool:
         """
         发送文本消息到指定会话
@@ -87,59 +122,21 @@ class DingTalkSender:
             conversation_id: 会话ID (openConversationId)
             user_id: 用户ID
             content: 消息内容
+            deadline: 消息处理截止时间(可选)
             
         Returns:
             是否发送成功
         """
-        response = None
-        try:
-            access_token = self._get_access_token()
-            
-            # 使用机器人发送消息 API
-            url = "https://api.dingtalk.com/v1.0/robot/oToMessages/batchSend"
-            
-            headers = {
-                "Content-Type": "application/json",
-                "x-acs-dingtalk-access-token": access_token
-            }
-            
-            # 构建消息体
-            payload = {
-                "robotCode": self.client_id,
-                "userIds": [user_id],
-                "msgKey": "sampleText",
-                "msgParam": json.dumps({
-                    "content": content
-                }, ensure_ascii=False)
-            }
-            
-            logger.info(f"发送消息到用户 {user_id}, 内容长度: {len(content)}")
-            logger.debug(f"Payload: {payload}")
-            
-            response = http_client.dingtalk_session.post(
-                url,
-                headers=headers,
-                json=payload,
-                timeout=10
-            )
-            
-            response.raise_for_status()
-            result = response.json()
-            
-            logger.info(f"消息发送响应: {result}")
-            return True
-            
-        except Exception as e:
-            logger.error(f"发送消息失败: {e}")
-            logger.error(f"Response: {response.text if response else 'None'}")
-            return False
+        logger.info(f"发送消息到用户 {user_id}, 内容长度: {len(content)}")
+        return self.send_message(conversation_id, user_id, msg_type='text', content=content, deadline=deadline)
     
     def send_markdown_message(
         self,
         conversation_id: str,
         user_id: str,
         title: str,
-        content: str
+        content: str,
+        deadline: Optional[Deadline] = None
     ) -> bool:
         """
         发送 Markdown 消息
@@ -149,62 +146,31 @@ class DingTalkSender:
             user_id: 用户ID
             title: 消息标题
             content: Markdown 内容
+            deadline: 消息处理截止时间(可选)
             
         Returns:
             是否发送成功
         """
-        try:
-            access_token = self._get_access_token()
-            
-            url = "https://api.dingtalk.com/v1.0/robot/oToMessages/batchSend"
-            
-            headers = {
-                "Content-Type": "application/json",
-                "x-acs-dingtalk-access-token": access_token
-            }
-            
-            payload = {
-                "robotCode": self.client_id,
-                "userIds": [user_id],
-                "msgKey": "sampleMarkdown",
-                "msgParam": json.dumps({
-                    "title": title,
-                    "text": content
-                }, ensure_ascii=False)
-            }
-            
-            logger.info(f"发送 Markdown 消息: {title}")
-            
-            response = http_client.dingtalk_session.post(
-                url,
-                headers=headers,
-                json=payload,
-                timeout=10
-            )
-            
-            response.raise_for_status()
-            result = response.json()
-            
-            logger.info(f"Markdown 消息发送响应: {result}")
-            return True
-            
-        except Exception as e:
-            logger.error(f"发送 Markdown 消息失败: {e}")
-            return False
+        logger.info(f"发送 Markdown 消息: {title}")
+        return self.send_message(
+            conversation_id, user_id, msg_type='markdown', title=title, text=content, deadline=deadline
+        )
     
-    def upload_media(self, file_path: str, media_type: str = "image") -> Optional[str]:
+    def upload_media(self, file_path: str, media_type: str = "image",
+                     deadline: Optional[Deadline] = None) -> Optional[str]:
         """
         上传媒体文件到钉钉
         
         Args:
             file_path: 本地文件路径
             media_type: 媒体类型 (image/voice/video/file)
+            deadline: 消息处理截止时间(可选)
             
         Returns:
             media_id,失败返回 None
         """
         try:
-            access_token = self._get_access_token()
+            access_token = self._get_access_token(deadline)
             
             url = "https://oapi.dingtalk.com/media/upload"
             
@@ -226,16 +192,20 @@ class DingTalkSender:
             }
             
             files = {
-                'media': (filename, file_content, 'image/png')
+                'media': (filename, file_content, mimetypes.guess_type(filename)[0] or 'application/octet-stream')
             }
             
             logger.info(f"上传媒体文件: {filename}, 类型: {media_type}")
             
-            response = http_client.dingtalk_session.post(
-                url,
-                params=params,
-                files=files,
-                timeout=30
+            response = call_with_throttle_retry(
+                openapi_limiter, url,
+                lambda: http_client.dingtalk_session.post(
+                    url,
+                    params=params,
+                    files=files,
+                    timeout=timeout_for(deadline, 30, "上传媒体文件")
+                ),
+                "上传媒体文件", deadline
             )
             
             response.raise_for_status()
@@ -255,79 +225,47 @@ class DingTalkSender:
             logger.error(traceback.format_exc())
             return None
     
-    def _compress_image(self, image_path: str, max_size_kb: int = 500) -> str:
+    def _compress_image(self, image_path: str, max_size_kb: int = 500,
+                        deadline: Optional[Deadline] = None) -> str:
         """
-        压缩图片到指定大小（二分搜索最佳质量）
+        压缩图片到指定大小（在进程池中执行，结果按内容哈希缓存）
         
         Args:
             image_path: 原图片路径
             max_size_kb: 最大文件大小(KB)
+            deadline: 消息处理截止时间(可选)
             
         Returns:
             压缩后的图片路径
         """
-        try:
-            from PIL import Image
-            import io
-            
-            # 打开图片
-            img = Image.open(image_path)
-            
-            # 如果是 RGBA 模式,转换为 RGB
-            if img.mode == 'RGBA':
-                background = Image.new('RGB', img.size, (255, 255, 255))
-                background.paste(img, mask=img.split()[3])
-                img = background
-            
-            compressed_path = image_path.replace('.png', '_compressed.jpg')
-            
-            # 二分搜索最佳质量
-            low, high = 20, 85
-            best_buffer = None
-            
-            while low <= high:
-                mid = (low + high) // 2
-                buffer = io.BytesIO()
-                img.save(buffer, format='JPEG', quality=mid, optimize=True)
-                size_kb = len(buffer.getvalue()) / 1024
-                
-                if size_kb <= max_size_kb:
-                    best_buffer = buffer
-                    low = mid + 1  # 尝试更高质量
-                else:
-                    high = mid - 1  # 降低质量
-            
-            if best_buffer:
-                with open(compressed_path, 'wb') as f:
-                    f.write(best_buffer.getvalue())
-                logger.info(f"图片压缩成功: {len(best_buffer.getvalue())/1024:.1f}KB")
-                return compressed_path
-            
-            # 二分搜索都不满足,缩小尺寸
-            logger.warning("图片过大,尝试缩小尺寸")
-            width, height = img.size
-            img = img.resize((width // 2, height // 2), Image.Resampling.LANCZOS)
-            
-            buffer = io.BytesIO()
-            img.save(buffer, format='JPEG', quality=75, optimize=True)
-            
-            with open(compressed_path, 'wb') as f:
-                f.write(buffer.getvalue())
-            
-            size_kb = len(buffer.getvalue()) / 1024
-            logger.info(f"图片缩小并压缩成功: {size_kb:.1f}KB")
-            
-            return compressed_path
-            
-        except Exception as e:
-            logger.error(f"图片压缩失败: {e}")
-            return image_path
+        return image_compressor.compress(image_path, max_size_kb=max_size_kb, deadline=deadline)
+    
+    def _prepare_image(self, image_path: str, max_size_kb: int = 500,
+                       deadline: Optional[Deadline] = None) -> str:
+        """图片超过大小限制时压缩（等待不超过 deadline），返回实际发送的文件路径"""
+        file_size_kb = os.path.getsize(image_path) / 1024
+        logger.info(f"原始图片大小: {file_size_kb:.1f}KB")
+        
+        if file_size_kb > max_size_kb:
+            logger.info(f"图片过大,开始压缩...")
+            image_path = self._compress_image(image_path, max_size_kb=max_size_kb, deadline=deadline)
+            file_size_kb = os.path.getsize(image_path) / 1024
+            logger.info(f"压缩后图片大小: {file_size_kb:.1f}KB")
+        return image_path
+    
+    def _inline_image_url(self, image_path: str, deadline: Optional[Deadline] = None) -> str:
+        """将图片编码为 base64 data URL（media_id 不可用时的回退方式）"""
+        with open(self._prepare_image(image_path, deadline=deadline), 'rb') as f:
+            image_base64 = base64.b64encode(f.read()).decode('utf-8')
+        logger.info(f"Base64 编码后大小: {len(image_base64) / 1024:.1f}KB")
+        return f"data:image/jpeg;base64,{image_base64}"
     
     def send_image_message(
         self,
         conversation_id: str,
         user_id: str,
-        image_path: str
+        image_path: str,
+        deadline: Optional[Deadline] = None
     ) -> bool:
         """
         发送图片消息
@@ -336,80 +274,33 @@ class DingTalkSender:
             conversation_id: 会话ID
             user_id: 用户ID
             image_path: 本地图片路径
+            deadline: 消息处理截止时间(可选)
             
         Returns:
             是否发送成功
         """
-        response = None
         try:
             if not os.path.exists(image_path):
                 logger.error(f"图片文件不存在: {image_path}")
                 return False
             
-            # 检查文件大小
-            file_size_kb = os.path.getsize(image_path) / 1024
-            logger.info(f"原始图片大小: {file_size_kb:.1f}KB")
-            
-            # 如果图片太大,先压缩
-            if file_size_kb > 500:
-                logger.info(f"图片过大,开始压缩...")
-                image_path = self._compress_image(image_path, max_size_kb=500)
-                file_size_kb = os.path.getsize(image_path) / 1024
-                logger.info(f"压缩后图片大小: {file_size_kb:.1f}KB")
-            
-            # 读取图片并转为 base64
-            with open(image_path, 'rb') as f:
-                image_data = f.read()
-            
-            # 转为 base64
-            image_base64 = base64.b64encode(image_data).decode('utf-8')
-            base64_size_kb = len(image_base64) / 1024
-            logger.info(f"Base64 编码后大小: {base64_size_kb:.1f}KB")
-            
-            access_token = self._get_access_token()
-            
-            url = "https://api.dingtalk.com/v1.0/robot/oToMessages/batchSend"
-            
-            headers = {
-                "Content-Type": "application/json",
-                "x-acs-dingtalk-access-token": access_token
-            }
-            
-            payload = {
-                "robotCode": self.client_id,
-                "userIds": [user_id],
-                "msgKey": "sampleImageMsg",
-                "msgParam": json.dumps({
-                    "photoURL": f"data:image/jpeg;base64,{image_base64}"
-                }, ensure_ascii=False)
-            }
-            
-            logger.info(f"发送图片消息到用户 {user_id}, 图片: {image_path}")
-            
-            response = http_client.dingtalk_session.post(
-                url,
-                headers=headers,
-                json=payload,
-                timeout=30
+            # 按内容哈希复用已上传的 media_id，未命中时压缩后上传一次
+            photo_url = self._media_cache.get_media_id(
+                image_path, "image", deadline=deadline,
+                prepare=lambda path: self._prepare_image(path, deadline=deadline)
             )
+            if not photo_url:
+                logger.warning("图片上传失败，改用 base64 内联发送")
+                photo_url = self._inline_image_url(image_path, deadline)
             
-            # 记录响应详情
-            logger.info(f"钉钉 API 响应状态码: {response.status_code}")
-            logger.info(f"钉钉 API 响应内容: {response.text[:500]}")
-            
-            response.raise_for_status()
-            result = response.json()
+            logger.info(f"发送图片消息到用户 {user_id}, 图片: {image_path}")
             
-            logger.info(f"图片消息发送响应: {result}")
-            return True
+            msg_param = json.dumps({"photoURL": photo_url}, ensure_ascii=False)
+            success = self._dispatch(user_id, self.MESSAGE_TYPES['image'], msg_param, 30, deadline)
+            if success:
+                logger.info(f"图片消息发送成功: {user_id}")
+            return success
             
-        except requests.exceptions.HTTPError as e:
-            logger.error(f"发送图片消息失败: {e}")
-            logger.error(f"响应状态码: {response.status_code if response else 'N/A'}")
-            logger.error(f"响应内容: {response.text if response else 'N/A'}")
-            import traceback
-            logger.error(traceback.format_exc())
-            return False
         except Exception as e:
             logger.error(f"发送图片消息异常: {e}")
             import traceback
@@ -422,6 +313,7 @@ class DingTalkSender:
         user_id: str,
         msg_type: str = 'text',
         msg_param: dict = None,
+        deadline: Optional[Deadline] = None,
         **kwargs
     ) -> bool:
         """
@@ -432,67 +324,368 @@ class DingTalkSender:
             user_id: 用户ID
             msg_type: 消息类型 ('text' 或 'markdown')
             msg_param: 消息参数 (根据消息类型而定)
+            deadline: 消息处理截止时间(可选)
             **kwargs: 其他参数
                 - 对于 'text': content (消息内容)
                 - 对于 'markdown': title, text (标题和内容)
             
+        Returns:
+            是否发送成功
+        """
+        msg_key, msg_param_json = self._build_msg_param(msg_type, msg_param, **kwargs)
+        logger.info(f"发送 {msg_type} 消息到用户 {user_id}")
+        return self._dispatch(user_id, msg_key, msg_param_json, 10, deadline)
+
+    def _build_msg_param(self, msg_type: str, msg_param: dict = None, **kwargs) -> Tuple[str, str]:
+        """
+        构建 batchSend 的 msgKey 与序列化后的 msgParam
+        
+        Args:
+            msg_type: 消息类型 ('text' 或 'markdown')
+            msg_param: 消息参数 (为空时从 kwargs 构建)
+            
+        Returns:
+            (msgKey, msgParam JSON 字符串)
+        """
+        # 获取消息类型对应的 msgKey
+        msg_key = self.MESSAGE_TYPES.get(msg_type, 'sampleText')
+        
+        # 如果没有提供 msg_param，从 kwargs 构建
+        if msg_param is None:
+            if msg_type == 'markdown':
+                msg_param = {
+                    "title": kwargs.get('title', '消息'),
+                    "text": kwargs.get('text', kwargs.get('content', ''))
+                }
+            else:  # text
+                msg_param = {
+                    "content": kwargs.get('content', '')
+                }
+        
+        return msg_key, json.dumps(msg_param, ensure_ascii=False)
+
+    def _build_batch_send_payload(self, user_ids: List[str], msg_key: str, msg_param: str) -> dict:
+        """构建 oToMessages/batchSend 请求体"""
+        return {
+            "robotCode": self.client_id,
+            "userIds": user_ids,
+            "msgKey": msg_key,
+            "msgParam": msg_param
+        }
+
+    def _build_group_send_payload(self, conversation_id: str, msg_key: str, msg_param: str) -> dict:
+        """构建 groupMessages/send 请求体"""
+        return {
+            "robotCode": self.client_id,
+            "openConversationId": conversation_id,
+            "msgKey": msg_key,
+            "msgParam": msg_param
+        }
+
+    def _post_batch_send(self, user_ids: List[str], msg_key: str, msg_param: str, timeout: float,
+                         deadline: Optional[Deadline] = None) -> bool:
+        """
+        调用 oToMessages/batchSend（发送队列工作线程与直接发送共用）
+        
+        deadline 为批次内最早的截止时间，等待 token 刷新与限流时不超过该时间
+        
         Returns:
             是否发送成功
         """
         response = None
         try:
-            access_token = self._get_access_token()
+            access_token = self._get_access_token(deadline)
+            headers = {
+                "Content-Type": "application/json",
+                "x-acs-dingtalk-access-token": access_token
+            }
+            payload = self._build_batch_send_payload(user_ids, msg_key, msg_param)
+            logger.debug(f"Payload: {payload}")
             
-            url = "https://api.dingtalk.com/v1.0/robot/oToMessages/batchSend"
+            response = call_with_throttle_retry(
+                openapi_limiter, BATCH_SEND_URL,
+                lambda: http_client.dingtalk_session.post(
+                    BATCH_SEND_URL,
+                    headers=headers,
+                    json=payload,
+                    timeout=timeout
+                ),
+                f"{msg_key} 消息", deadline
+            )
             
+            response.raise_for_status()
+            result = response.json()
+            
+            logger.info(f"{msg_key} 消息发送响应: {result}")
+            return True
+            
+        except Exception as e:
+            logger.error(f"发送 {msg_key} 消息失败: {e}")
+            logger.error(f"Response: {response.text[:500] if response is not None else 'None'}")
+            return False
+
+    def _submit(self, user_id: str, msg_key: str, msg_param: str, timeout: float,
+                deadline: Optional[Deadline]) -> Optional[Future]:
+        """提交到发送队列；未启用队列或预算已耗尽时返回 None"""
+        if self._outbound is None:
+            return None
+        timeout_for(deadline, timeout, "发送消息")  # 预算耗尽时直接抛出，不再排队
+        return self._outbound.submit(user_id, msg_key, msg_param, timeout, deadline)
+
+    def _wait(self, future: Future, timeout: float, deadline: Optional[Deadline]) -> bool:
+        """
+        等待队列发送结果，最多等待一个合并窗口加一次调用超时（不超过处理预算），
+        避免排在慢批次之后无限期阻塞；超时仍未开始发送的消息撤回
+        """
+        wait = self._outbound.window + timeout
+        if deadline is not None:
+            wait = min(wait, max(deadline.remaining(), 0))
+        try:
+            return future.result(timeout=wait)
+        except FutureTimeoutError:
+            if future.cancel():
+                logger.warning(f"发送队列等待超时({wait:.1f}s)，已撤回消息")
+                return False
+            # 已开始发送，最多再等待一次调用超时
+            return future.result(timeout=timeout)
+
+    def _dispatch(self, user_id: str, msg_key: str, msg_param: str, timeout: float,
+                  deadline: Optional[Deadline] = None) -> bool:
+        """
+        发送单聊消息：启用队列时排队等待合并发送，否则直接调用接口
+        
+        Args:
+            user_id: 用户ID
+            msg_key: 消息模板
+            msg_param: 序列化后的消息参数
+            timeout: 单次调用超时上限(秒)
+            deadline: 消息处理截止时间(可选)
+        
+        Returns:
+            是否发送成功
+        """
+        try:
+            future = self._submit(user_id, msg_key, msg_param, timeout, deadline)
+            if future is not None:
+                return self._wait(future, timeout, deadline)
+            return self._post_batch_send(
+                [user_id], msg_key, msg_param, timeout_for(deadline, timeout, "发送消息"), deadline
+            )
+        except Exception as e:
+            logger.error(f"发送 {msg_key} 消息失败: {e}")
+            return False
+
+    def send_group_message(
+        self,
+        conversation_id: str,
+        msg_type: str = 'text',
+        msg_param: dict = None,
+        deadline: Optional[Deadline] = None,
+        **kwargs
+    ) -> bool:
+        """
+        通过 groupMessages/send 发送群聊消息（session webhook 过期后的群聊回复方式）
+        
+        Args:
+            conversation_id: 群会话ID (openConversationId)
+            msg_type: 消息类型，同 send_message
+            msg_param: 消息参数
+            deadline: 消息处理截止时间(可选)
+            **kwargs: 同 send_message
+        
+        Returns:
+            是否发送成功
+        """
+        msg_key, msg_param_json = self._build_msg_param(msg_type, msg_param, **kwargs)
+        logger.info(f"发送 {msg_type} 消息到群 {conversation_id}")
+        
+        response = None
+        try:
+            access_token = self._get_access_token(deadline)
             headers = {
                 "Content-Type": "application/json",
                 "x-acs-dingtalk-access-token": access_token
             }
+            payload = self._build_group_send_payload(conversation_id, msg_key, msg_param_json)
+            logger.debug(f"Payload: {payload}")
             
-            # 获取消息类型对应的 msgKey
-            msg_key = self.MESSAGE_TYPES.get(msg_type, 'sampleText')
-            
-            # 如果没有提供 msg_param，从 kwargs 构建
-            if msg_param is None:
-                if msg_type == 'markdown':
-                    msg_param = {
-                        "title": kwargs.get('title', '消息'),
-                        "text": kwargs.get('text', kwargs.get('content', ''))
-                    }
-                else:  # text
-                    msg_param = {
-                        "content": kwargs.get('content', '')
-                    }
-            
-            payload = {
-                "robotCode": self.client_id,
-                "userIds": [user_id],
-                "msgKey": msg_key,
-                "msgParam": json.dumps(msg_param, ensure_ascii=False)
-            }
+            response = call_with_throttle_retry(
+                openapi_limiter, GROUP_SEND_URL,
+                lambda: http_client.dingtalk_session.post(
+                    GROUP_SEND_URL,
+                    headers=headers,
+                    json=payload,
+                    timeout=timeout_for(deadline, 10, "发送群消息")
+                ),
+                f"{msg_key} 群消息", deadline
+            )
+            
+            response.raise_for_status()
+            result = response.json()
+            
+            logger.info(f"{msg_key} 群消息发送响应: {result}")
+            return True
             
-            logger.info(f"发送 {msg_type} 消息到用户 {user_id}")
+        except Exception as e:
+            logger.error(f"发送 {msg_key} 群消息失败: {e}")
+            logger.error(f"Response: {response.text[:500] if response is not None else 'None'}")
+            return False
+
+    def broadcast(self, user_ids: List[str], msg_type: str = 'text', msg_param: dict = None,
+                  deadline: Optional[Deadline] = None, **kwargs) -> Dict[str, bool]:
+        """
+        向多个用户发送相同内容（启用队列时合并为尽量少的 batchSend 调用）
+        
+        Args:
+            user_ids: 用户ID列表
+            msg_type: 消息类型 ('text' 或 'markdown')
+            msg_param: 消息参数
+            deadline: 消息处理截止时间(可选)
+            **kwargs: 同 send_message
+        
+        Returns:
+            {用户ID: 是否发送成功}
+        """
+        msg_key, msg_param_json = self._build_msg_param(msg_type, msg_param, **kwargs)
+        if self._outbound is None:
+            success = self._post_batch_send(
+                list(user_ids), msg_key, msg_param_json, timeout_for(deadline, 10, "发送消息"), deadline
+            )
+            return dict.fromkeys(user_ids, success)
+        futures = {uid: self._submit(uid, msg_key, msg_param_json, 10, deadline) for uid in user_ids}
+        results = {}
+        for uid, future in futures.items():
+            try:
+                results[uid] = self._wait(future, 10, deadline)
+            except Exception as e:
+                logger.error(f"发送消息到用户 {uid} 失败: {e}")
+                results[uid] = False
+        return results
+
+    async def _wait_async(self, future: Future, timeout: float, deadline: Optional[Deadline]) -> bool:
+        """等待队列发送结果（协程版本，不占用线程），等待上限同 _wait"""
+        wait = self._outbound.window + timeout
+        if deadline is not None:
+            wait = min(wait, max(deadline.remaining(), 0))
+        try:
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), wait)
+        except asyncio.TimeoutError:
+            if future.cancel():
+                logger.warning(f"发送队列等待超时({wait:.1f}s)，已撤回消息")
+                return False
+            # 已开始发送，最多再等待一次调用超时
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+
+    async def _post_async(self, url: str, payload: dict, timeout: float, label: str,
+                          deadline: Optional[Deadline] = None) -> bool:
+        """
+        通过异步客户端调用 OpenAPI 发送接口（协程版本的 _post_batch_send / 群消息发送共用）
+        
+        Returns:
+            是否发送成功
+        """
+        response = None
+        try:
+            access_token = await self._get_access_token_async(deadline)
+            headers = {
+                "Content-Type": "application/json",
+                "x-acs-dingtalk-access-token": access_token
+            }
             logger.debug(f"Payload: {payload}")
             
-            response = http_client.dingtalk_session.post(
-                url,
-                headers=headers,
-                json=payload,
-                timeout=10
+            response = await call_with_throttle_retry_async(
+                openapi_limiter, url,
+                lambda: async_http_client.post(url, headers=headers, json=payload, timeout=timeout),
+                label, deadline
             )
             
             response.raise_for_status()
             result = response.json()
             
-            logger.info(f"{msg_type.upper()} 消息发送响应: {result}")
+            logger.info(f"{label}发送响应: {result}")
             return True
             
         except Exception as e:
-            logger.error(f"发送 {msg_type} 消息失败: {e}")
-            logger.error(f"Response: {response.text if response else 'None'}")
+            logger.error(f"发送 {label}失败: {e}")
+            logger.error(f"Response: {response.text[:500] if response is not None else 'None'}")
             return False
 
+    async def send_message_async(
+        self,
+        conversation_id: str,
+        user_id: str,
+        msg_type: str = 'text',
+        msg_param: dict = None,
+        deadline: Optional[Deadline] = None,
+        **kwargs
+    ) -> bool:
+        """
+        通用消息发送方法（协程版本），参数同 send_message
+        
+        启用发送队列时等待队列结果而不占用线程，否则通过异步客户端直接发送
+        
+        Returns:
+            是否发送成功
+        """
+        msg_key, msg_param_json = self._build_msg_param(msg_type, msg_param, **kwargs)
+        logger.info(f"发送 {msg_type} 消息到用户 {user_id}")
+        try:
+            future = self._submit(user_id, msg_key, msg_param_json, 10, deadline)
+            if future is not None:
+                return await self._wait_async(future, 10, deadline)
+            payload = self._build_batch_send_payload([user_id], msg_key, msg_param_json)
+            return await self._post_async(
+                BATCH_SEND_URL, payload, timeout_for(deadline, 10, "发送消息"), f"{msg_key} 消息", deadline
+            )
+        except Exception as e:
+            logger.error(f"发送 {msg_key} 消息失败: {e}")
+            return False
+
+    async def send_group_message_async(
+        self,
+        conversation_id: str,
+        msg_type: str = 'text',
+        msg_param: dict = None,
+        deadline: Optional[Deadline] = None,
+        **kwargs
+    ) -> bool:
+        """发送群聊消息（协程版本），参数同 send_group_message"""
+        msg_key, msg_param_json = self._build_msg_param(msg_type, msg_param, **kwargs)
+        logger.info(f"发送 {msg_type} 消息到群 {conversation_id}")
+        try:
+            payload = self._build_group_send_payload(conversation_id, msg_key, msg_param_json)
+            return await self._post_async(
+                GROUP_SEND_URL, payload, timeout_for(deadline, 10, "发送群消息"), f"{msg_key} 群消息", deadline
+            )
+        except Exception as e:
+            logger.error(f"发送 {msg_key} 群消息失败: {e}")
+            return False
+
+    async def send_text_message_async(
+        self,
+        conversation_id: str,
+        user_id: str,
+        content: str,
+        deadline: Optional[Deadline] = None
+    ) -> bool:
+        """发送文本消息（协程版本），参数同 send_text_message"""
+        return await self.send_message_async(
+            conversation_id, user_id, msg_type='text', content=content, deadline=deadline
+        )
+
+    async def send_markdown_message_async(
+        self,
+        conversation_id: str,
+        user_id: str,
+        title: str,
+        content: str,
+        deadline: Optional[Deadline] = None
+    ) -> bool:
+        """发送 Markdown 消息（协程版本），参数同 send_markdown_message"""
+        return await self.send_message_async(
+            conversation_id, user_id, msg_type='markdown', title=title, text=content, deadline=deadline
+        )
+
 
 # 全局发送器实例
 dingtalk_sender = DingTalkSender()
@@ -0,0 +1,235 @@
+"""
+磁盘清理
+后台定期扫描图片目录（收到的图片 images/、生成的图片 imagegen/、派生版本 cache/variants/、
+发送前的压缩结果 cache/compressed/），
+按目录的字节配额与最长保留时间淘汰最久未使用的文件；
+正在被任务使用的文件（pin）与刚写入的文件不会被删除；
+图片缓存（image_cache）自身的淘汰同样跳过这里 pin 住的文件
+"""
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import (
+    IMAGE_DIR, IMAGEGEN_DIR, IMAGE_DIR_QUOTA_MB, IMAGE_DIR_MAX_AGE_HOURS,
+    IMAGEGEN_DIR_QUOTA_MB, IMAGEGEN_DIR_MAX_AGE_HOURS, IMAGE_VARIANT_CACHE_MB,
+    COMPRESSED_DIR_QUOTA_MB, COMPRESSED_DIR_MAX_AGE_HOURS, JANITOR_INTERVAL, JANITOR_GRACE_SECONDS,
+)
+from image_compressor import COMPRESSED_DIR
+from image_variants import VARIANT_DIR
+
+logger = logging.getLogger(__name__)
+
+TEMP_SUFFIX = ".part"  # 下载中的临时文件
+STALE_TEMP_SECONDS = 3600  # 临时文件超过该时间未更新视为残留
+
+# 淘汰回调: 被删除文件的路径
+EvictionListener = Callable[[str], None]
+
+
+@dataclass
+class DirectoryPolicy:
+    """单个目录的清理策略"""
+    path: Path
+    max_bytes: int = 0  # 字节配额，0 表示不限制
+    max_age: float = 0  # 最长保留时间(秒)，从最近一次使用算起，0 表示不限制
+
+
+class DiskJanitor:
+    """按目录配额与保留时间淘汰最久未使用的文件"""
+
+    def __init__(self, policies: List[DirectoryPolicy], interval: float = JANITOR_INTERVAL,
+                 grace_seconds: float = JANITOR_GRACE_SECONDS):
+        """
+        Args:
+            policies: 各目录的清理策略
+            interval: 清理间隔(秒)，0 表示不启动后台清理
+            grace_seconds: 最近该时间内写入或使用过的文件不会被删除
+        """
+        self.policies = policies
+        self.interval = interval
+        self.grace = grace_seconds
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._pinned: Counter = Counter()
+        self._listeners: List[EvictionListener] = []
+        self._timer: Optional[threading.Timer] = None
+        self._runs = 0
+        self._evicted = 0
+        self._reclaimed = 0
+
+    @staticmethod
+    def _key(path) -> str:
+        return os.path.abspath(path)
+
+    def pin(self, path):
+        """标记文件正在使用，清理时跳过（可重复 pin，需配对 unpin）"""
+        with self._lock:
+            self._pinned[self._key(path)] += 1
+
+    def unpin(self, path):
+        key = self._key(path)
+        with self._lock:
+            self._pinned[key] -= 1
+            if self._pinned[key] <= 0:
+                del self._pinned[key]
+
+    @contextmanager
+    def pinned(self, *paths):
+        """在 with 块内保护这些文件不被清理（忽略空路径）"""
+        paths = [path for path in paths if path]
+        for path in paths:
+            self.pin(path)
+        try:
+            yield
+        finally:
+            for path in paths:
+                self.unpin(path)
+
+    def is_pinned(self, path) -> bool:
+        with self._lock:
+            return self._key(path) in self._pinned
+
+    def add_listener(self, listener: EvictionListener):
+        """注册淘汰回调（如让内存缓存失效），每删除一个文件调用一次"""
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: EvictionListener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _scan(self, directory: Path) -> List[Tuple[float, int, str, str]]:
+        """返回目录下的文件 [(最近使用时间, 字节数, 路径, 文件名)]"""
+        files = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if not entry.is_file(follow_symlinks=False):
+                            continue
+                        stat = entry.stat(follow_symlinks=False)
+                    except FileNotFoundError:
+                        continue
+                    files.append((max(stat.st_atime, stat.st_mtime), stat.st_size, entry.path, entry.name))
+        except FileNotFoundError:
+            pass
+        return files
+
+    def _remove(self, path: str) -> bool:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            logger.warning(f"删除文件失败: {path}, {e}")
+            return False
+        for listener in self._listeners:
+            try:
+                listener(path)
+            except Exception as e:
+                logger.warning(f"淘汰回调失败: {path}, {e}")
+        return True
+
+    def sweep(self, policy: DirectoryPolicy, now: Optional[float] = None) -> Tuple[int, int, int]:
+        """
+        清理单个目录：先删除过期文件与残留的临时文件，再按最久未使用淘汰到配额以内
+
+        Returns:
+            (删除文件数, 回收字节数, 剩余字节数)
+        """
+        now = time.time() if now is None else now
+        files = self._scan(policy.path)
+        total = sum(size for _, size, _, _ in files)
+        candidates = []
+        for used_at, size, path, name in files:
+            idle = now - used_at
+            if name.endswith(TEMP_SUFFIX):
+                # 下载中的临时文件只在长时间未更新时清理，且不计入 LRU
+                if idle > STALE_TEMP_SECONDS:
+                    candidates.append((used_at, size, path, True))
+                continue
+            if idle < self.grace or self.is_pinned(path):
+                continue
+            candidates.append((used_at, size, path, policy.max_age > 0 and idle > policy.max_age))
+
+        candidates.sort()
+        evicted = reclaimed = 0
+        for used_at, size, path, expired in candidates:
+            if not expired and (policy.max_bytes <= 0 or total <= policy.max_bytes):
+                continue
+            if self._remove(path):
+                evicted += 1
+                reclaimed += size
+                total -= size
+        if policy.max_bytes > 0 and total > policy.max_bytes:
+            logger.warning(f"{policy.path} 仍超出配额: {total / 1024 / 1024:.1f}MB "
+                           f"> {policy.max_bytes / 1024 / 1024:.1f}MB（其余文件正在使用或刚写入）")
+        return evicted, reclaimed, total
+
+    def run_once(self) -> int:
+        """
+        清理所有目录
+
+        Returns:
+            本次回收的字节数
+        """
+        reclaimed_total = 0
+        with self._run_lock:
+            now = time.time()
+            for policy in self.policies:
+                evicted, reclaimed, remaining = self.sweep(policy, now)
+                reclaimed_total += reclaimed
+                self._evicted += evicted
+                if evicted:
+                    logger.info(f"磁盘清理 {policy.path.name}/: 删除 {evicted} 个文件，"
+                                f"回收 {reclaimed / 1024 / 1024:.1f}MB，剩余 {remaining / 1024 / 1024:.1f}MB")
+            self._runs += 1
+            self._reclaimed += reclaimed_total
+        return reclaimed_total
+
+    def start(self):
+        """启动后台定期清理（interval 为 0 时不启动）"""
+        if self.interval > 0 and self._timer is None:
+            self._schedule(0)
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _schedule(self, delay: float):
+        self._timer = threading.Timer(delay, self._periodic_run)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _periodic_run(self):
+        """定期清理"""
+        try:
+            self.run_once()
+        except Exception as e:
+            logger.error(f"磁盘清理失败: {e}", exc_info=True)
+        finally:
+            if self._timer is not None:
+                self._schedule(self.interval)  # 重新调度
+
+    def stats(self) -> Dict[str, int]:
+        """返回 {runs, evicted, reclaimed_bytes, pinned}"""
+        with self._lock:
+            pinned = len(self._pinned)
+        return {"runs": self._runs, "evicted": self._evicted, "reclaimed_bytes": self._reclaimed, "pinned": pinned}
+
+
+# 全局单例
+disk_janitor = DiskJanitor([
+    DirectoryPolicy(IMAGE_DIR, IMAGE_DIR_QUOTA_MB * 1024 * 1024, IMAGE_DIR_MAX_AGE_HOURS * 3600),
+    DirectoryPolicy(IMAGEGEN_DIR, IMAGEGEN_DIR_QUOTA_MB * 1024 * 1024, IMAGEGEN_DIR_MAX_AGE_HOURS * 3600),
+    # 缩放版本可随时重新生成，源图删除后遗留的版本随保留时间清理
+    DirectoryPolicy(VARIANT_DIR, IMAGE_VARIANT_CACHE_MB * 1024 * 1024, IMAGEGEN_DIR_MAX_AGE_HOURS * 3600),
+    DirectoryPolicy(COMPRESSED_DIR, COMPRESSED_DIR_QUOTA_MB * 1024 * 1024, COMPRESSED_DIR_MAX_AGE_HOURS * 3600),
+])
@@ -0,0 +1,199 @@
+"""
+流式文件下载
+所有图片下载（收到的图片、Gemini/CodeBuddy 生成结果）共用的下载原语：
+分块写入临时文件，下载过程中限制大小、计算 SHA-256 并按文件头识别真实格式，
+完成后原子改名；任何失败都会删除临时文件，不会留下半个文件
+"""
+import hashlib
+import logging
+import os
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Optional
+
+from config import DOWNLOAD_MAX_MB
+from deadline import Deadline, timeout_for
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 65536
+SNIFF_BYTES = 32  # 识别格式所需的文件头长度
+
+# 格式 -> 扩展名
+IMAGE_EXTENSIONS = {
+    "jpeg": "jpg", "png": "png", "gif": "gif", "webp": "webp", "bmp": "bmp", "avif": "avif", "heic": "heic",
+}
+
+
+class DownloadError(Exception):
+    """下载失败（内容不合法或超出限制）"""
+
+
+def sniff_image_format(head: bytes) -> Optional[str]:
+    """
+    按文件头识别图片格式
+
+    Returns:
+        'jpeg' / 'png' / 'gif' / 'webp' / 'bmp' / 'avif' / 'heic'，无法识别返回 None
+    """
+    if head.startswith(b'\xff\xd8\xff'):
+        return "jpeg"
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return "png"
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return "gif"
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return "webp"
+    if head.startswith(b'BM'):
+        return "bmp"
+    if head[4:8] == b'ftyp':
+        brand = head[8:12]
+        if brand in (b'avif', b'avis'):
+            return "avif"
+        if brand in (b'heic', b'heix', b'mif1', b'msf1'):
+            return "heic"
+    return None
+
+
+@dataclass
+class DownloadResult:
+    """下载结果"""
+    path: str
+    size: int
+    sha256: str
+    format: Optional[str]  # sniff_image_format 的结果
+
+    @property
+    def ext(self) -> str:
+        """按真实格式得到的扩展名（含点号）"""
+        return f".{IMAGE_EXTENSIONS.get(self.format, 'bin')}"
+
+
+# 完成处理函数: (临时文件路径, 下载结果) -> 最终路径；需自行把临时文件移走或删除
+FinalizeFunc = Callable[[str, DownloadResult], str]
+
+
+class StreamingFile:
+    """边写边校验的临时文件，供同步与协程下载共用"""
+
+    def __init__(self, directory: Path, max_bytes: int, deadline: Optional[Deadline] = None,
+                 label: str = "下载文件"):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.deadline = deadline
+        self.label = label
+        self.tmp_path = str(self.directory / f".{uuid.uuid4().hex}.part")
+        self.size = 0
+        self._digest = hashlib.sha256()
+        self._head = b''
+        self._file = open(self.tmp_path, 'wb')
+
+    def check_length(self, content_length: Optional[str]):
+        """响应头声明的大小已超出上限时提前放弃"""
+        if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+            raise DownloadError(f"{self.label}: 文件大小 {int(content_length)} 超出上限 {self.max_bytes}")
+
+    def write(self, chunk: bytes):
+        if not chunk:
+            return
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise DownloadError(f"{self.label}: 文件大小超出上限 {self.max_bytes}")
+        if len(self._head) < SNIFF_BYTES:
+            self._head += chunk[:SNIFF_BYTES - len(self._head)]
+        self._digest.update(chunk)
+        self._file.write(chunk)
+        if self.deadline is not None:
+            self.deadline.check(self.label)
+
+    def commit(self, stem: Optional[str], image_only: bool, finalize: Optional[FinalizeFunc]) -> DownloadResult:
+        """
+        写入完成：校验格式后原子改名为 <stem><扩展名>（stem 为空时使用内容哈希），
+        或交给 finalize 处理
+        """
+        self._file.close()
+        result = DownloadResult(self.tmp_path, self.size, self._digest.hexdigest(), sniff_image_format(self._head))
+        if image_only and result.format is None:
+            raise DownloadError(f"{self.label}: 内容不是可识别的图片 (头部 {self._head[:8].hex()})")
+        if finalize is not None:
+            result.path = finalize(self.tmp_path, result)
+        else:
+            result.path = str(self.directory / f"{stem or result.sha256}{result.ext}")
+            os.replace(self.tmp_path, result.path)
+        return result
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self.tmp_path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        return False
+
+
+def download_file(url: str, directory: Path, stem: Optional[str] = None, *,
+                  finalize: Optional[FinalizeFunc] = None, headers: Optional[dict] = None,
+                  max_bytes: int = DOWNLOAD_MAX_MB * 1024 * 1024, timeout: float = 60,
+                  deadline: Optional[Deadline] = None, label: str = "下载图片",
+                  image_only: bool = True, session=None) -> DownloadResult:
+    """
+    流式下载到 directory
+
+    Args:
+        url: 下载地址
+        directory: 保存目录（临时文件也在此目录，保证改名是原子的）
+        stem: 文件名（不含扩展名，扩展名按真实格式决定），为空时使用内容哈希
+        finalize: 自定义完成处理（如登记到缓存），为空时原子改名
+        headers: 请求头
+        max_bytes: 大小上限
+        timeout: 单次调用超时上限(秒)
+        deadline: 消息处理截止时间(可选)
+        label: 日志标签
+        image_only: 内容不是图片时视为失败
+        session: requests 会话，默认 http_client.download_session
+
+    Returns:
+        DownloadResult
+
+    Raises:
+        DownloadError / requests 异常 / DeadlineExceeded
+    """
+    if session is None:
+        from http_client import http_client
+        session = http_client.download_session
+    with session.get(url, headers=headers, timeout=timeout_for(deadline, timeout, label), stream=True) as response:
+        response.raise_for_status()
+        with StreamingFile(directory, max_bytes, deadline, label) as sink:
+            sink.check_length(response.headers.get("Content-Length"))
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                sink.write(chunk)
+            result = sink.commit(stem, image_only, finalize)
+    logger.info(f"{label}完成: {result.path} ({result.size / 1024:.1f}KB, {result.format})")
+    return result
+
+
+async def download_file_async(url: str, directory: Path, stem: Optional[str] = None, *,
+                              finalize: Optional[FinalizeFunc] = None, headers: Optional[dict] = None,
+                              max_bytes: int = DOWNLOAD_MAX_MB * 1024 * 1024, timeout: float = 60,
+                              deadline: Optional[Deadline] = None, label: str = "下载图片",
+                              image_only: bool = True) -> DownloadResult:
+    """download_file 的协程版本，经 async_http_client 下载"""
+    from async_http_client import async_http_client
+
+    with StreamingFile(directory, max_bytes, deadline, label) as sink:
+        await async_http_client.download(
+            url, sink.write, headers=headers, timeout=timeout_for(deadline, timeout, label),
+            on_response=lambda resp: sink.check_length(resp.headers.get("Content-Length")),
+        )
+        result = sink.commit(stem, image_only, finalize)
+    logger.info(f"{label}完成: {result.path} ({result.size / 1024:.1f}KB, {result.format})")
+    return result
@@ -4,9 +4,11 @@ Gemini 图片生成模块
 集成自 /root/project-wb/gemini-image 项目
 """
 import os
+import asyncio
 import json
 import time
 import logging
+import threading
 import uuid
 import shutil
 from pathlib import Path
@@ -19,12 +21,17 @@ from tencentcloud.common.profile.http_profile import HttpProfile
 from tencentcloud.common.exception.tencent_cloud_sdk_exception import TencentCloudSDKException
 from tencentcloud.vod.v20180717 import vod_client, models
 
+from deadline import Deadline, timeout_for
+from downloader import download_file, download_file_async
+
 logger = logging.getLogger(__name__)
 
 
 class GeminiImageGenerator:
     """Gemini 图片生成器 - 使用腾讯云 VOD AI 服务"""
     
+    VOD_REQ_TIMEOUT = 60  # VOD API 默认请求超时(秒)
+    
     def __init__(self, output_dir: str = None):
         """
         初始化生成器
@@ -60,16 +67,57 @@ class GeminiImageGenerator:
             self.output_dir = BASE_DIR / "imagegen"
         
         self.output_dir.mkdir(exist_ok=True)
+        
+        self._vod_client: Optional[vod_client.VodClient] = None
+        self._vod_client_lock = threading.Lock()
     
     def is_enabled(self) -> bool:
         """检查生成器是否已启用"""
         return self.enabled
     
+    def warm_up(self, timeout: float = 10):
+        """
+        预热 VOD 长连接（DNS 解析与 TLS 握手），不调用任何业务 API
+        
+        Args:
+            timeout: 超时(秒)
+        """
+        if not self.enabled:
+            return
+        client = self._create_vod_client()
+        # SDK 未提供预连接接口，直接使用其内部 Session 发起一次 HEAD；
+        # 内部结构随 SDK 版本变化，取不到时跳过预热（首个请求照常建立连接）
+        conn = getattr(getattr(client, "request", None), "conn", None)
+        session = getattr(conn, "_session", None)
+        if session is None or not hasattr(session, "head"):
+            logger.info("VOD SDK 未暴露内部 Session，跳过连接预热")
+            return
+        session.head(f"https://{self.api_endpoint}/", timeout=timeout)
+    
     def get_model_info(self) -> str:
         """获取模型信息字符串"""
         return f"Gemini {self.model_name} v{self.model_version}"
     
-    def _create_vod_client(self) -> vod_client.VodClient:
+    def _create_vod_client(self, deadline: Optional[Deadline] = None) -> vod_client.VodClient:
+        """
+        获取 VOD 客户端
+        
+        剩余预算充足时复用同一个保持长连接的客户端（启动预热的连接也在其中），
+        预算不足默认超时时创建一个短超时的临时客户端。
+        
+        Args:
+            deadline: 消息处理截止时间(可选)，用于限制单次 API 调用超时
+        """
+        req_timeout = max(1, int(timeout_for(deadline, self.VOD_REQ_TIMEOUT, "VOD API")))
+        if req_timeout < self.VOD_REQ_TIMEOUT:
+            return self._build_vod_client(req_timeout)
+        
+        with self._vod_client_lock:
+            if self._vod_client is None:
+                self._vod_client = self._build_vod_client(self.VOD_REQ_TIMEOUT, keep_alive=True)
+            return self._vod_client
+    
+    def _build_vod_client(self, req_timeout: int, keep_alive: bool = False) -> vod_client.VodClient:
         """创建 VOD 客户端"""
         # 创建凭证
         cred = credential.Credential(self.secret_id, self.secret_key)
@@ -77,6 +125,8 @@ class GeminiImageGenerator:
         # 配置HTTP选项
         http_profile = HttpProfile()
         http_profile.endpoint = self.api_endpoint
+        http_profile.reqTimeout = req_timeout
+        http_profile.keepAlive = keep_alive
         
         # 配置客户端选项
         client_profile = ClientProfile()
@@ -91,13 +141,46 @@ class GeminiImageGenerator:
             return False
         return path.startswith(('http://', 'https://', 'ftp://'))
     
-    def _create_aigc_task(self, prompt: str, image_url: Optional[str] = None) -> str:
+    def _prepare_reference_url(self, source_image_path: str) -> str:
+        """
+        获取参考图片的公网 URL，本地图片会复制到图片服务器目录
+        
+        Args:
+            source_image_path: 源图片路径或URL
+        
+        Returns:
+            公网可访问的图片 URL
+        """
+        if self._is_url(source_image_path):
+            return source_image_path
+        
+        logger.info(f"本地图片需要上传: {source_image_path}")
+        # 将本地图片复制到IMAGE_SERVER目录
+        from config import IMAGE_SERVER_URL, BASE_DIR
+        
+        # 生成唯一文件名
+        filename = f"ref_{uuid.uuid4().hex[:16]}{os.path.splitext(source_image_path)[1]}"
+        target_dir = BASE_DIR / "imagegen"
+        target_path = target_dir / filename
+        
+        # 复制文件
+        shutil.copy(source_image_path, target_path)
+        logger.info(f"参考图片已复制到: {target_path}")
+        
+        # 构建公网URL
+        image_url = f"{IMAGE_SERVER_URL}/{filename}"
+        logger.info(f"参考图片URL: {image_url}")
+        return image_url
+    
+    def _create_aigc_task(self, prompt: str, image_url: Optional[str] = None,
+                          deadline: Optional[Deadline] = None) -> str:
         """
         创建 AI 图像生成任务
         
         Args:
             prompt: 图像生成提示词
             image_url: 参考图片 URL(可选,用于图生图)
+            deadline: 消息处理截止时间(可选)
         
         Returns:
             任务 ID
@@ -105,7 +188,7 @@ class GeminiImageGenerator:
         Raises:
             TencentCloudSDKException: SDK 调用异常
         """
-        client = self._create_vod_client()
+        client = self._create_vod_client(deadline)
         
         # 构建请求参数
         params = {
@@ -141,17 +224,18 @@ class GeminiImageGenerator:
         logger.info(f"任务创建成功: TaskId={task_id}")
         return task_id
     
-    def _get_task_detail(self, task_id: str) -> dict:
+    def _get_task_detail(self, task_id: str, deadline: Optional[Deadline] = None) -> dict:
         """
         查询任务详情
         
         Args:
             task_id: 任务 ID
+            deadline: 消息处理截止时间(可选)
         
         Returns:
             任务详情字典
         """
-        client = self._create_vod_client()
+        client = self._create_vod_client(deadline)
         
         # 构建请求参数
         params = {
@@ -206,7 +290,8 @@ class GeminiImageGenerator:
         max_wait_seconds: int = 300,
         initial_interval: float = 2.0,
         max_interval: float = 15.0,
-        backoff_factor: float = 1.5
+        backoff_factor: float = 1.5,
+        deadline: Optional[Deadline] = None
     ) -> Optional[str]:
         """
         轮询等待任务完成（指数退避）
@@ -217,12 +302,15 @@ class GeminiImageGenerator:
             initial_interval: 初始轮询间隔(秒)
             max_interval: 最大轮询间隔(秒)
             backoff_factor: 间隔增长倍数
+            deadline: 消息处理截止时间(可选)，最大等待时间不超过剩余预算
         
         Returns:
             生成的图片URL,超时或失败返回None
         """
         start_time = time.time()
         interval = initial_interval
+        if deadline is not None:
+            max_wait_seconds = min(max_wait_seconds, deadline.remaining())
         
         logger.info(f"开始轮询任务状态 (TaskId: {task_id})")
         
@@ -235,7 +323,7 @@ class GeminiImageGenerator:
             
             try:
                 # 查询任务详情
-                detail = self._get_task_detail(task_id)
+                detail = self._get_task_detail(task_id, deadline)
                 status = detail.get("Status")
                 
                 logger.info(f"[{int(elapsed_time)}s] 任务状态: {status}")
@@ -247,46 +335,36 @@ class GeminiImageGenerator:
                 elif status == "FAIL":
                     return None
                 else:
-                    # 指数退避等待
-                    time.sleep(min(interval, max_interval))
+                    # 指数退避等待（不超过剩余等待时间）
+                    remaining = max_wait_seconds - (time.time() - start_time)
+                    time.sleep(max(0, min(interval, max_interval, remaining)))
                     interval *= backoff_factor
                     
             except Exception as err:
                 logger.error(f"查询任务详情时出错: {err}")
                 return None
     
-    def _download_image(self, image_url: str, filename: str = None) -> Optional[str]:
+    def _download_image(self, image_url: str, filename: str = None,
+                        deadline: Optional[Deadline] = None) -> Optional[str]:
         """
         从 URL 下载图片到本地
         
         Args:
             image_url: 图片 URL
-            filename: 保存的文件名(可选)
+            filename: 保存的文件名(可选，不含扩展名，扩展名按图片真实格式决定)
+            deadline: 消息处理截止时间(可选)
         
         Returns:
             本地文件路径,失败返回 None
         """
-        from http_client import http_client
-        
         try:
-            if not filename:
-                # 从 URL 提取扩展名
-                ext = image_url.split('.')[-1].split('?')[0]
-                if ext not in ['png', 'jpg', 'jpeg', 'gif', 'webp']:
-                    ext = 'jpg'
-                filename = f"gemini_{uuid.uuid4().hex[:16]}.{ext}"
-            
-            local_path = self.output_dir / filename
-            
             logger.info(f"下载图片: {image_url}")
-            response = http_client.download_session.get(image_url, timeout=60)
-            response.raise_for_status()
-            
-            with open(local_path, 'wb') as f:
-                f.write(response.content)
-            
-            logger.info(f"图片已保存: {local_path}")
-            return str(local_path)
+            result = download_file(
+                image_url, self.output_dir, filename or f"gemini_{uuid.uuid4().hex[:16]}",
+                timeout=60, deadline=deadline, label="下载生成图片"
+            )
+            logger.info(f"图片已保存: {result.path}")
+            return result.path
             
         except Exception as e:
             logger.error(f"下载图片失败: {e}")
@@ -294,13 +372,19 @@ class GeminiImageGenerator:
             logger.error(traceback.format_exc())
             return None
     
-    def generate_text_to_image(self, prompt: str, max_wait_seconds: int = 300) -> Optional[Tuple[str, str]]:
+    def generate_text_to_image(
+        self,
+        prompt: str,
+        max_wait_seconds: int = 300,
+        deadline: Optional[Deadline] = None
+    ) -> Optional[Tuple[str, str]]:
         """
         文生图
         
         Args:
             prompt: 图片描述提示词
             max_wait_seconds: 最大等待时间(秒)
+            deadline: 消息处理截止时间(可选)
         
         Returns:
             (图片本地路径, 模型信息) 元组,失败返回 None
@@ -311,17 +395,17 @@ class GeminiImageGenerator:
         
         try:
             # 步骤1: 创建任务
-            task_id = self._create_aigc_task(prompt)
+            task_id = self._create_aigc_task(prompt, deadline=deadline)
             
             # 步骤2: 等待任务完成
-            file_url = self._wait_for_task_completion(task_id, max_wait_seconds)
+            file_url = self._wait_for_task_completion(task_id, max_wait_seconds, deadline=deadline)
             
             if not file_url:
                 logger.error("任务未完成或失败")
                 return None
             
             # 步骤3: 下载图片到本地
-            local_path = self._download_image(file_url)
+            local_path = self._download_image(file_url, deadline=deadline)
             
             if local_path:
                 model_info = self.get_model_info()
@@ -344,7 +428,8 @@ class GeminiImageGenerator:
         self,
         prompt: str,
         source_image_path: str,
-        max_wait_seconds: int = 300
+        max_wait_seconds: int = 300,
+        deadline: Optional[Deadline] = None
     ) -> Optional[Tuple[str, str]]:
         """
         图生图
@@ -353,6 +438,7 @@ class GeminiImageGenerator:
             prompt: 修改描述提示词
             source_image_path: 源图片路径或URL
             max_wait_seconds: 最大等待时间(秒)
+            deadline: 消息处理截止时间(可选)
         
         Returns:
             (图片本地路径, 模型信息) 元组,失败返回 None
@@ -363,40 +449,20 @@ class GeminiImageGenerator:
         
         try:
             # 如果是本地路径,需要上传到公网可访问的位置
-            image_url = source_image_path
-            
-            if not self._is_url(source_image_path):
-                logger.info(f"本地图片需要上传: {source_image_path}")
-                # 将本地图片复制到IMAGE_SERVER目录
-                import shutil
-                import os
-                from config import IMAGE_SERVER_URL, BASE_DIR
-                
-                # 生成唯一文件名
-                filename = f"ref_{uuid.uuid4().hex[:16]}{os.path.splitext(source_image_path)[1]}"
-                target_dir = BASE_DIR / "imagegen"
-                target_path = target_dir / filename
-                
-                # 复制文件
-                shutil.copy(source_image_path, target_path)
-                logger.info(f"参考图片已复制到: {target_path}")
-                
-                # 构建公网URL
-                image_url = f"{IMAGE_SERVER_URL}/{filename}"
-                logger.info(f"参考图片URL: {image_url}")
+            image_url = self._prepare_reference_url(source_image_path)
             
             # 步骤1: 创建任务(带参考图片)
-            task_id = self._create_aigc_task(prompt, image_url)
+            task_id = self._create_aigc_task(prompt, image_url, deadline=deadline)
             
             # 步骤2: 等待任务完成
-            file_url = self._wait_for_task_completion(task_id, max_wait_seconds)
+            file_url = self._wait_for_task_completion(task_id, max_wait_seconds, deadline=deadline)
             
             if not file_url:
                 logger.error("任务未完成或失败")
                 return None
             
             # 步骤3: 下载图片到本地
-            local_path = self._download_image(file_url)
+            local_path = self._download_image(file_url, deadline=deadline)
             
             if local_path:
                 model_info = self.get_model_info()
@@ -416,5 +482,130 @@ class GeminiImageGenerator:
             return None
 
 
+    # ------------------------------------------------------------------
+    # 协程版本：VOD SDK 为同步实现，SDK 调用放到线程中执行，
+    # 轮询等待与图片下载由事件循环驱动
+    # ------------------------------------------------------------------
+
+    async def _wait_for_task_completion_async(
+        self,
+        task_id: str,
+        max_wait_seconds: int = 300,
+        initial_interval: float = 2.0,
+        max_interval: float = 15.0,
+        backoff_factor: float = 1.5,
+        deadline: Optional[Deadline] = None
+    ) -> Optional[str]:
+        """轮询等待任务完成（协程版本），参数同 _wait_for_task_completion"""
+        start_time = time.time()
+        interval = initial_interval
+        if deadline is not None:
+            max_wait_seconds = min(max_wait_seconds, deadline.remaining())
+        
+        logger.info(f"开始轮询任务状态 (TaskId: {task_id})")
+        
+        while True:
+            elapsed_time = time.time() - start_time
+            
+            if elapsed_time > max_wait_seconds:
+                logger.error(f"超时: 任务在{max_wait_seconds}秒内未完成")
+                return None
+            
+            try:
+                detail = await asyncio.to_thread(self._get_task_detail, task_id, deadline)
+                status = detail.get("Status")
+                
+                logger.info(f"[{int(elapsed_time)}s] 任务状态: {status}")
+                
+                if status == "FINISH":
+                    return self._extract_file_url(detail)
+                elif status == "FAIL":
+                    return None
+                else:
+                    remaining = max_wait_seconds - (time.time() - start_time)
+                    await asyncio.sleep(max(0, min(interval, max_interval, remaining)))
+                    interval *= backoff_factor
+                    
+            except Exception as err:
+                logger.error(f"查询任务详情时出错: {err}")
+                return None
+    
+    async def _download_image_async(self, image_url: str, filename: str = None,
+                                    deadline: Optional[Deadline] = None) -> Optional[str]:
+        """从 URL 下载图片到本地（协程版本），参数同 _download_image"""
+        try:
+            logger.info(f"下载图片: {image_url}")
+            result = await download_file_async(
+                image_url, self.output_dir, filename or f"gemini_{uuid.uuid4().hex[:16]}",
+                timeout=60, deadline=deadline, label="下载生成图片"
+            )
+            logger.info(f"图片已保存: {result.path}")
+            return result.path
+            
+        except Exception as e:
+            logger.error(f"下载图片失败: {e}", exc_info=True)
+            return None
+    
+    async def _generate_async(
+        self,
+        prompt: str,
+        image_url: Optional[str],
+        max_wait_seconds: int,
+        deadline: Optional[Deadline],
+        label: str
+    ) -> Optional[Tuple[str, str]]:
+        """创建任务、等待完成并下载结果（协程版本）"""
+        if not self.enabled:
+            logger.error("Gemini 图片生成器未启用,请检查配置")
+            return None
+        
+        try:
+            task_id = await asyncio.to_thread(self._create_aigc_task, prompt, image_url, deadline)
+            
+            file_url = await self._wait_for_task_completion_async(task_id, max_wait_seconds, deadline=deadline)
+            if not file_url:
+                logger.error("任务未完成或失败")
+                return None
+            
+            local_path = await self._download_image_async(file_url, deadline=deadline)
+            if local_path:
+                model_info = self.get_model_info()
+                logger.info(f"{label}成功: {local_path}, 模型: {model_info}")
+                return (local_path, model_info)
+            logger.error("图片下载失败")
+            return None
+            
+        except TencentCloudSDKException as e:
+            logger.error(f"SDK 调用失败: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"{label}失败: {e}", exc_info=True)
+            return None
+    
+    async def generate_text_to_image_async(
+        self,
+        prompt: str,
+        max_wait_seconds: int = 300,
+        deadline: Optional[Deadline] = None
+    ) -> Optional[Tuple[str, str]]:
+        """文生图（协程版本），参数同 generate_text_to_image"""
+        return await self._generate_async(prompt, None, max_wait_seconds, deadline, "文生图")
+    
+    async def generate_image_to_image_async(
+        self,
+        prompt: str,
+        source_image_path: str,
+        max_wait_seconds: int = 300,
+        deadline: Optional[Deadline] = None
+    ) -> Optional[Tuple[str, str]]:
+        """图生图（协程版本），参数同 generate_image_to_image"""
+        try:
+            image_url = self._prepare_reference_url(source_image_path)
+        except Exception as e:
+            logger.error(f"图生图失败: {e}", exc_info=True)
+            return None
+        return await self._generate_async(prompt, image_url, max_wait_seconds, deadline, "图生图")
+
+
 # 创建全局实例
 gemini_image_generator = GeminiImageGenerator()
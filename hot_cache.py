@@ -0,0 +1,150 @@
+"""
+图片服务器的热点对象缓存
+刚生成的图片会在几秒内被多次请求（钉钉预览抓取、群成员逐个打开、nginx 首次回源），
+在内存中缓存最近提供过的文件，命中时不再读盘。
+条目按 (路径, mtime_ns, 大小) 校验，文件被改写后自然失效；被磁盘清理删除时经回调失效
+"""
+import logging
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from config import IMAGE_SERVER_CACHE_MB, IMAGE_SERVER_CACHE_MAX_OBJECT_KB
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class HotObject:
+    """缓存的文件内容与校验信息"""
+    data: bytes
+    mtime_ns: int
+    size: int
+    content_type: str
+
+    @property
+    def etag(self) -> str:
+        """与 aiohttp FileResponse 相同的强 ETag，命中与否对客户端表现一致"""
+        return f"{self.mtime_ns:x}-{self.size:x}"
+
+    @property
+    def last_modified(self) -> float:
+        return self.mtime_ns / 1e9
+
+
+class HotObjectCache:
+    """按字节数限制的 LRU 内存缓存"""
+
+    def __init__(self, max_bytes: int = IMAGE_SERVER_CACHE_MB * 1024 * 1024,
+                 max_object_bytes: int = IMAGE_SERVER_CACHE_MAX_OBJECT_KB * 1024):
+        """
+        Args:
+            max_bytes: 缓存总字节数上限，0 表示关闭缓存
+            max_object_bytes: 单个文件的大小上限，更大的文件直接 sendfile
+        """
+        self.max_bytes = max_bytes
+        self.max_object_bytes = min(max_object_bytes, max_bytes)
+        self._lock = threading.Lock()
+        self._objects: "OrderedDict[str, HotObject]" = OrderedDict()
+        self._total = 0
+        self._hits = 0
+        self._misses = 0
+        self._bypass = 0
+        self._hit_bytes = 0
+        self._evictions = 0
+
+    @staticmethod
+    def _key(path) -> str:
+        return os.path.realpath(path)
+
+    def admits(self, size: int) -> bool:
+        """该大小的文件是否可以缓存"""
+        return 0 < size <= self.max_object_bytes
+
+    def get(self, path, st: os.stat_result) -> Optional[HotObject]:
+        """
+        查找缓存，st 为文件当前的 stat 结果；mtime 或大小变化时视为未命中并丢弃旧条目
+
+        超过单个文件上限、不可能被缓存的文件计入 bypass 而不是未命中，命中率只反映可缓存的请求
+        """
+        if not self.admits(st.st_size):
+            with self._lock:
+                self._bypass += 1
+            return None
+        key = self._key(path)
+        with self._lock:
+            obj = self._objects.get(key)
+            if obj is not None and (obj.mtime_ns, obj.size) != (st.st_mtime_ns, st.st_size):
+                self._remove(key)
+                obj = None
+            if obj is None:
+                self._misses += 1
+                return None
+            self._objects.move_to_end(key)
+            self._hits += 1
+            self._hit_bytes += obj.size
+            return obj
+
+    def put(self, path, data: bytes, st: Optional[os.stat_result] = None) -> Optional[HotObject]:
+        """
+        缓存文件内容（文件过大时不缓存）
+
+        Args:
+            path: 文件路径
+            data: 文件内容
+            st: 读取内容时的 stat 结果，为空时重新 stat
+
+        Returns:
+            缓存条目，未缓存时返回 None
+        """
+        if not self.admits(len(data)):
+            return None
+        st = st or os.stat(path)
+        if st.st_size != len(data):
+            return None  # 读取期间文件被改写
+        key = self._key(path)
+        content_type = mimetypes.guess_type(key)[0] or "application/octet-stream"
+        obj = HotObject(data, st.st_mtime_ns, st.st_size, content_type)
+        with self._lock:
+            if key in self._objects:
+                self._remove(key)
+            self._objects[key] = obj
+            self._total += obj.size
+            while self._total > self.max_bytes:
+                self._remove(next(iter(self._objects)))
+                self._evictions += 1
+        return obj
+
+    def load(self, path) -> Optional[HotObject]:
+        """读取文件并缓存（在工作线程中调用）"""
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            if not self.admits(st.st_size):
+                return None
+            data = f.read()
+        return self.put(path, data, st)
+
+    def invalidate(self, path):
+        """移除条目，作为 disk_janitor 的淘汰回调"""
+        with self._lock:
+            self._remove(self._key(path))
+
+    def _remove(self, key: str):
+        """调用方需持有锁"""
+        obj = self._objects.pop(key, None)
+        if obj is not None:
+            self._total -= obj.size
+
+    def stats(self) -> Dict[str, float]:
+        """返回 {objects, bytes, hits, misses, bypass, hit_ratio, hit_bytes, evictions}"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "objects": len(self._objects), "bytes": self._total,
+                "hits": self._hits, "misses": self._misses, "bypass": self._bypass,
+                "hit_ratio": round(self._hits / lookups, 4) if lookups else 0.0,
+                "hit_bytes": self._hit_bytes, "evictions": self._evictions,
+            }
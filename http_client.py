@@ -1,12 +1,186 @@
 """全局 HTTP 连接池管理"""
 import requests
 from requests.adapters import HTTPAdapter
+from urllib3 import PoolManager
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import EmptyPoolError, MaxRetryError, ResponseError
 from urllib3.util.retry import Retry
+from urllib3.util.timeout import Timeout
+from collections import defaultdict
+import contextvars
 import threading
+import time
 import logging
 
+from config import (
+    HTTP_POOL_MAXSIZE_DINGTALK,
+    HTTP_POOL_MAXSIZE_CODEBUDDY,
+    HTTP_POOL_MAXSIZE_DOWNLOAD,
+    HTTP_POOL_HOST_MAXSIZE,
+    HTTP_POOL_BLOCK,
+    HTTP_POOL_TIMEOUT,
+    HTTP_POOL_STATS_INTERVAL,
+)
+from retry_budget import retry_budgets
+import rate_limiter
+
 logger = logging.getLogger(__name__)
 
+# 当前请求等待空闲连接的上限(秒)；requests 不向 urllib3 传 pool_timeout，由 adapter 在 send 时设置
+_pool_timeout: contextvars.ContextVar[float] = contextvars.ContextVar("http_pool_timeout", default=HTTP_POOL_TIMEOUT)
+
+
+def pool_timeout_for(timeout) -> float:
+    """
+    根据请求超时计算等待空闲连接的上限
+
+    取请求的连接超时（调用方已按消息截止时间收紧），并不超过 HTTP_POOL_TIMEOUT
+
+    Args:
+        timeout: requests 的 timeout 参数（秒数、(connect, read) 元组、urllib3 Timeout 或 None）
+
+    Returns:
+        等待上限(秒)
+    """
+    if isinstance(timeout, tuple):
+        timeout = timeout[0]
+    elif isinstance(timeout, Timeout):
+        timeout = timeout.connect_timeout
+    if isinstance(timeout, (int, float)):
+        return min(float(timeout), HTTP_POOL_TIMEOUT)
+    return HTTP_POOL_TIMEOUT
+
+
+class PoolStats:
+    """连接池统计（按主机），用于观察连接池是否被打满或频繁丢弃连接"""
+
+    FIELDS = ("checkouts", "waits", "wait_seconds", "created", "discarded")
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._hosts = defaultdict(lambda: dict.fromkeys(self.FIELDS, 0))
+
+    def record_checkout(self, host: str, wait_seconds: float = None):
+        """记录一次取连接；wait_seconds 非空表示因连接池已空而等待"""
+        with self._lock:
+            stats = self._hosts[host]
+            stats["checkouts"] += 1
+            if wait_seconds is not None:
+                stats["waits"] += 1
+                stats["wait_seconds"] += wait_seconds
+
+    def record_created(self, host: str):
+        """记录一次新建连接"""
+        with self._lock:
+            self._hosts[host]["created"] += 1
+
+    def record_discarded(self, host: str):
+        """记录一次因连接池已满而丢弃连接"""
+        with self._lock:
+            self._hosts[host]["discarded"] += 1
+
+    def snapshot(self) -> dict:
+        """返回 {host: {字段: 值}} 的快照"""
+        with self._lock:
+            return {host: dict(stats) for host, stats in self._hosts.items()}
+
+
+class _InstrumentedPoolMixin:
+    """为 urllib3 连接池添加取用/等待/新建/丢弃计数"""
+
+    stats: PoolStats = None
+
+    def _get_conn(self, timeout=None):
+        if timeout is None:
+            timeout = _pool_timeout.get()
+        # block 模式下池为空意味着需要等待其他线程归还连接
+        waiting = self.block and self.pool is not None and self.pool.empty()
+        start = time.monotonic() if waiting else None
+        conn = super()._get_conn(timeout)
+        self.stats.record_checkout(self.host, time.monotonic() - start if waiting else None)
+        return conn
+
+    def _new_conn(self):
+        self.stats.record_created(self.host)
+        return super()._new_conn()
+
+    def _put_conn(self, conn):
+        if conn is not None and self.pool is not None and self.pool.full():
+            self.stats.record_discarded(self.host)
+        super()._put_conn(conn)
+
+
+class _InstrumentedPoolManager(PoolManager):
+    """支持按主机覆盖连接池大小的 PoolManager"""
+
+    def __init__(self, *args, stats: PoolStats, host_maxsize: dict = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._host_maxsize = host_maxsize or {}
+        attrs = {"stats": stats}
+        self.pool_classes_by_scheme = {
+            "http": type("InstrumentedHTTPConnectionPool", (_InstrumentedPoolMixin, HTTPConnectionPool), attrs),
+            "https": type("InstrumentedHTTPSConnectionPool", (_InstrumentedPoolMixin, HTTPSConnectionPool), attrs),
+        }
+
+    def _new_pool(self, scheme, host, port, request_context=None):
+        if request_context is None:
+            request_context = self.connection_pool_kw.copy()
+        if host in self._host_maxsize:
+            request_context = dict(request_context, maxsize=self._host_maxsize[host])
+        return super()._new_pool(scheme, host, port, request_context)
+
+
+class BudgetedRetry(Retry):
+    """受全局重试预算约束的 urllib3 Retry，预算耗尽时按重试次数用尽处理"""
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        # 先由父类判断重试次数是否用尽（用尽时直接抛出 MaxRetryError）
+        new_retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        if _pool is not None:
+            request = retry_budgets.current(_pool.host)
+            allowed = request.retry() if request is not None else retry_budgets.get(_pool.host).try_retry()
+            if not allowed:
+                reason = error or ResponseError("retry budget exhausted")
+                raise MaxRetryError(_pool, url, reason) from reason
+        return new_retry
+
+
+class InstrumentedHTTPAdapter(HTTPAdapter):
+    """带连接池统计与重试预算的 HTTPAdapter"""
+
+    def __init__(self, stats: PoolStats, host_maxsize: dict = None, **kwargs):
+        # init_poolmanager 会在父类构造函数中调用，需先设置属性
+        self.stats = stats
+        self.host_maxsize = host_maxsize or {}
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        self._pool_connections = connections
+        self._pool_maxsize = maxsize
+        self._pool_block = block
+        self.poolmanager = _InstrumentedPoolManager(
+            num_pools=connections,
+            maxsize=maxsize,
+            block=block,
+            stats=self.stats,
+            host_maxsize=self.host_maxsize,
+            **pool_kwargs
+        )
+
+    def send(self, request, **kwargs):
+        # block 模式下等待空闲连接的时间受请求超时约束，连接池被长请求占满时不会无限期挂起
+        token = _pool_timeout.set(pool_timeout_for(kwargs.get("timeout")))
+        try:
+            # 每次 send 是一个逻辑请求；业务层已开启的逻辑请求会被复用
+            with retry_budgets.request(request.url):
+                return super().send(request, **kwargs)
+        except EmptyPoolError as e:
+            # 请求尚未发出，按连接超时处理，调用方可以安全重试
+            raise requests.exceptions.ConnectTimeout(e, request=request)
+        finally:
+            _pool_timeout.reset(token)
+
 
 class HttpClient:
     """线程安全的 HTTP 客户端，支持连接池复用"""
@@ -25,47 +199,100 @@ class HttpClient:
         if self._initialized:
             return
         self._initialized = True
+        self._stats = {}
 
         # 钉钉 API Session
         self.dingtalk_session = self._create_session(
-            pool_connections=5, pool_maxsize=10,
+            "dingtalk", pool_connections=5, pool_maxsize=HTTP_POOL_MAXSIZE_DINGTALK,
             retries=2, backoff_factor=0.5
         )
 
         # CodeBuddy API Session（长超时，重试由业务层控制）
         self.codebuddy_session = self._create_session(
-            pool_connections=3, pool_maxsize=5,
+            "codebuddy", pool_connections=3, pool_maxsize=HTTP_POOL_MAXSIZE_CODEBUDDY,
             retries=0, backoff_factor=0
         )
 
         # 通用下载 Session
         self.download_session = self._create_session(
-            pool_connections=5, pool_maxsize=10,
+            "download", pool_connections=5, pool_maxsize=HTTP_POOL_MAXSIZE_DOWNLOAD,
             retries=3, backoff_factor=1.0
         )
 
-        logger.info("HTTP 连接池已初始化")
+        logger.info(
+            f"HTTP 连接池已初始化: dingtalk={HTTP_POOL_MAXSIZE_DINGTALK}, "
+            f"codebuddy={HTTP_POOL_MAXSIZE_CODEBUDDY}, download={HTTP_POOL_MAXSIZE_DOWNLOAD}, "
+            f"block={HTTP_POOL_BLOCK}, pool_timeout={HTTP_POOL_TIMEOUT}s"
+        )
+
+        self._stats_timer = None
+        if HTTP_POOL_STATS_INTERVAL > 0:
+            self._start_stats_timer()
 
-    @staticmethod
-    def _create_session(pool_connections, pool_maxsize, retries, backoff_factor):
+    def _create_session(self, name, pool_connections, pool_maxsize, retries, backoff_factor):
         """创建带连接池的 HTTP Session"""
         session = requests.Session()
-        retry_strategy = Retry(
+        retry_strategy = BudgetedRetry(
             total=retries,
             backoff_factor=backoff_factor,
             status_forcelist=[502, 503, 504]
         )
-        adapter = HTTPAdapter(
+        stats = PoolStats(name)
+        self._stats[name] = stats
+        adapter = InstrumentedHTTPAdapter(
+            stats=stats,
+            host_maxsize=HTTP_POOL_HOST_MAXSIZE,
             pool_connections=pool_connections,
             pool_maxsize=pool_maxsize,
+            pool_block=HTTP_POOL_BLOCK,
             max_retries=retry_strategy
         )
         session.mount("https://", adapter)
         session.mount("http://", adapter)
         return session
 
+    def pool_stats(self) -> dict:
+        """
+        获取连接池统计
+
+        Returns:
+            {session 名称: {host: {checkouts, waits, wait_seconds, created, discarded}}}
+        """
+        return {name: stats.snapshot() for name, stats in self._stats.items()}
+
+    def log_pool_stats(self):
+        """输出连接池、重试预算与钉钉限流统计日志，出现等待、丢弃、拒绝重试或限流时以 WARNING 级别输出"""
+        for name, hosts in self.pool_stats().items():
+            for host, s in hosts.items():
+                level = logging.WARNING if s["waits"] or s["discarded"] else logging.INFO
+                logger.log(
+                    level,
+                    f"连接池[{name}] {host}: 取用={s['checkouts']}, 等待={s['waits']}"
+                    f"({s['wait_seconds']:.2f}s), 新建={s['created']}, 丢弃={s['discarded']}"
+                )
+        retry_budgets.log_stats()
+        rate_limiter.log_stats()
+
+    def _start_stats_timer(self):
+        """启动定时统计日志"""
+        self._stats_timer = threading.Timer(HTTP_POOL_STATS_INTERVAL, self._periodic_stats)
+        self._stats_timer.daemon = True
+        self._stats_timer.start()
+
+    def _periodic_stats(self):
+        """定期输出连接池统计"""
+        try:
+            self.log_pool_stats()
+        except Exception as e:
+            logger.error(f"输出连接池统计失败: {e}")
+        finally:
+            self._start_stats_timer()  # 重新调度
+
     def close(self):
         """关闭所有连接"""
+        if self._stats_timer:
+            self._stats_timer.cancel()
+        self.log_pool_stats()
         self.dingtalk_session.close()
         self.codebuddy_session.close()
         self.download_session.close()
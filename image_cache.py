@@ -0,0 +1,188 @@
+"""
+收到图片的本地缓存
+两级索引：downloadCode → 内容哈希 → 唯一的本地文件（images/<sha256>.<ext>）。
+同一 downloadCode 再次出现时跳过获取下载链接与下载；内容相同的图片只保存一份
+"""
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from config import IMAGE_DIR, IMAGE_CACHE_TTL, IMAGE_CACHE_MAX_MB
+from disk_janitor import disk_janitor
+
+logger = logging.getLogger(__name__)
+
+_CACHED_NAME = re.compile(r'^[0-9a-f]{64}\.\w+$')
+MAX_CODES = 10000  # 最多记录的 downloadCode 数
+
+
+class ImageCache:
+    """按内容寻址的图片缓存，带有效期与总大小上限"""
+
+    def __init__(self, directory: Path = IMAGE_DIR, ttl_seconds: float = IMAGE_CACHE_TTL,
+                 max_bytes: int = IMAGE_CACHE_MAX_MB * 1024 * 1024, max_codes: int = MAX_CODES):
+        """
+        Args:
+            directory: 图片目录
+            ttl_seconds: 缓存有效期(秒)，从保存或最近一次命中算起
+            max_bytes: 缓存文件总大小上限，超出时淘汰最久未使用的文件
+            max_codes: 最多记录的 downloadCode 数
+        """
+        self.directory = Path(directory)
+        self.ttl = ttl_seconds
+        self.max_bytes = max_bytes
+        self.max_codes = max_codes
+        self._lock = threading.Lock()
+        self._codes: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()  # downloadCode -> (哈希, 记录时间)
+        self._files: "OrderedDict[str, Tuple[str, int, float]]" = OrderedDict()  # 哈希 -> (路径, 字节数, 最近使用时间)
+        self._total = 0
+        self._hits = 0
+        self._misses = 0
+        self._load()
+
+    def _load(self):
+        """启动时登记目录中已有的缓存文件（按修改时间排序）"""
+        try:
+            entries = [e for e in os.scandir(self.directory) if e.is_file() and _CACHED_NAME.match(e.name)]
+        except FileNotFoundError:
+            return
+        for entry in sorted(entries, key=lambda e: e.stat().st_mtime):
+            stat = entry.stat()
+            self._files[entry.name.split('.')[0]] = (entry.path, stat.st_size, stat.st_mtime)
+            self._total += stat.st_size
+        if self._files:
+            logger.info(f"已登记 {len(self._files)} 个缓存图片，共 {self._total / 1024 / 1024:.1f}MB")
+
+    def _expired(self, used_at: float, now: float) -> bool:
+        return now - used_at > self.ttl
+
+    def _touch(self, digest: str, now: float) -> Optional[str]:
+        """返回仍有效的文件路径并更新使用时间（调用方需持有锁）"""
+        entry = self._files.get(digest)
+        if entry is None:
+            return None
+        path, size, used_at = entry
+        if self._expired(used_at, now) or not os.path.exists(path):
+            self._drop(digest)
+            return None
+        self._files[digest] = (path, size, now)
+        self._files.move_to_end(digest)
+        try:
+            os.utime(path)  # 让磁盘清理按最近使用时间判断
+        except OSError:
+            pass
+        return path
+
+    def _drop(self, digest: str):
+        """移除文件记录并删除文件；文件正被使用（已 pin）时只移除记录，文件留给磁盘清理（调用方需持有锁）"""
+        path, size, _ = self._files.pop(digest)
+        self._total -= size
+        if disk_janitor.is_pinned(path):
+            return
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"删除缓存图片失败: {path}, {e}")
+
+    def discard(self, path: str):
+        """文件已被外部删除（如磁盘清理）时移除其记录，作为 disk_janitor 的淘汰回调"""
+        name = os.path.basename(path)
+        if not _CACHED_NAME.match(name):
+            return
+        digest = name.split('.')[0]
+        with self._lock:
+            entry = self._files.get(digest)
+            if entry is not None and os.path.abspath(entry[0]) == os.path.abspath(path):
+                self._files.pop(digest)
+                self._total -= entry[1]
+
+    def get(self, download_code: str) -> Optional[str]:
+        """
+        按 downloadCode 查找已下载的图片
+
+        Returns:
+            本地路径，未命中返回 None
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._codes.get(download_code)
+            path = None
+            if entry is not None:
+                path = self._touch(entry[0], now)  # 同时清理已过期的文件
+                if path is not None and self._expired(entry[1], now):
+                    path = None
+            if path is None:
+                self._codes.pop(download_code, None)
+                self._misses += 1
+                return None
+            self._codes.move_to_end(download_code)
+            self._hits += 1
+        logger.info(f"命中图片缓存: {os.path.basename(path)}")
+        return path
+
+    def put(self, download_code: Optional[str], tmp_path: str, digest: str, ext: str = ".jpg") -> str:
+        """
+        登记新下载的图片
+
+        内容已缓存时删除临时文件并复用已有文件，否则原子改名为 <哈希><扩展名>
+
+        Args:
+            download_code: 图片下载码(可选)
+            tmp_path: 已写完的临时文件
+            digest: 内容 SHA-256
+            ext: 文件扩展名
+
+        Returns:
+            缓存文件路径
+        """
+        now = time.time()
+        with self._lock:
+            path = self._touch(digest, now)
+            if path is not None:
+                os.remove(tmp_path)
+                logger.info(f"图片内容已缓存，复用: {os.path.basename(path)}")
+            else:
+                path = str(self.directory / f"{digest}{ext}")
+                size = os.path.getsize(tmp_path)
+                os.replace(tmp_path, path)
+                self._files[digest] = (path, size, now)
+                self._total += size
+                self._evict(now, keep=digest)
+            if download_code:
+                self._codes[download_code] = (digest, now)
+                self._codes.move_to_end(download_code)
+                while len(self._codes) > self.max_codes:
+                    self._codes.popitem(last=False)
+        return path
+
+    def _evict(self, now: float, keep: str):
+        """
+        淘汰过期文件，并按最久未使用淘汰到总大小上限以内（调用方需持有锁）
+
+        正被使用（已 pin，如正在交给 CodeBuddy 分析）的文件跳过，留待之后的淘汰
+        """
+        for digest, (path, _, used_at) in list(self._files.items()):
+            if digest != keep and (self._total > self.max_bytes or self._expired(used_at, now)):
+                if not disk_janitor.is_pinned(path):
+                    self._drop(digest)
+            elif not self._expired(used_at, now) and self._total <= self.max_bytes:
+                break  # 之后的条目更新，均未过期
+
+    def stats(self) -> Dict[str, int]:
+        """返回 {files, bytes, codes, hits, misses}"""
+        with self._lock:
+            return {
+                "files": len(self._files), "bytes": self._total, "codes": len(self._codes),
+                "hits": self._hits, "misses": self._misses,
+            }
+
+
+# 全局单例
+image_cache = ImageCache()
@@ -0,0 +1,330 @@
+"""
+图片压缩
+在独立进程池中把图片压缩到指定大小以内，不占用发送线程与 GIL；
+压缩结果按 (内容哈希, 大小上限) 缓存到磁盘，同一张图片不会重复压缩
+"""
+import io
+import logging
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from config import CACHE_DIR, COMPRESS_WORKERS, COMPRESS_MAX_DIMENSION
+from deadline import Deadline, DeadlineExceeded, timeout_for
+from media_cache import file_sha256
+
+logger = logging.getLogger(__name__)
+
+COMPRESSED_DIR = CACHE_DIR / "compressed"
+
+QUALITY_MIN, QUALITY_MAX = 20, 85
+FEATURE_SAMPLES = 65536  # 计算复杂度特征时的采样像素数
+
+# JPEG 体积模型: log(bpp) = w0 + w1*log(梯度能量) + w2*熵 + w3*log(量化缩放系数)
+# 系数由 scripts/benchmark_jpeg_quality.py --fit 在生成图片集上拟合
+SIZE_MODEL = (2.7290, 0.5362, -0.1282, -0.7700)
+
+
+def _open_for_compression(src_path: str, max_dimension: int):
+    """
+    打开图片并限制分辨率
+
+    JPEG 源图使用 draft 模式在解码阶段直接按 1/2、1/4、1/8 缩小，避免完整解码超大图片
+    """
+    from PIL import Image
+
+    img = Image.open(src_path)
+    if img.format == 'JPEG' and max(img.size) > max_dimension:
+        img.draft('RGB', (max_dimension, max_dimension))
+    if max(img.size) > max_dimension:
+        img.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+
+    # 透明图片铺白底后转为 RGB
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[3])
+        img = background
+    elif img.mode != 'RGB':
+        img = img.convert('RGB')
+    return img
+
+
+def _quant_scale(quality: int) -> float:
+    """IJG 质量到量化表缩放系数(%)的映射"""
+    return 5000 / quality if quality < 50 else 200 - 2 * quality
+
+
+def _quality_for_scale(scale: float) -> float:
+    """_quant_scale 的反函数"""
+    return 5000 / scale if scale >= 100 else (200 - scale) / 2
+
+
+def complexity_features(img) -> Optional[Tuple[float, float]]:
+    """
+    计算图片复杂度特征（需要 NumPy，未安装时返回 None）
+
+    梯度能量取自按行/列抽样的原始分辨率像素（缩放会抹掉 JPEG 需要编码的高频细节），
+    熵取自抽样得到的缩小副本
+
+    Returns:
+        (梯度能量, 灰度熵)
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        return None
+
+    gray = np.asarray(img.convert('L'), dtype=np.float32)
+    if gray.shape[0] < 2 or gray.shape[1] < 2:
+        return None
+    step = max(1, int(math.sqrt(gray.size / FEATURE_SAMPLES)))
+    gradient = float(
+        np.abs(np.diff(gray[::step, :], axis=1)).mean() + np.abs(np.diff(gray[:, ::step], axis=0)).mean()
+    )
+    hist = np.bincount(gray[::step, ::step].astype(np.uint8).ravel(), minlength=256).astype(np.float64)
+    prob = hist[hist > 0] / hist.sum()
+    entropy = float(-(prob * np.log2(prob)).sum())
+    return gradient, entropy
+
+
+class QualityEstimator:
+    """根据复杂度特征预测满足大小上限的 JPEG 质量与缩放比例"""
+
+    def __init__(self, features: Tuple[float, float], pixels: int, model: Tuple[float, ...] = SIZE_MODEL):
+        gradient, entropy = features
+        w0, w1, w2, self.w3 = model
+        # 与质量无关的部分，实际编码后据此校正
+        self.base = w0 + w1 * math.log(gradient + 1e-3) + w2 * entropy
+        self.pixels = pixels
+        self._samples = []  # 原尺寸实际编码结果 [(log 量化缩放系数, log bpp)]
+
+    def predict_bytes(self, quality: int, scale: float = 1.0) -> float:
+        """预测指定质量与缩放比例下的 JPEG 字节数"""
+        bpp = math.exp(self.base + self.w3 * math.log(_quant_scale(quality)))
+        return bpp * self.pixels * scale * scale / 8
+
+    def solve(self, budget_bytes: float) -> Tuple[int, float]:
+        """
+        求满足预算的最高质量；质量低于下限时改为缩小尺寸
+
+        Returns:
+            (quality, scale)
+        """
+        bpp = budget_bytes * 8 / self.pixels
+        log_scale = (math.log(bpp) - self.base) / self.w3
+        quality = int(_quality_for_scale(math.exp(log_scale)))
+        if quality >= QUALITY_MIN:
+            return min(quality, QUALITY_MAX), 1.0
+        # 质量过低时画质损失明显，改为中等质量 + 缩小尺寸
+        quality = 60
+        scale = min(1.0, math.sqrt(budget_bytes / self.predict_bytes(quality)))
+        return quality, scale
+
+    def correct(self, quality: int, scale: float, actual_bytes: int):
+        """
+        用实际编码结果校正模型
+
+        一次结果只平移截距；原尺寸下有两次不同质量的结果时，同时用割线斜率替换 w3
+        """
+        if scale == 1.0:
+            point = (math.log(_quant_scale(quality)), math.log(actual_bytes * 8 / self.pixels))
+            if self._samples and self._samples[-1][0] != point[0]:
+                slope = (point[1] - self._samples[-1][1]) / (point[0] - self._samples[-1][0])
+                if slope < 0:
+                    self.w3 = slope
+            self._samples.append(point)
+        self.base += math.log(actual_bytes / self.predict_bytes(quality, scale))
+
+
+def _encode(img, quality: int, scale: float = 1.0) -> bytes:
+    """按指定质量与缩放比例编码 JPEG"""
+    from PIL import Image
+
+    if scale < 1.0:
+        width, height = img.size
+        img = img.resize((max(1, int(width * scale)), max(1, int(height * scale))), Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def search_quality(img, budget_bytes: int) -> Tuple[Optional[bytes], int]:
+    """
+    二分搜索最佳 JPEG 质量
+
+    Returns:
+        (满足预算的最高质量编码结果或 None, 编码次数)
+    """
+    low, high = QUALITY_MIN, QUALITY_MAX
+    best = None
+    encodes = 0
+    while low <= high:
+        mid = (low + high) // 2
+        data = _encode(img, mid)
+        encodes += 1
+        if len(data) <= budget_bytes:
+            best = data
+            low = mid + 1  # 尝试更高质量
+        else:
+            high = mid - 1  # 降低质量
+    return best, encodes
+
+
+def predict_quality(img, budget_bytes: int) -> Tuple[Optional[bytes], int]:
+    """
+    根据复杂度特征预测质量，通常一到两次编码即可满足预算
+
+    第一次按模型预测编码；结果超出预算或明显低于预算时用实际大小校正模型再编码，
+    最多三次。NumPy 不可用时返回 (None, 0)，由调用方回退到二分搜索。
+
+    Returns:
+        (满足预算的编码结果或 None, 编码次数)
+    """
+    features = complexity_features(img)
+    if features is None:
+        return None, 0
+
+    estimator = QualityEstimator(features, img.size[0] * img.size[1])
+    target = budget_bytes * 0.95  # 留出模型误差余量
+    best = None
+    encodes = 0
+    tried = set()
+    for _ in range(3):
+        quality, scale = estimator.solve(target)
+        if (quality, scale) in tried:
+            break
+        tried.add((quality, scale))
+        data = _encode(img, quality, scale)
+        encodes += 1
+        if len(data) <= budget_bytes:
+            if best is None or len(data) > len(best):
+                best = data
+            # 已接近预算或已达最高质量时不再尝试
+            if len(data) >= budget_bytes * 0.8 or (quality >= QUALITY_MAX and scale == 1.0):
+                break
+        estimator.correct(quality, scale, len(data))
+    return best, encodes
+
+
+def compress_to_budget(src_path: str, dst_path: str, max_size_kb: int,
+                       max_dimension: int = COMPRESS_MAX_DIMENSION) -> int:
+    """
+    压缩图片到 max_size_kb 以内（在工作进程中执行）
+
+    优先按复杂度特征预测质量；预测失败时二分搜索，仍超出时缩小一半尺寸。
+    结果先写临时文件再原子替换
+
+    Returns:
+        压缩后的字节数
+    """
+    img = _open_for_compression(src_path, max_dimension)
+    budget_bytes = max_size_kb * 1024
+
+    best, _ = predict_quality(img, budget_bytes)
+    if best is None:
+        best, _ = search_quality(img, budget_bytes)
+    if best is None:
+        # 二分搜索都不满足,缩小尺寸
+        best = _encode(img, 75, 0.5)
+
+    tmp_path = f"{dst_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(best)
+    os.replace(tmp_path, dst_path)
+    return len(best)
+
+
+class ImageCompressor:
+    """带磁盘缓存的进程池图片压缩器"""
+
+    def __init__(self, cache_dir: Path = COMPRESSED_DIR, workers: int = COMPRESS_WORKERS):
+        self.cache_dir = Path(cache_dir)
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._inflight: Dict[Tuple[str, int], Future] = {}
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        """惰性创建进程池（spawn 方式，避免 fork 多线程进程）"""
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._pool
+
+    def cached_path(self, digest: str, max_size_kb: int) -> Path:
+        """压缩结果的缓存路径"""
+        return self.cache_dir / f"{digest}_{max_size_kb}k.jpg"
+
+    def compress(self, image_path: str, max_size_kb: int = 500, timeout: Optional[float] = 60,
+                 deadline: Optional[Deadline] = None) -> str:
+        """
+        压缩图片到指定大小
+
+        Args:
+            image_path: 原图片路径
+            max_size_kb: 最大文件大小(KB)
+            timeout: 等待压缩的超时(秒)
+            deadline: 消息处理截止时间(可选)，等待压缩不超过剩余预算
+
+        Returns:
+            压缩后的图片路径，失败时返回原路径
+
+        Raises:
+            DeadlineExceeded: 开始等待前预算已耗尽
+        """
+        try:
+            digest = file_sha256(image_path)
+            dst_path = self.cached_path(digest, max_size_kb)
+            try:
+                # 只更新访问时间记录使用（磁盘清理按 max(atime, mtime) 淘汰最久未使用），mtime 保持为生成时间
+                os.utime(dst_path, (time.time(), dst_path.stat().st_mtime))
+                logger.info(f"命中压缩缓存: {dst_path.name}")
+                return str(dst_path)
+            except FileNotFoundError:
+                pass
+
+            # 同一图片的并发压缩只提交一次
+            key = (digest, max_size_kb)
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            pool = self._get_pool()
+            with self._lock:
+                future = self._inflight.get(key)
+                submitted = future is None
+                if submitted:
+                    future = pool.submit(compress_to_budget, image_path, str(dst_path), max_size_kb)
+                    self._inflight[key] = future
+            if submitted:
+                future.add_done_callback(lambda _: self._forget(key))
+
+            size = future.result(timeout=timeout_for(deadline, timeout, "图片压缩"))
+            logger.info(f"图片压缩成功: {size / 1024:.1f}KB")
+            return str(dst_path)
+
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"图片压缩失败: {e}")
+            return image_path
+
+    def _forget(self, key: Tuple[str, int]):
+        with self._lock:
+            self._inflight.pop(key, None)
+
+    def close(self):
+        """关闭进程池"""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+# 全局单例
+image_compressor = ImageCompressor()
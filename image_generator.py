@@ -4,6 +4,7 @@
 """
 import os
 import re
+import asyncio
 import logging
 import base64
 import uuid
@@ -11,6 +12,9 @@ from pathlib import Path
 from typing import Optional, Tuple
 
 from http_client import http_client
+from async_http_client import async_http_client
+from deadline import Deadline, timeout_for
+from downloader import download_file
 from config import (
     CODEBUDDY_API_URL,
     CODEBUDDY_API_TOKEN,
@@ -102,12 +106,23 @@ class ImageGenerator:
         
         return prompt
     
-    def generate_text_to_image(self, prompt: str) -> Optional[Tuple[str, str]]:
+    @staticmethod
+    def _build_codebuddy_payload(full_prompt: str) -> dict:
+        """构建 CodeBuddy 生图请求体"""
+        return {
+            "prompt": full_prompt,
+            "print": True,
+            "dangerouslySkipPermissions": True,
+            "continue": False  # 生图不需要继续对话
+        }
+    
+    def generate_text_to_image(self, prompt: str, deadline: Optional[Deadline] = None) -> Optional[Tuple[str, str]]:
         """
         文生图
         
         Args:
             prompt: 图片描述提示词
+            deadline: 消息处理截止时间(可选)
             
         Returns:
             (图片本地路径, 模型信息) 元组,失败返回 None
@@ -115,25 +130,29 @@ class ImageGenerator:
         # 优先使用 Gemini 生成器(如果已启用)
         if IMAGE_GENERATOR_TYPE == "gemini" and gemini_image_generator.is_enabled():
             logger.info(f"使用 Gemini 生成器进行文生图")
-            result = gemini_image_generator.generate_text_to_image(prompt)
+            result = gemini_image_generator.generate_text_to_image(prompt, deadline=deadline)
             if result:
                 return result  # Gemini 已经返回 (path, model_info)
+            if deadline is not None and deadline.expired():
+                logger.warning("Gemini 生成失败且处理预算已耗尽,不再回退")
+                return None
             # Gemini 失败,回退到 CodeBuddy
             logger.warning("Gemini 生成失败,回退到 CodeBuddy")
         
         # 使用 CodeBuddy 生成器
         logger.info(f"使用 CodeBuddy 生成器进行文生图")
-        path = self._generate_text_to_image_codebuddy(prompt)
+        path = self._generate_text_to_image_codebuddy(prompt, deadline)
         if path:
             return (path, "CodeBuddy")
         return None
     
-    def _generate_text_to_image_codebuddy(self, prompt: str) -> Optional[str]:
+    def _generate_text_to_image_codebuddy(self, prompt: str, deadline: Optional[Deadline] = None) -> Optional[str]:
         """
         使用 CodeBuddy API 进行文生图
         
         Args:
             prompt: 图片描述提示词
+            deadline: 消息处理截止时间(可选)
             
         Returns:
             生成的图片本地路径,失败返回 None
@@ -144,12 +163,7 @@ class ImageGenerator:
             # 构建请求 - 使用 /model:text-to-image 指令
             full_prompt = f"/model:text-to-image {prompt}"
             
-            payload = {
-                "prompt": full_prompt,
-                "print": True,
-                "dangerouslySkipPermissions": True,
-                "continue": False  # 生图不需要继续对话
-            }
+            payload = self._build_codebuddy_payload(full_prompt)
             
             logger.info(f"调用 CodeBuddy API: {self.api_url}")
             logger.info(f"Payload: {payload}")
@@ -158,7 +172,7 @@ class ImageGenerator:
                 self.api_url,
                 headers=self.headers,
                 json=payload,
-                timeout=120  # 生图可能需要较长时间
+                timeout=timeout_for(deadline, 120, "CodeBuddy 文生图")  # 生图可能需要较长时间
             )
             
             response.raise_for_status()
@@ -167,7 +181,7 @@ class ImageGenerator:
             logger.info(f"API 响应: {response_text[:500]}")
             
             # 从响应中提取图片
-            image_path = self._extract_image_from_response(response_text, "text-to-image")
+            image_path = self._extract_image_from_response(response_text, "text-to-image", deadline)
             
             if image_path:
                 logger.info(f"文生图成功: {image_path}")
@@ -182,13 +196,15 @@ class ImageGenerator:
             logger.error(traceback.format_exc())
             return None
     
-    def generate_image_to_image(self, prompt: str, source_image_path: str) -> Optional[Tuple[str, str]]:
+    def generate_image_to_image(self, prompt: str, source_image_path: str,
+                                deadline: Optional[Deadline] = None) -> Optional[Tuple[str, str]]:
         """
         图生图
         
         Args:
             prompt: 修改描述提示词
             source_image_path: 源图片路径
+            deadline: 消息处理截止时间(可选)
             
         Returns:
             (图片本地路径, 模型信息) 元组,失败返回 None
@@ -196,26 +212,31 @@ class ImageGenerator:
         # 优先使用 Gemini 生成器(如果已启用)
         if IMAGE_GENERATOR_TYPE == "gemini" and gemini_image_generator.is_enabled():
             logger.info(f"使用 Gemini 生成器进行图生图")
-            result = gemini_image_generator.generate_image_to_image(prompt, source_image_path)
+            result = gemini_image_generator.generate_image_to_image(prompt, source_image_path, deadline=deadline)
             if result:
                 return result  # Gemini 已经返回 (path, model_info)
+            if deadline is not None and deadline.expired():
+                logger.warning("Gemini 生成失败且处理预算已耗尽,不再回退")
+                return None
             # Gemini 失败,回退到 CodeBuddy
             logger.warning("Gemini 生成失败,回退到 CodeBuddy")
         
         # 使用 CodeBuddy 生成器
         logger.info(f"使用 CodeBuddy 生成器进行图生图")
-        path = self._generate_image_to_image_codebuddy(prompt, source_image_path)
+        path = self._generate_image_to_image_codebuddy(prompt, source_image_path, deadline)
         if path:
             return (path, "CodeBuddy")
         return None
     
-    def _generate_image_to_image_codebuddy(self, prompt: str, source_image_path: str) -> Optional[str]:
+    def _generate_image_to_image_codebuddy(self, prompt: str, source_image_path: str,
+                                           deadline: Optional[Deadline] = None) -> Optional[str]:
         """
         使用 CodeBuddy API 进行图生图
         
         Args:
             prompt: 修改描述提示词
             source_image_path: 源图片路径
+            deadline: 消息处理截止时间(可选)
             
         Returns:
             生成的图片本地路径,失败返回 None
@@ -226,12 +247,7 @@ class ImageGenerator:
             # 构建请求 - 使用 /model:image-to-image 指令
             full_prompt = f"/model:image-to-image 源图片: {source_image_path} 修改要求: {prompt}"
             
-            payload = {
-                "prompt": full_prompt,
-                "print": True,
-                "dangerouslySkipPermissions": True,
-                "continue": False
-            }
+            payload = self._build_codebuddy_payload(full_prompt)
             
             logger.info(f"调用 CodeBuddy API: {self.api_url}")
             logger.info(f"Payload: {payload}")
@@ -240,7 +256,7 @@ class ImageGenerator:
                 self.api_url,
                 headers=self.headers,
                 json=payload,
-                timeout=120
+                timeout=timeout_for(deadline, 120, "CodeBuddy 图生图")
             )
             
             response.raise_for_status()
@@ -249,7 +265,7 @@ class ImageGenerator:
             logger.info(f"API 响应: {response_text[:500]}")
             
             # 从响应中提取图片
-            image_path = self._extract_image_from_response(response_text, "image-to-image")
+            image_path = self._extract_image_from_response(response_text, "image-to-image", deadline)
             
             if image_path:
                 logger.info(f"图生图成功: {image_path}")
@@ -264,7 +280,92 @@ class ImageGenerator:
             logger.error(traceback.format_exc())
             return None
     
-    def _extract_image_from_response(self, response_text: str, generation_type: str) -> Optional[str]:
+    async def generate_text_to_image_async(self, prompt: str,
+                                           deadline: Optional[Deadline] = None) -> Optional[Tuple[str, str]]:
+        """文生图（协程版本），参数同 generate_text_to_image"""
+        if IMAGE_GENERATOR_TYPE == "gemini" and gemini_image_generator.is_enabled():
+            logger.info(f"使用 Gemini 生成器进行文生图")
+            result = await gemini_image_generator.generate_text_to_image_async(prompt, deadline=deadline)
+            if result:
+                return result
+            if deadline is not None and deadline.expired():
+                logger.warning("Gemini 生成失败且处理预算已耗尽,不再回退")
+                return None
+            logger.warning("Gemini 生成失败,回退到 CodeBuddy")
+        
+        logger.info(f"使用 CodeBuddy 生成器进行文生图")
+        path = await self._generate_codebuddy_async(f"/model:text-to-image {prompt}", "text-to-image", deadline)
+        if path:
+            return (path, "CodeBuddy")
+        return None
+    
+    async def generate_image_to_image_async(self, prompt: str, source_image_path: str,
+                                            deadline: Optional[Deadline] = None) -> Optional[Tuple[str, str]]:
+        """图生图（协程版本），参数同 generate_image_to_image"""
+        if IMAGE_GENERATOR_TYPE == "gemini" and gemini_image_generator.is_enabled():
+            logger.info(f"使用 Gemini 生成器进行图生图")
+            result = await gemini_image_generator.generate_image_to_image_async(
+                prompt, source_image_path, deadline=deadline
+            )
+            if result:
+                return result
+            if deadline is not None and deadline.expired():
+                logger.warning("Gemini 生成失败且处理预算已耗尽,不再回退")
+                return None
+            logger.warning("Gemini 生成失败,回退到 CodeBuddy")
+        
+        logger.info(f"使用 CodeBuddy 生成器进行图生图")
+        full_prompt = f"/model:image-to-image 源图片: {source_image_path} 修改要求: {prompt}"
+        path = await self._generate_codebuddy_async(full_prompt, "image-to-image", deadline)
+        if path:
+            return (path, "CodeBuddy")
+        return None
+    
+    async def _generate_codebuddy_async(self, full_prompt: str, generation_type: str,
+                                        deadline: Optional[Deadline] = None) -> Optional[str]:
+        """
+        使用 CodeBuddy API 生图（协程版本）
+        
+        Args:
+            full_prompt: 带 /model 指令的完整提示词
+            generation_type: 'text-to-image' 或 'image-to-image'
+            deadline: 消息处理截止时间(可选)
+            
+        Returns:
+            生成的图片本地路径,失败返回 None
+        """
+        try:
+            payload = self._build_codebuddy_payload(full_prompt)
+            logger.info(f"调用 CodeBuddy API: {self.api_url}")
+            logger.info(f"Payload: {payload}")
+            
+            response = await async_http_client.post(
+                self.api_url,
+                profile="codebuddy",
+                headers=self.headers,
+                json=payload,
+                timeout=timeout_for(deadline, 120, f"CodeBuddy {generation_type}")
+            )
+            response.raise_for_status()
+            response_text = response.text
+            logger.info(f"API 响应: {response_text[:500]}")
+            
+            # 提取过程涉及文件复制，放到线程中执行
+            image_path = await asyncio.to_thread(
+                self._extract_image_from_response, response_text, generation_type, deadline
+            )
+            if image_path:
+                logger.info(f"{generation_type} 成功: {image_path}")
+                return image_path
+            logger.error("未能从响应中提取图片")
+            return None
+            
+        except Exception as e:
+            logger.error(f"{generation_type} 失败: {e}", exc_info=True)
+            return None
+    
+    def _extract_image_from_response(self, response_text: str, generation_type: str,
+                                     deadline: Optional[Deadline] = None) -> Optional[str]:
         """
         从 CodeBuddy 响应中提取图片
         
@@ -276,6 +377,7 @@ class ImageGenerator:
         Args:
             response_text: API 响应文本
             generation_type: 'text-to-image' 或 'image-to-image'
+            deadline: 消息处理截止时间(可选)
             
         Returns:
             本地图片路径,失败返回 None
@@ -338,20 +440,13 @@ class ImageGenerator:
             if url_match:
                 image_url = url_match.group(0)
                 
-                # 下载图片
-                img_response = http_client.download_session.get(image_url, timeout=30)
-                img_response.raise_for_status()
-                
-                # 从 URL 获取文件扩展名
-                ext = image_url.split('.')[-1].split('?')[0]
-                filename = f"{generation_type}_{uuid.uuid4().hex}.{ext}"
-                image_path = self.output_dir / filename
-                
-                with open(image_path, 'wb') as f:
-                    f.write(img_response.content)
-                
-                logger.info(f"从 URL 下载图片: {image_path}")
-                return str(image_path)
+                # 流式下载图片，扩展名按真实格式决定
+                result = download_file(
+                    image_url, self.output_dir, f"{generation_type}_{uuid.uuid4().hex}",
+                    timeout=30, deadline=deadline, label="下载生成图片"
+                )
+                logger.info(f"从 URL 下载图片: {result.path}")
+                return result.path
             
             logger.warning(f"无法从响应中提取图片,响应内容: {response_text[:200]}")
             return None
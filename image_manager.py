@@ -7,7 +7,8 @@ import uuid
 import logging
 from pathlib import Path
 from typing import Optional
-from http_client import http_client
+from downloader import DownloadResult, download_file, download_file_async
+from image_cache import image_cache
 
 from config import IMAGE_DIR
 
@@ -17,10 +18,19 @@ logger = logging.getLogger(__name__)
 class ImageManager:
     """图片管理器"""
 
+    DOWNLOAD_HEADERS = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+    }
+
     def __init__(self):
         # 确保图片目录存在
         IMAGE_DIR.mkdir(parents=True, exist_ok=True)
 
+    @staticmethod
+    def _store(tmp_path: str, result: DownloadResult) -> str:
+        """下载完成后登记到图片缓存（相同内容只保留一份）"""
+        return image_cache.put(None, tmp_path, result.sha256, result.ext)
+
     def download_image(self, image_url: str) -> Optional[str]:
         """
         从URL下载图片并保存到本地
@@ -32,23 +42,33 @@ class ImageManager:
             本地文件路径，失败返回None
         """
         try:
-            # 生成唯一文件名
-            filename = f"{uuid.uuid4().hex}.jpg"
-            local_path = IMAGE_DIR / filename
+            # 流式下载，按内容哈希保存到图片缓存
+            result = download_file(
+                image_url, IMAGE_DIR, finalize=self._store, headers=self.DOWNLOAD_HEADERS, timeout=30
+            )
+            logger.info(f"图片下载成功: {result.path}")
+            return result.path
+
+        except Exception as e:
+            logger.error(f"图片下载失败: {e}")
+            return None
 
-            # 下载图片
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            }
-            response = http_client.download_session.get(image_url, headers=headers, timeout=30)
-            response.raise_for_status()
+    async def download_image_async(self, image_url: str) -> Optional[str]:
+        """
+        从URL下载图片并保存到本地（协程版本）
 
-            # 保存到本地
-            with open(local_path, 'wb') as f:
-                f.write(response.content)
+        Args:
+            image_url: 图片的URL地址
 
-            logger.info(f"图片下载成功: {local_path}")
-            return str(local_path)
+        Returns:
+            本地文件路径，失败返回None
+        """
+        try:
+            result = await download_file_async(
+                image_url, IMAGE_DIR, finalize=self._store, headers=self.DOWNLOAD_HEADERS, timeout=30
+            )
+            logger.info(f"图片下载成功: {result.path}")
+            return result.path
 
         except Exception as e:
             logger.error(f"图片下载失败: {e}")
@@ -0,0 +1,176 @@
+"""
+图片预处理
+分析类请求（看图、图文对话）不直接把原图交给 CodeBuddy：按文件头识别真实格式，
+生成限制分辨率的分析副本（JPEG，扩展名与内容一致），后端解码更快、图片 token 更少。
+只做分析的请求生成副本后删除原图，图片目录只保留副本；图生图等需要原图的请求不经过预处理，原图保留
+"""
+import logging
+import os
+import re
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List
+
+from config import IMAGE_DIR, ANALYSIS_MAX_DIMENSION, ANALYSIS_JPEG_QUALITY
+from disk_janitor import disk_janitor
+from downloader import IMAGE_EXTENSIONS, SNIFF_BYTES, sniff_image_format
+from image_cache import image_cache
+from media_cache import file_sha256
+
+logger = logging.getLogger(__name__)
+
+_DIGEST_NAME = re.compile(r'^[0-9a-f]{64}$')
+PASSTHROUGH_FORMATS = {"jpeg", "png", "webp"}  # 后端可直接读取的格式
+PASSTHROUGH_MAX_BYTES = 1024 * 1024  # 分辨率已达标且不超过该大小时直接使用原图
+
+
+class ImagePreprocessor:
+    """生成限制分辨率的分析副本，按内容哈希缓存"""
+
+    def __init__(self, directory: Path = IMAGE_DIR, max_dimension: int = ANALYSIS_MAX_DIMENSION,
+                 quality: int = ANALYSIS_JPEG_QUALITY):
+        """
+        Args:
+            directory: 分析副本保存目录（与收到的图片同目录，由磁盘清理统一管理）
+            max_dimension: 分析副本的最大边长(像素)
+            quality: 分析副本的 JPEG 质量
+        """
+        self.directory = Path(directory)
+        self.max_dimension = max_dimension
+        self.quality = quality
+
+    def analysis_path(self, digest: str) -> Path:
+        """分析副本路径: <原图哈希>_a<最大边长>.jpg"""
+        return self.directory / f"{digest}_a{self.max_dimension}.jpg"
+
+    def _can_pass_through(self, path: str, fmt: str) -> bool:
+        """格式可直接读取、扩展名与内容一致且分辨率与大小都已达标"""
+        from PIL import Image
+
+        ext = os.path.splitext(path)[1].lower().lstrip('.')
+        if fmt not in PASSTHROUGH_FORMATS or ext not in (IMAGE_EXTENSIONS[fmt], fmt):
+            return False
+        if os.path.getsize(path) > PASSTHROUGH_MAX_BYTES:
+            return False
+        with Image.open(path) as img:  # 只读取文件头，不解码像素
+            return max(img.size) <= self.max_dimension
+
+    def _render(self, src_path: str, dst_path: Path) -> int:
+        """
+        解码、纠正 EXIF 方向、缩小并编码为 JPEG，先写临时文件再原子替换
+
+        JPEG 源图使用 draft 模式在解码阶段直接缩小，避免完整解码手机原图
+
+        Returns:
+            分析副本字节数
+        """
+        from PIL import Image, ImageOps
+
+        with Image.open(src_path) as img:
+            if img.format == 'JPEG' and max(img.size) > self.max_dimension:
+                img.draft('RGB', (self.max_dimension, self.max_dimension))
+            img = ImageOps.exif_transpose(img)
+            if max(img.size) > self.max_dimension:
+                img.thumbnail((self.max_dimension, self.max_dimension), Image.Resampling.LANCZOS)
+
+            # 透明图片铺白底后转为 RGB
+            if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+                img = img.convert('RGBA')
+                background = Image.new('RGB', img.size, (255, 255, 255))
+                background.paste(img, mask=img.split()[3])
+                img = background
+            elif img.mode != 'RGB':
+                img = img.convert('RGB')
+
+            tmp_path = self.directory / f".{uuid.uuid4().hex}.part"
+            try:
+                img.save(tmp_path, format='JPEG', quality=self.quality)
+                os.replace(tmp_path, dst_path)
+            except BaseException:
+                tmp_path.unlink(missing_ok=True)
+                raise
+        return os.path.getsize(dst_path)
+
+    def _release_original(self, image_path: str):
+        """
+        删除已有分析副本的原图（只处理图片缓存管理的 <哈希>.<扩展名> 文件），并从图片缓存中移除记录
+
+        原图正被其他任务使用（已 pin，如图生图的源图片）时保留
+        """
+        path = Path(image_path)
+        if path.parent.resolve() != self.directory.resolve() or not _DIGEST_NAME.match(path.stem):
+            return
+        if disk_janitor.is_pinned(image_path):
+            return
+        try:
+            os.remove(image_path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"删除原图失败: {image_path}, {e}")
+            return
+        image_cache.discard(image_path)
+        logger.info(f"分析副本已生成，删除原图: {path.name}")
+
+    def prepare(self, image_path: str, keep_original: bool = True) -> str:
+        """
+        返回供 CodeBuddy 分析的图片路径
+
+        原图已满足要求时直接返回原路径；否则生成（或复用）分析副本。
+        无法识别或处理失败时退回原图
+
+        Args:
+            image_path: 原图路径
+            keep_original: 为 False 时（请求只需分析副本）生成副本后删除原图
+
+        Returns:
+            分析用图片路径
+        """
+        stem = Path(image_path).stem
+        if _DIGEST_NAME.match(stem):
+            # 同一内容的副本已存在时直接复用（原图可能已被之前的分析请求删除）
+            dst_path = self.analysis_path(stem)
+            if dst_path.exists():
+                os.utime(dst_path)  # 让磁盘清理按最近使用时间判断
+                logger.info(f"命中分析副本: {dst_path.name}")
+                if not keep_original:
+                    self._release_original(image_path)
+                return str(dst_path)
+        try:
+            with open(image_path, 'rb') as f:
+                fmt = sniff_image_format(f.read(SNIFF_BYTES))
+            if fmt is None:
+                logger.warning(f"无法识别图片格式，使用原图: {image_path}")
+                return image_path
+            if self._can_pass_through(image_path, fmt):
+                return image_path
+
+            digest = stem if _DIGEST_NAME.match(stem) else file_sha256(image_path)
+            dst_path = self.analysis_path(digest)
+            if dst_path.exists():
+                os.utime(dst_path)  # 让磁盘清理按最近使用时间判断
+                logger.info(f"命中分析副本: {dst_path.name}")
+            else:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                size = self._render(image_path, dst_path)
+                logger.info(f"已生成分析副本: {dst_path.name} ({fmt} {os.path.getsize(image_path) / 1024:.1f}KB"
+                            f" -> {size / 1024:.1f}KB)")
+        except Exception as e:
+            logger.error(f"图片预处理失败，使用原图: {image_path}, {e}")
+            return image_path
+        if not keep_original:
+            self._release_original(image_path)
+        return str(dst_path)
+
+    def prepare_all(self, image_paths: List[str], max_workers: int = 4, keep_original: bool = True) -> List[str]:
+        """并发预处理多张图片，保持原顺序"""
+        if len(image_paths) <= 1:
+            return [self.prepare(path, keep_original) for path in image_paths]
+        workers = min(max_workers, len(image_paths))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-prepare") as pool:
+            return list(pool.map(lambda path: self.prepare(path, keep_original), image_paths))
+
+
+# 全局单例
+image_preprocessor = ImagePreprocessor()
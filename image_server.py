@@ -2,77 +2,282 @@
 """
 图片 HTTP 服务器
 提供生成的图片的 HTTP 访问
+
+基于 aiohttp 的异步服务：文件经 sendfile 零拷贝发送，单个慢客户端不会阻塞其他请求；
+支持强 ETag / Last-Modified 条件请求(304)、Range 分段下载与 HEAD；
+最近提供过的小文件缓存在内存中（hot_cache），命中时不再读盘；
+?w=<宽度> 返回白名单宽度内的缩放版本（image_variants），生成后缓存到磁盘；
+按 Accept 请求头在原图与其 WebP / AVIF 编码版本中选择客户端可接受的最小版本（Vary: Accept）
+
+可独立运行（python image_server.py），也可在 EMBED_IMAGE_SERVER 开启时由 bot.py 在同一事件循环中启动
 """
-import os
+import asyncio
+import logging
+import mimetypes
 import sys
-from http.server import SimpleHTTPRequestHandler, HTTPServer
 from pathlib import Path
-import logging
+from typing import Dict, Optional
+
+from aiohttp import web
+from dotenv import load_dotenv
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('/var/log/image-server.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+load_dotenv(Path(__file__).parent / ".env")
+
+from config import IMAGEGEN_DIR, IMAGE_SERVER_PORT  # noqa: E402
+from disk_janitor import disk_janitor  # noqa: E402
+from hot_cache import HotObject, HotObjectCache  # noqa: E402
+from image_variants import FORMATS, VariantStore, variant_store  # noqa: E402
 
 logger = logging.getLogger(__name__)
 
+CACHE_CONTROL = 'public, max-age=86400'
+LOG_FILE = '/var/log/image-server.log'
+
+
+def parse_accept(header: str) -> Dict[str, Optional[float]]:
+    """解析 Accept 请求头为 {媒体类型: q 值}，未显式给出 q 值时为 None（等同 1.0）"""
+    accepted = {}
+    for item in header.split(","):
+        media_type, *params = [part.strip() for part in item.split(";")]
+        if not media_type:
+            continue
+        q = None
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[media_type.lower()] = q
+    return accepted
+
+
+def accepts(accepted: Dict[str, Optional[float]], media_type: str) -> bool:
+    """
+    客户端是否明确接受 media_type（用于选择编码版本）
+
+    只认列出的精确类型，或显式带 q 值的 type/*；*/* 与不带 q 值的 image/* 不算，
+    钉钉预览抓取、curl 等只发 */* 的客户端始终拿到原图
+    """
+    if media_type in accepted:
+        q = accepted[media_type]
+        return q is None or q > 0
+    q = accepted.get(f"{media_type.split('/')[0]}/*")
+    return q is not None and q > 0
+
+
+class ImageServer:
+    """静态图片服务"""
+
+    def __init__(self, directory: Path = IMAGEGEN_DIR, cache: Optional[HotObjectCache] = None,
+                 variants: Optional[VariantStore] = None):
+        """
+        Args:
+            directory: 图片目录
+            cache: 热点对象缓存，默认按配置创建
+            variants: 派生版本缓存，默认使用全局单例
+        """
+        self.directory = Path(directory).resolve()
+        self.cache = cache if cache is not None else HotObjectCache()
+        self.variants = variants if variants is not None else variant_store
+        self._runner: Optional[web.AppRunner] = None
+
+    def resolve(self, name: str) -> Optional[Path]:
+        """把请求路径映射为目录内的文件；越出目录、隐藏文件（如下载中的 .part）或不是文件时返回 None"""
+        if any(part.startswith('.') for part in Path(name).parts):
+            return None
+        try:
+            path = (self.directory / name).resolve()
+        except (OSError, ValueError):
+            return None
+        if not path.is_relative_to(self.directory) or not path.is_file():
+            return None
+        return path
+
+    async def handle_index(self, request: web.Request) -> web.Response:
+        """根路径只用于健康检查，不列出目录内容"""
+        return web.Response(text="image server ok\n")
+
+    async def handle_options(self, request: web.Request) -> web.Response:
+        return web.Response(status=204)
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        """热点缓存命中率等统计"""
+        return web.json_response({"hot_cache": self.cache.stats(), "variants": self.variants.stats()})
+
+    async def handle_file(self, request: web.Request) -> web.StreamResponse:
+        """
+        返回图片文件
 
-class ImageHandler(SimpleHTTPRequestHandler):
-    """自定义图片处理器"""
-    
-    def __init__(self, *args, **kwargs):
-        # 设置图片目录
-        image_dir = Path(__file__).parent / "imagegen"
-        super().__init__(*args, directory=str(image_dir), **kwargs)
-    
-    def log_message(self, format, *args):
-        """记录访问日志"""
-        logger.info("%s - - [%s] %s" % (
-            self.address_string(),
-            self.log_date_time_string(),
-            format % args
-        ))
-    
-    def end_headers(self):
+        带 ?w=<宽度> 时返回缩放版本（生成失败时退回原图），再按 Accept 选择编码版本。
+        内存缓存命中时直接返回；可缓存的文件在 GET 未命中时读入缓存；
+        其余情况由 FileResponse 负责 sendfile、ETag("<mtime_ns>-<size>")、Last-Modified、
+        If-None-Match / If-Modified-Since / If-Range 与 Range 的处理
+        """
+        name = request.match_info["name"]
+        path = self.resolve(name)
+        if path is None:
+            raise web.HTTPNotFound()
+        width = request.query.get("w")
+        if width is not None:
+            path = await self._variant(path, name, width)
+        headers = {}
+        if self.variants.sibling_formats:
+            headers["Vary"] = "Accept"
+            path = self._negotiate(request, path)
+        return await self._serve(request, path, headers)
+
+    def _negotiate(self, request: web.Request, path: Path) -> Path:
+        """在原图与客户端可接受的已生成编码版本中选择最小的一个；缺失的编码版本在后台生成"""
+        accepted = parse_accept(request.headers.get("Accept", ""))
+        wanted = [fmt for fmt in self.variants.sibling_formats if accepts(accepted, FORMATS[fmt][2])]
+        if not wanted:
+            return path
+        siblings = dict(self.variants.siblings(path))
+        if any(fmt not in siblings for fmt in wanted):
+            try:
+                self.variants.schedule_siblings(path)
+            except Exception as e:
+                logger.warning(f"提交编码版本生成失败: {path.name}, {e}")
+        candidates = [path] + [siblings[fmt] for fmt in wanted if fmt in siblings]
+        return min(candidates, key=lambda candidate: candidate.stat().st_size)
+
+    async def _variant(self, path: Path, name: str, width: str) -> Path:
+        """返回缩放版本路径，宽度不在白名单内时返回 400"""
+        if not width.isdigit() or int(width) not in self.variants.widths:
+            raise web.HTTPBadRequest(text=f"w 可选值: {', '.join(map(str, self.variants.widths))}\n")
+        try:
+            return await self.variants.get(path, name, int(width))
+        except Exception as e:
+            logger.error(f"缩放版本不可用，返回原图: {name} w={width}, {e}")
+            return path
+
+    async def _serve(self, request: web.Request, path: Path, headers: Dict[str, str]) -> web.StreamResponse:
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            self.cache.invalidate(path)
+            raise web.HTTPNotFound()
+
+        obj = self.cache.get(path, st)
+        if obj is None and request.method == "GET" and self.cache.admits(st.st_size):
+            try:
+                obj = await asyncio.get_running_loop().run_in_executor(None, self.cache.load, path)
+            except FileNotFoundError:
+                raise web.HTTPNotFound()
+        if obj is not None:
+            return self._object_response(request, obj, headers)
+        # aiohttp 使用独立的 MIME 表（不含 webp/avif），与内存缓存一样按 mimetypes 设置类型
+        content_type = mimetypes.guess_type(path.name)[0]
+        if content_type:
+            headers = {**headers, "Content-Type": content_type}
+        return web.FileResponse(path, headers=headers)
+
+    @staticmethod
+    def _object_response(request: web.Request, obj: HotObject, extra_headers: Dict[str, str]) -> web.Response:
+        """按与 FileResponse 相同的规则处理条件请求与 Range，返回内存中的内容"""
+        headers = {**extra_headers, "ETag": f'"{obj.etag}"', "Accept-Ranges": "bytes"}
+        if_none_match = request.if_none_match
+        if if_none_match:
+            if any(etag.value in (obj.etag, "*") for etag in if_none_match):
+                return ImageServer._not_modified(obj, headers)
+        elif request.if_modified_since and obj.last_modified <= request.if_modified_since.timestamp():
+            return ImageServer._not_modified(obj, headers)
+
+        status, body = 200, obj.data
+        if_range = request.if_range
+        if if_range is None or obj.last_modified <= if_range.timestamp():
+            try:
+                rng = request.http_range
+            except ValueError:
+                rng = slice(obj.size, None)
+            if rng.start is not None:
+                start, stop, _ = rng.indices(obj.size)
+                if start >= obj.size or start >= stop:
+                    headers["Content-Range"] = f"bytes */{obj.size}"
+                    raise web.HTTPRequestRangeNotSatisfiable(headers=headers)
+                status, body = 206, memoryview(obj.data)[start:stop]
+                headers["Content-Range"] = f"bytes {start}-{stop - 1}/{obj.size}"
+
+        response = web.Response(status=status, body=body, content_type=obj.content_type, headers=headers)
+        response.last_modified = obj.last_modified
+        return response
+
+    @staticmethod
+    def _not_modified(obj: HotObject, headers: dict) -> web.Response:
+        response = web.Response(status=304, headers=headers)
+        response.last_modified = obj.last_modified
+        return response
+
+    @staticmethod
+    async def _add_headers(request: web.Request, response: web.StreamResponse):
         """添加 CORS 和缓存头"""
         # 允许跨域访问
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', '*')
+        response.headers['Access-Control-Allow-Origin'] = '*'
+        response.headers['Access-Control-Allow-Methods'] = 'GET, HEAD, OPTIONS'
+        response.headers['Access-Control-Allow-Headers'] = '*'
         # 缓存设置
-        self.send_header('Cache-Control', 'public, max-age=86400')
-        super().end_headers()
+        if response.status < 400:
+            response.headers.setdefault('Cache-Control', CACHE_CONTROL)
 
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/", self.handle_index)
+        app.router.add_get("/-/stats", self.handle_stats)
+        app.router.add_get("/{name:.+}", self.handle_file)  # 同时处理 HEAD
+        app.router.add_route("OPTIONS", "/{name:.*}", self.handle_options)
+        app.on_response_prepare.append(self._add_headers)
+        return app
 
-def run_server(port=8080, host='0.0.0.0'):
-    """运行图片服务器"""
+    async def start(self, host: str = '0.0.0.0', port: int = IMAGE_SERVER_PORT):
+        """在当前事件循环中启动服务"""
+        disk_janitor.add_listener(self.cache.invalidate)
+        self._runner = web.AppRunner(self.make_app(), access_log=logger)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"图片服务器启动成功, 监听地址: {host}:{port}, 图片目录: {self.directory}")
+
+    async def stop(self):
+        disk_janitor.remove_listener(self.cache.invalidate)
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        self.variants.close()
+        logger.info(f"图片服务器已停止, 热点缓存: {self.cache.stats()}")
+
+
+def setup_logging():
+    """独立运行时的日志配置"""
+    handlers = [logging.StreamHandler(sys.stdout)]
     try:
-        server = HTTPServer((host, port), ImageHandler)
-        logger.info(f"图片服务器启动成功")
-        logger.info(f"监听地址: {host}:{port}")
-        logger.info(f"图片目录: {Path(__file__).parent / 'imagegen'}")
-        logger.info(f"访问示例: http://{host}:{port}/filename.png")
-        server.serve_forever()
-    except KeyboardInterrupt:
-        logger.info("收到中断信号,服务器停止")
-        server.shutdown()
-    except Exception as e:
-        logger.error(f"服务器运行错误: {e}")
-        raise
+        handlers.append(logging.FileHandler(LOG_FILE))
+    except OSError as e:
+        print(f"无法写入日志文件 {LOG_FILE}: {e}", file=sys.stderr)
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=handlers,
+    )
+
+
+def run_server(port=IMAGE_SERVER_PORT, host='0.0.0.0'):
+    """运行图片服务器"""
+    server = ImageServer()
+    logger.info(f"图片目录: {server.directory}, 访问示例: http://{host}:{port}/filename.png")
+    web.run_app(server.make_app(), host=host, port=port, access_log=logger, print=None)
+    logger.info("服务器已停止")
 
 
 if __name__ == '__main__':
     import argparse
-    
+
     parser = argparse.ArgumentParser(description='图片 HTTP 服务器')
-    parser.add_argument('--port', type=int, default=8080, help='监听端口(默认: 8080)')
+    parser.add_argument('--port', type=int, default=IMAGE_SERVER_PORT,
+                        help=f'监听端口(默认: IMAGE_SERVER_PORT={IMAGE_SERVER_PORT})')
     parser.add_argument('--host', default='0.0.0.0', help='监听地址(默认: 0.0.0.0)')
-    
+
     args = parser.parse_args()
-    
+
+    setup_logging()
     run_server(port=args.port, host=args.host)
@@ -0,0 +1,272 @@
+"""
+生成图片的派生版本
+- 缩放版本：图片服务器按 ?w=<宽度> 提供缩略图，宽度限定在白名单内。
+  钉钉卡片的 picURL 使用缩略图，messageURL 仍指向原图，客户端不必为了渲染预览下载原图
+- 编码版本：原图与缩放版本的 WebP / AVIF 副本，图片生成后在后台预先编码，
+  图片服务器按 Accept 请求头选择客户端可接受的最小版本
+
+派生版本在进程池中生成，同一版本的并发请求只生成一次；结果缓存到磁盘，源文件更新后重新生成
+"""
+import asyncio
+import hashlib
+import logging
+import mimetypes
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from config import (
+    CACHE_DIR, IMAGE_SERVER_URL, IMAGE_THUMB_WIDTH, IMAGE_VARIANT_WIDTHS,
+    IMAGE_VARIANT_WORKERS, IMAGE_VARIANT_QUALITY, IMAGE_SIBLING_FORMATS,
+)
+
+logger = logging.getLogger(__name__)
+
+VARIANT_DIR = CACHE_DIR / "variants"
+_UNSAFE_CHARS = re.compile(r'[^\w.-]')
+
+# 编码格式 -> (Pillow 格式名, 扩展名, MIME 类型)
+FORMATS = {
+    "jpeg": ("JPEG", "jpg", "image/jpeg"),
+    "webp": ("WEBP", "webp", "image/webp"),
+    "avif": ("AVIF", "avif", "image/avif"),
+}
+for _, _ext, _mime in FORMATS.values():
+    mimetypes.add_type(_mime, f".{_ext}")
+
+
+def supported_sibling_formats(formats: Tuple[str, ...] = IMAGE_SIBLING_FORMATS) -> Tuple[str, ...]:
+    """当前 Pillow 可以编码的编码版本格式（AVIF 需要 Pillow 11.2+）"""
+    from PIL import features
+
+    supported = []
+    for fmt in formats:
+        if fmt not in ("webp", "avif"):
+            logger.warning(f"不支持的编码版本格式: {fmt}")
+        elif features.check(fmt):
+            supported.append(fmt)
+        else:
+            logger.warning(f"Pillow 不支持 {fmt} 编码，跳过该格式")
+    return tuple(supported)
+
+
+def render_variant(src_path: str, dst_path: str, width: Optional[int], fmt: str, quality: int) -> int:
+    """
+    生成派生版本（在工作进程中执行）
+
+    width 不为空时缩放到不超过该宽度（不放大），JPEG 源图使用 draft 模式在解码阶段直接缩小；
+    输出 JPEG 时透明图片铺白底，WebP / AVIF 保留透明通道。
+    结果先写临时文件再原子替换
+
+    Returns:
+        结果字节数
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(src_path) as img:
+        if width and img.format == 'JPEG' and img.width > width:
+            img.draft('RGB', (width, img.height * width // img.width))
+        img = ImageOps.exif_transpose(img)
+        if width and img.width > width:
+            img = img.resize((width, max(1, round(img.height * width / img.width))), Image.Resampling.LANCZOS)
+
+        has_alpha = img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+        if has_alpha and fmt == "jpeg":
+            img = img.convert('RGBA')
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[3])
+            img = background
+        elif img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if has_alpha else 'RGB')
+
+        tmp_path = f"{dst_path}.{os.getpid()}.tmp"
+        try:
+            options = {"optimize": True} if fmt == "jpeg" else {}
+            img.save(tmp_path, format=FORMATS[fmt][0], quality=quality, **options)
+            os.replace(tmp_path, dst_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    return os.path.getsize(dst_path)
+
+
+def thumbnail_url(image_url: str, width: int = IMAGE_THUMB_WIDTH) -> str:
+    """
+    图片服务器上图片的缩略图 URL（用作卡片 picURL）
+
+    width 为 0、不在白名单内或不是本服务器的图片时返回原 URL
+    """
+    if not width or width not in IMAGE_VARIANT_WIDTHS or not image_url.startswith(f"{IMAGE_SERVER_URL}/"):
+        return image_url
+    return f"{image_url}{'&' if '?' in image_url else '?'}w={width}"
+
+
+class VariantStore:
+    """派生版本的磁盘缓存"""
+
+    def __init__(self, directory: Path = VARIANT_DIR, widths: Tuple[int, ...] = IMAGE_VARIANT_WIDTHS,
+                 workers: int = IMAGE_VARIANT_WORKERS, quality: int = IMAGE_VARIANT_QUALITY,
+                 sibling_formats: Optional[Tuple[str, ...]] = None):
+        """
+        Args:
+            directory: 缓存目录
+            widths: 允许的宽度白名单
+            workers: 生成进程数，0 表示在线程池中生成
+            quality: 编码质量
+            sibling_formats: 编码版本格式，默认为配置中 Pillow 支持的格式
+        """
+        self.directory = Path(directory)
+        self.widths = tuple(widths)
+        self.workers = workers
+        self.quality = quality
+        self.sibling_formats = (
+            supported_sibling_formats() if sibling_formats is None else tuple(sibling_formats)
+        )
+        self._pool: Optional[Executor] = None
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self._failed: Dict[str, int] = {}  # 生成失败的目标 -> 失败时源文件的 mtime_ns，源文件不变时不在后台重试
+        self._rendered = 0
+
+    def _get_pool(self) -> Executor:
+        """惰性创建进程池（spawn 方式，避免 fork 多线程进程）"""
+        with self._lock:
+            if self._pool is None:
+                if self.workers > 0:
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                    )
+                else:
+                    self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="image-variant")
+            return self._pool
+
+    @staticmethod
+    def _cache_stem(key: str, display: str) -> str:
+        """缓存文件名前缀: <可读文件名>.<路径哈希>，不同路径（如 a.png 与 a.jpg、a/b.png 与 a_b.png）不会共用缓存"""
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+        return f"{_UNSAFE_CHARS.sub('_', display)}.{digest}"
+
+    def variant_path(self, name: str, width: int) -> Path:
+        """缩放版本路径: <文件名>.<相对路径哈希>_w<宽度>.jpg"""
+        return self.directory / f"{self._cache_stem(name, os.path.basename(name))}_w{width}.jpg"
+
+    def sibling_path(self, source: Path, fmt: str) -> Path:
+        """
+        编码版本路径: <源文件名>.<源路径哈希>.<扩展名>，源文件可以是原图或缩放版本
+
+        按真实路径计算哈希：生成图片时预先编码用的 imagegen/ 路径与图片服务器 resolve() 后的路径
+        在目录是符号链接时也能对应到同一个缓存文件
+        """
+        return self.directory / f"{self._cache_stem(os.path.realpath(source), source.name)}.{FORMATS[fmt][1]}"
+
+    @staticmethod
+    def _fresh(path: Path, source: Path) -> bool:
+        """派生版本存在且不早于源文件"""
+        try:
+            return path.stat().st_mtime_ns >= source.stat().st_mtime_ns
+        except FileNotFoundError:
+            return False
+
+    def _submit(self, source: Path, dst: Path, width: Optional[int], fmt: str) -> Future:
+        """提交生成任务，同一目标正在生成时复用"""
+        key = str(dst)
+        source_mtime = source.stat().st_mtime_ns
+        self.directory.mkdir(parents=True, exist_ok=True)
+        pool = self._get_pool()
+        with self._lock:
+            future = self._inflight.get(key)
+            submitted = future is None
+            if submitted:
+                future = pool.submit(render_variant, str(source), key, width, fmt, self.quality)
+                self._inflight[key] = future
+        if submitted:
+            future.add_done_callback(lambda f: self._on_rendered(key, source_mtime, f))
+        return future
+
+    def _on_rendered(self, key: str, source_mtime: int, future: Future):
+        with self._lock:
+            self._inflight.pop(key, None)
+            if not future.cancelled() and future.exception() is not None:
+                self._failed[key] = source_mtime
+            else:
+                self._failed.pop(key, None)
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            logger.error(f"生成派生版本失败: {os.path.basename(key)}, {future.exception()}")
+            return
+        self._rendered += 1
+        logger.info(f"已生成派生版本: {os.path.basename(key)} ({future.result() / 1024:.1f}KB)")
+
+    async def get(self, source: Path, name: str, width: int) -> Path:
+        """
+        返回源图片指定宽度的缩放版本，缓存不存在或早于源文件时生成
+
+        Args:
+            source: 源图片路径
+            name: 源图片在图片目录中的相对路径
+            width: 宽度，必须在白名单内
+
+        Raises:
+            ValueError: 宽度不在白名单内
+        """
+        if width not in self.widths:
+            raise ValueError(f"不支持的宽度: {width}，可用: {', '.join(map(str, self.widths))}")
+        dst = self.variant_path(name, width)
+        if not self._fresh(dst, source):
+            await asyncio.shield(asyncio.wrap_future(self._submit(source, dst, width, "jpeg")))
+        return dst
+
+    def siblings(self, source: Path) -> List[Tuple[str, Path]]:
+        """已生成且不早于源文件的编码版本 [(格式, 路径)]"""
+        result = []
+        for fmt in self.sibling_formats:
+            path = self.sibling_path(source, fmt)
+            if self._fresh(path, source):
+                result.append((fmt, path))
+        return result
+
+    def schedule_siblings(self, source: Path) -> List[Future]:
+        """在后台生成缺失的编码版本（不等待结果，源文件未变时不重试失败的版本）"""
+        futures = []
+        for fmt in self.sibling_formats:
+            dst = self.sibling_path(source, fmt)
+            if self._fresh(dst, source):
+                continue
+            with self._lock:
+                failed_mtime = self._failed.get(str(dst))
+            if failed_mtime is not None and failed_mtime == source.stat().st_mtime_ns:
+                continue
+            futures.append(self._submit(source, dst, None, fmt))
+        return futures
+
+    def prepare_generated(self, image_path: str) -> List[Future]:
+        """图片生成后在后台预先生成原图的编码版本与卡片缩略图（不等待结果）"""
+        source = Path(image_path)
+        futures = self.schedule_siblings(source)
+        if IMAGE_THUMB_WIDTH in self.widths:
+            dst = self.variant_path(source.name, IMAGE_THUMB_WIDTH)
+            if not self._fresh(dst, source):
+                futures.append(self._submit(source, dst, IMAGE_THUMB_WIDTH, "jpeg"))
+        return futures
+
+    def stats(self) -> Dict[str, int]:
+        """返回 {rendered, inflight}"""
+        with self._lock:
+            return {"rendered": self._rendered, "inflight": len(self._inflight)}
+
+    def close(self):
+        """关闭进程池"""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+# 全局单例
+variant_store = VariantStore()
@@ -0,0 +1,164 @@
+"""
+互动卡片回复
+每个请求只投放一张卡片并原地更新：先显示处理进度，完成后替换为最终结果，
+代替 "收到任务" 提示 + 若干条结果消息的多条推送
+"""
+import logging
+import threading
+import time
+import uuid
+from typing import Optional
+
+from config import CARD_TEMPLATE_ID, CARD_UPDATE_MIN_INTERVAL
+from deadline import Deadline, timeout_for
+from delivery_router import DeliveryTarget
+from dingtalk_sender import dingtalk_sender
+from http_client import http_client
+from rate_limiter import openapi_limiter, call_with_throttle_retry
+
+logger = logging.getLogger(__name__)
+
+CARD_CREATE_URL = "https://api.dingtalk.com/v1.0/card/instances/createAndDeliver"
+CARD_UPDATE_URL = "https://api.dingtalk.com/v1.0/card/instances"
+
+# 卡片模板变量 status 的取值
+STATUS_PROCESSING = "processing"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+
+class InteractiveCard:
+    """
+    一张可原地更新的互动卡片
+
+    卡片模板需包含 title、content（Markdown）与 status 三个变量
+    """
+
+    def __init__(self, target: DeliveryTarget, title: str, template_id: str = CARD_TEMPLATE_ID,
+                 min_interval: float = CARD_UPDATE_MIN_INTERVAL):
+        """
+        Args:
+            target: 投递目标（群聊投放到群，单聊投放给用户）
+            title: 卡片标题
+            template_id: 卡片模板 ID
+            min_interval: 进度更新的最小间隔(秒)，间隔内的进度更新被跳过，最终结果不受限制
+        """
+        self.target = target
+        self.title = title
+        self.template_id = template_id
+        self.min_interval = min_interval
+        self.out_track_id = uuid.uuid4().hex
+        self.created = False
+        self.updates = 0
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()  # 卡片更新依次发出，最终结果总是最后一次 PUT
+        self._last_update = 0.0
+        self._finished = False
+
+    def _card_data(self, content: str, status: str) -> dict:
+        return {"cardParamMap": {"title": self.title, "content": content, "status": status}}
+
+    def _open_space(self) -> dict:
+        """投放空间：群聊投放到群会话，单聊投放到与机器人的单聊"""
+        robot_code = dingtalk_sender.client_id
+        if self.target.is_group:
+            return {
+                "openSpaceId": f"dtv1.card//IM_GROUP.{self.target.conversation_id}",
+                "imGroupOpenSpaceModel": {"supportForward": True},
+                "imGroupOpenDeliverModel": {"robotCode": robot_code},
+            }
+        return {
+            "openSpaceId": f"dtv1.card//IM_ROBOT.{self.target.user_id}",
+            "imRobotOpenSpaceModel": {"supportForward": True},
+            "imRobotOpenDeliverModel": {"spaceType": "IM_ROBOT", "robotCode": robot_code},
+        }
+
+    def _call(self, method: str, url: str, payload: dict, label: str, deadline: Optional[Deadline]) -> bool:
+        """调用卡片接口"""
+        response = None
+        try:
+            headers = {
+                "Content-Type": "application/json",
+                "x-acs-dingtalk-access-token": dingtalk_sender._get_access_token(deadline)
+            }
+            response = call_with_throttle_retry(
+                openapi_limiter, url,
+                lambda: http_client.dingtalk_session.request(
+                    method, url, headers=headers, json=payload,
+                    timeout=timeout_for(deadline, 10, label)
+                ),
+                label, deadline
+            )
+            response.raise_for_status()
+            result = response.json()
+            if result.get("success") is False:
+                raise RuntimeError(f"{result}")
+            return True
+        except Exception as e:
+            logger.error(f"{label}失败: {e}, response={response.text[:500] if response is not None else 'None'}")
+            return False
+
+    def create(self, content: str, deadline: Optional[Deadline] = None) -> bool:
+        """
+        创建并投放卡片
+
+        Returns:
+            是否成功；失败时调用方应回退到普通消息
+        """
+        payload = {
+            "cardTemplateId": self.template_id,
+            "outTrackId": self.out_track_id,
+            "cardData": self._card_data(content, STATUS_PROCESSING),
+            "userIdType": 1,
+            **self._open_space(),
+        }
+        self.created = self._call("POST", CARD_CREATE_URL, payload, "投放互动卡片", deadline)
+        if self.created:
+            self._last_update = time.monotonic()
+            logger.info(f"已投放互动卡片: {self.out_track_id}")
+        return self.created
+
+    def update(self, content: str, status: str = STATUS_PROCESSING, deadline: Optional[Deadline] = None,
+               force: bool = False) -> bool:
+        """
+        原地更新卡片内容
+
+        Args:
+            content: 新的 Markdown 内容
+            status: 卡片状态
+            deadline: 消息处理截止时间(可选)
+            force: 忽略最小更新间隔（最终结果使用）
+
+        Returns:
+            是否已更新（进度更新因间隔过短被跳过时返回 False）
+        """
+        with self._lock:
+            if not self.created or self._finished:
+                return False
+            now = time.monotonic()
+            if not force and now - self._last_update < self.min_interval:
+                return False
+            self._last_update = now
+            if status != STATUS_PROCESSING:
+                self._finished = True  # 结束后不再接受进度更新
+        payload = {
+            "outTrackId": self.out_track_id,
+            "cardData": self._card_data(content, status),
+            "cardUpdateOptions": {"updateCardDataByKey": True},
+        }
+        # 最终结果等待进行中的进度更新完成后再发出；等待期间已结束的进度更新直接放弃
+        with self._send_lock:
+            if status == STATUS_PROCESSING and self._finished:
+                return False
+            success = self._call("PUT", CARD_UPDATE_URL, payload, "更新互动卡片", deadline)
+        if success:
+            self.updates += 1
+        return success
+
+    def finish(self, content: str, deadline: Optional[Deadline] = None) -> bool:
+        """用最终结果更新卡片"""
+        return self.update(content, STATUS_DONE, deadline, force=True)
+
+    def fail(self, content: str, deadline: Optional[Deadline] = None) -> bool:
+        """将卡片标记为失败"""
+        return self.update(content, STATUS_FAILED, deadline, force=True)
@@ -0,0 +1,137 @@
+"""
+钉钉媒体文件缓存
+按图片内容哈希缓存 upload_media 返回的 media_id（内存 + 磁盘），
+同一张图片只上传一次，之后图片消息直接以 media_id 引用
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from deadline import Deadline
+
+logger = logging.getLogger(__name__)
+
+# 上传函数: (file_path, media_type, deadline=) -> media_id 或 None
+UploadFunc = Callable[..., Optional[str]]
+
+
+def file_sha256(file_path: str, chunk_size: int = 65536) -> str:
+    """计算文件内容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MediaCache:
+    """media_id 缓存，条目格式 {内容哈希: {"media_id": str, "expires_at": 时间戳}}"""
+
+    def __init__(self, upload: UploadFunc, cache_file: Path, ttl_seconds: float):
+        """
+        Args:
+            upload: 上传函数（DingTalkSender.upload_media）
+            cache_file: 磁盘缓存文件
+            ttl_seconds: media_id 的缓存有效期(秒)，应小于钉钉临时素材的有效期
+        """
+        self._upload = upload
+        self.cache_file = Path(cache_file)
+        self.ttl = ttl_seconds
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, List] = {}  # {内容哈希: [锁, 持有或等待的线程数]}
+        self._entries: Dict[str, dict] = self._load()
+
+    def _load(self) -> Dict[str, dict]:
+        """从磁盘加载未过期的条目"""
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"media_id 缓存文件无法读取，忽略: {e}")
+            return {}
+        now = time.time()
+        entries = {k: v for k, v in entries.items() if v.get("expires_at", 0) > now}
+        logger.info(f"已加载 {len(entries)} 条 media_id 缓存")
+        return entries
+
+    def _save(self):
+        """原子写入磁盘（调用方需持有 _lock）"""
+        try:
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.cache_file.with_suffix('.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.cache_file)
+        except OSError as e:
+            logger.warning(f"保存 media_id 缓存失败: {e}")
+
+    def _lookup(self, digest: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry and entry["expires_at"] > time.time():
+                return entry["media_id"]
+            return None
+
+    @contextmanager
+    def _key_lock(self, digest: str):
+        """
+        同一内容的并发上传只进行一次
+
+        最后一个持有或等待者退出时移除锁，上传成功或失败都不会遗留条目
+        """
+        with self._lock:
+            entry = self._key_locks.setdefault(digest, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    self._key_locks.pop(digest, None)
+
+    def get_media_id(self, file_path: str, media_type: str = "image",
+                     deadline: Optional[Deadline] = None,
+                     prepare: Optional[Callable[[str], str]] = None) -> Optional[str]:
+        """
+        获取文件对应的 media_id，未缓存时上传
+
+        Args:
+            file_path: 本地文件路径（以其内容哈希作为缓存键）
+            media_type: 媒体类型
+            deadline: 消息处理截止时间(可选)
+            prepare: 上传前的处理函数(可选)，如压缩；返回实际上传的文件路径，仅在未命中缓存时调用
+
+        Returns:
+            media_id，上传失败返回 None
+        """
+        digest = file_sha256(file_path)
+
+        media_id = self._lookup(digest)
+        if media_id:
+            logger.info(f"命中 media_id 缓存: {digest[:12]}")
+            return media_id
+
+        with self._key_lock(digest):
+            media_id = self._lookup(digest)
+            if media_id:
+                return media_id
+            upload_path = prepare(file_path) if prepare else file_path
+            media_id = self._upload(upload_path, media_type, deadline=deadline)
+            if not media_id:
+                return None
+            with self._lock:
+                now = time.time()
+                self._entries = {k: v for k, v in self._entries.items() if v["expires_at"] > now}
+                self._entries[digest] = {"media_id": media_id, "expires_at": now + self.ttl}
+                self._save()
+            return media_id
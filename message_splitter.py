@@ -0,0 +1,151 @@
+"""
+长消息分割
+按 UTF-8 字节数（钉钉消息长度限制的实际计量方式）把长文本切成若干条消息：
+优先在标题、段落处断开，代码块被切断时在前一条末尾闭合、在下一条开头按原语言重新打开，
+并为每条消息编号。单次扫描，分段结果直接拼接，整体为线性时间
+"""
+import re
+from typing import Iterator, List, Optional, Tuple
+
+_HEADING = re.compile(r'#{1,6}\s')
+_FENCE = re.compile(r'\s{0,3}(`{3,}|~{3,})')
+
+# 断点优先级（断在该行之前）
+BREAK_LINE = 1
+BREAK_PARAGRAPH = 2
+BREAK_HEADING = 3
+BREAK_FORCED = 0  # 代码块内部（需要闭合再重开）或超长行中间
+
+PART_HEADER_RESERVE = 16  # 为编号 "(12/34)" 预留的字节数
+MIN_FILL = 0.5  # 优先级断点需达到的最小填充比例，避免切出过短的消息
+
+
+def _byte_len(text: str) -> int:
+    return len(text.encode('utf-8'))
+
+
+def _fence_marker(opener: str) -> str:
+    """代码块起始行中的围栏标记（``` 或 ~~~），也是对应的闭合标记"""
+    return _FENCE.match(opener).group(1)
+
+
+def _hard_split(line: str, max_bytes: int) -> List[str]:
+    """把超长单行按字节切开（不切断多字节字符）"""
+    data = line.encode('utf-8')
+    pieces = []
+    while len(data) > max_bytes:
+        cut = max_bytes
+        while cut > 0 and (data[cut] & 0xC0) == 0x80:  # UTF-8 续字节
+            cut -= 1
+        pieces.append(data[:cut].decode('utf-8'))
+        data = data[cut:]
+    pieces.append(data.decode('utf-8'))
+    return pieces
+
+
+def _scan(content: str, line_budget: int) -> Tuple[List[str], List[int], List[Optional[str]], List[int]]:
+    """
+    预处理：分行、计算字节数、代码块状态与每行之前的断点优先级
+
+    Returns:
+        (lines, sizes, fence_before, priority)；fence_before[i] 为第 i 行之前所处代码块的起始行，
+        不在代码块中时为 None
+    """
+    lines, sizes, fence_before, priority = [], [], [], []
+    fence: Optional[str] = None  # 当前代码块的起始行（不含换行）
+    prev_blank = False
+    for raw in content.splitlines(keepends=True):
+        stripped = raw.rstrip('\n')
+        pieces = _hard_split(raw, line_budget) if _byte_len(raw) > line_budget else [raw]
+        for k, piece in enumerate(pieces):
+            if fence is not None or k > 0:
+                p = BREAK_FORCED
+            elif _HEADING.match(stripped):
+                p = BREAK_HEADING
+            elif prev_blank:
+                p = BREAK_PARAGRAPH
+            else:
+                p = BREAK_LINE
+            lines.append(piece)
+            sizes.append(_byte_len(piece))
+            fence_before.append(fence)
+            priority.append(p)
+
+        match = _FENCE.match(stripped)
+        if match:
+            marker = match.group(1)
+            if fence is None:
+                fence = stripped
+            elif stripped.strip() == marker and marker[0] == _fence_marker(fence)[0] \
+                    and len(marker) >= len(_fence_marker(fence)):
+                fence = None
+        prev_blank = not stripped.strip()
+    return lines, sizes, fence_before, priority
+
+
+def split_message(content: str, max_bytes: int) -> List[str]:
+    """
+    按字节上限分割消息
+
+    Args:
+        content: 原始文本（纯文本或 Markdown）
+        max_bytes: 单条消息的 UTF-8 字节上限（已扣除编号预留）
+
+    Returns:
+        分割后的各段内容；未超出上限时返回 [content]。断点后的空行可能单独成段，
+        去除空白后为空的段被丢弃，不会以 "(n/N)" 空消息发出
+    """
+    if _byte_len(content) <= max_bytes:
+        return [content]
+
+    # 单行上限需容纳重开代码块的起始行与闭合标记
+    line_budget = max(1, max_bytes // 4)
+    lines, sizes, fence_before, priority = _scan(content, line_budget)
+    n = len(lines)
+    min_fill = max_bytes * MIN_FILL
+    parts = []
+    i = 0
+    while i < n:
+        start = i
+        reopen = fence_before[start]
+        prefix = f"{reopen}\n" if reopen else ""
+        size = _byte_len(prefix)
+        best = None  # (优先级, 断点行号)
+        while i < n:
+            if i > start:
+                fence = fence_before[i]
+                close = 1 + len(_fence_marker(fence)) if fence else 0
+                if size + close <= max_bytes:
+                    key = (priority[i] if size >= min_fill else -1, i)
+                    if best is None or key >= best:
+                        best = key
+            if size + sizes[i] > max_bytes and i > start:
+                break
+            size += sizes[i]
+            i += 1
+        if i < n and best is not None:
+            i = best[1]
+        part = _render(prefix, lines[start:i], fence_before[i] if i < n else None)
+        if part.strip():
+            parts.append(part)
+    return parts
+
+
+def _render(prefix: str, lines: List[str], open_fence: Optional[str]) -> str:
+    """拼接一段内容；在代码块内部断开时补上闭合标记"""
+    text = prefix + "".join(lines)
+    if open_fence:
+        text = text.rstrip('\n') + "\n" + _fence_marker(open_fence)
+    return text.rstrip('\n')
+
+
+def number_parts(parts: List[str]) -> Iterator[Tuple[str, str]]:
+    """
+    为分段编号
+
+    Yields:
+        (编号标签如 "(1/3)"，单条时为空字符串, 内容)
+    """
+    total = len(parts)
+    for index, part in enumerate(parts, 1):
+        yield (f"({index}/{total})" if total > 1 else ""), part
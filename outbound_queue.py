@@ -0,0 +1,187 @@
+"""
+钉钉主动消息发送队列
+将短时间窗口内内容相同（msgKey + msgParam）的单聊消息合并为一次 oToMessages/batchSend 调用，
+所有发送由单个工作线程在同一条长连接上依次发出
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+from deadline import Deadline
+
+logger = logging.getLogger(__name__)
+
+# batchSend 单次调用最多支持的 userIds 数量
+BATCH_SEND_MAX_USERS = 20
+
+# 实际发送函数: (user_ids, msg_key, msg_param, timeout, deadline) -> 是否成功
+SendBatchFunc = Callable[[List[str], str, str, float, Optional[Deadline]], bool]
+
+
+@dataclass
+class OutboundItem:
+    """一条待发送的单聊消息"""
+    user_id: str
+    msg_key: str
+    msg_param: str  # 已序列化的 JSON 字符串，作为合并依据
+    timeout: float = 10  # 单次调用超时上限(秒)
+    deadline: Optional[Deadline] = None
+    future: Future = field(default_factory=Future)
+
+
+@dataclass
+class OutboundBatch:
+    """一次 batchSend 调用"""
+    msg_key: str
+    msg_param: str
+    items: List[OutboundItem] = field(default_factory=list)
+
+
+class OutboundQueue:
+    """
+    合并发送队列
+
+    调用方 submit() 后得到 Future；工作线程收集一个时间窗口内的消息，
+    按内容合并后依次发送。合并时保证同一用户的消息顺序不变。
+    """
+
+    def __init__(self, send_batch: SendBatchFunc, window_seconds: float,
+                 max_users: int = BATCH_SEND_MAX_USERS):
+        """
+        Args:
+            send_batch: 实际发送函数
+            window_seconds: 合并窗口(秒)
+            max_users: 单次调用最多合并的用户数
+        """
+        self._send_batch = send_batch
+        self.window = window_seconds
+        self.max_users = max_users
+        self._queue: "queue.Queue[OutboundItem]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._messages = 0
+        self._calls = 0
+
+    def submit(self, user_id: str, msg_key: str, msg_param: str, timeout: float = 10,
+               deadline: Optional[Deadline] = None) -> Future:
+        """
+        提交一条消息
+
+        Args:
+            user_id: 用户ID
+            msg_key: 消息模板 (sampleText / sampleMarkdown / sampleImageMsg)
+            msg_param: 已序列化的消息参数
+            timeout: 单次调用超时上限(秒)
+            deadline: 消息处理截止时间(可选)
+
+        Returns:
+            Future，结果为是否发送成功
+        """
+        item = OutboundItem(user_id, msg_key, msg_param, timeout, deadline)
+        self._ensure_worker()
+        self._queue.put(item)
+        return item.future
+
+    def depth(self) -> int:
+        """当前排队中的消息数"""
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        """返回 {messages: 已处理消息数, calls: 实际调用次数}"""
+        with self._stats_lock:
+            return {"messages": self._messages, "calls": self._calls}
+
+    def _ensure_worker(self):
+        """惰性启动工作线程"""
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="dingtalk-outbound", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        """工作线程主循环"""
+        while True:
+            items = self._collect()
+            for batch in self.group(items, self.max_users):
+                self._send(batch)
+
+    def _collect(self) -> List[OutboundItem]:
+        """阻塞等待第一条消息，再收集窗口期内到达的其余消息"""
+        items = [self._queue.get()]
+        window_end = time.monotonic() + self.window
+        while True:
+            remaining = window_end - time.monotonic()
+            try:
+                items.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                return items
+
+    @staticmethod
+    def group(items: List[OutboundItem], max_users: int = BATCH_SEND_MAX_USERS) -> List[OutboundBatch]:
+        """
+        按内容合并消息
+
+        一条消息只会并入「该用户最近一条消息所在批次之后」的同内容批次，
+        因此每个用户收到的消息顺序与提交顺序一致。
+
+        Returns:
+            按发送顺序排列的批次
+        """
+        batches: List[OutboundBatch] = []
+        latest: Dict[Tuple[str, str], int] = {}  # 内容 -> 最近一个同内容批次的下标
+        user_last: Dict[str, int] = {}  # 用户 -> 该用户最近所在批次的下标
+
+        for item in items:
+            key = (item.msg_key, item.msg_param)
+            index = latest.get(key)
+            if (index is None
+                    or user_last.get(item.user_id, -1) >= index
+                    or len(batches[index].items) >= max_users):
+                batches.append(OutboundBatch(item.msg_key, item.msg_param))
+                index = len(batches) - 1
+                latest[key] = index
+            batches[index].items.append(item)
+            user_last[item.user_id] = index
+        return batches
+
+    def _send(self, batch: OutboundBatch):
+        """发送一个批次并回填所有 Future（调用方已放弃等待的消息不再发送）"""
+        live = []
+        for item in batch.items:
+            if not item.future.set_running_or_notify_cancel():
+                continue
+            if item.deadline is not None and item.deadline.expired():
+                logger.warning(f"消息已超出处理预算，放弃发送: user={item.user_id}")
+                item.future.set_result(False)
+            else:
+                live.append(item)
+        if not live:
+            return
+
+        # 合并后的调用需满足批次内最紧的超时要求
+        timeout = min(
+            item.timeout if item.deadline is None else min(item.timeout, item.deadline.remaining())
+            for item in live
+        )
+        # 等待 token 与限流时以批次内最早的截止时间为准
+        deadline = min((item.deadline for item in live if item.deadline is not None),
+                       key=lambda d: d.remaining(), default=None)
+        user_ids = [item.user_id for item in live]
+        if len(user_ids) > 1:
+            logger.info(f"合并发送 {batch.msg_key} 消息到 {len(user_ids)} 个用户")
+        try:
+            success = self._send_batch(user_ids, batch.msg_key, batch.msg_param, timeout, deadline)
+        except Exception as e:
+            logger.error(f"批量发送消息失败: {e}")
+            success = False
+
+        with self._stats_lock:
+            self._messages += len(live)
+            self._calls += 1
+        for item in live:
+            item.future.set_result(success)
@@ -0,0 +1,224 @@
+"""
+钉钉接口限流
+所有主动调用钉钉的请求（OpenAPI 与 session webhook 分别限流）先经过令牌桶，
+识别限流响应后暂停该类调用并退避重试，避免批量结果推送或长文本分段时触发 QPS 限制而丢消息
+"""
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from config import (
+    DINGTALK_OPENAPI_QPS,
+    DINGTALK_WEBHOOK_QPS,
+    DINGTALK_THROTTLE_RETRIES,
+)
+from deadline import Deadline, DeadlineExceeded
+from retry_budget import retry_budgets
+
+logger = logging.getLogger(__name__)
+
+# OpenAPI 限流错误码（HTTP 403 / 429 响应体中的 code 字段）
+OPENAPI_THROTTLE_CODES = (
+    "Forbidden.AccessDenied.QpsLimitForApi",
+    "Forbidden.AccessDenied.QpsLimitForAppkeyAndApi",
+    "Forbidden.AccessDenied.QpsLimitForAppkey",
+)
+# oapi / session webhook 限流 errcode（HTTP 200 响应体）
+# 90018: 调用超过每秒限制; 130101: 机器人发送太快
+WEBHOOK_THROTTLE_ERRCODES = (90018, 130101)
+
+
+class RateLimiter:
+    """令牌桶限流器，同时支持线程与协程等待"""
+
+    def __init__(self, name: str, rate: float, burst: Optional[float] = None):
+        """
+        Args:
+            name: 名称（用于日志）
+            rate: 每秒允许的调用数
+            burst: 突发上限，默认等于 rate
+        """
+        self.name = name
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._waiting = 0
+        self._acquired = 0
+        self._throttled = 0
+
+    def _reserve(self) -> float:
+        """预订一个令牌，返回需要等待的时间(秒)"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= 1  # 允许为负，表示已被预订的未来令牌
+            self._acquired += 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            return max(wait, self._paused_until - now)
+
+    def _cancel(self):
+        """归还未使用的预订"""
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + 1)
+            self._acquired -= 1
+
+    def _check_wait(self, wait: float, deadline: Optional[Deadline]):
+        if deadline is not None and wait > deadline.remaining():
+            self._cancel()
+            raise DeadlineExceeded(f"等待{self.name}限流超出处理预算 ({wait:.1f}s)")
+
+    def acquire(self, deadline: Optional[Deadline] = None):
+        """
+        阻塞直到允许发送
+
+        Args:
+            deadline: 消息处理截止时间(可选)，等待时间超出剩余预算时抛出 DeadlineExceeded
+        """
+        wait = self._reserve()
+        if wait <= 0:
+            return
+        self._check_wait(wait, deadline)
+        with self._lock:
+            self._waiting += 1
+        try:
+            time.sleep(wait)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+    async def acquire_async(self, deadline: Optional[Deadline] = None):
+        """协程版本的 acquire，等待时不占用线程"""
+        wait = self._reserve()
+        if wait <= 0:
+            return
+        self._check_wait(wait, deadline)
+        with self._lock:
+            self._waiting += 1
+        try:
+            await asyncio.sleep(wait)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+    def penalize(self, seconds: float):
+        """收到限流响应后暂停该类调用，并清空已积累的突发令牌"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = min(self._tokens, 0.0)
+            self._throttled += 1
+
+    def depth(self) -> int:
+        """当前正在排队等待的调用数"""
+        with self._lock:
+            return self._waiting
+
+    def stats(self) -> dict:
+        """返回 {waiting, acquired, throttled}"""
+        with self._lock:
+            return {"waiting": self._waiting, "acquired": self._acquired, "throttled": self._throttled}
+
+
+def is_throttled(response: Any) -> bool:
+    """
+    判断响应是否为钉钉限流响应（兼容 requests.Response 与 AsyncResponse）
+    """
+    if response.status_code == 429:
+        return True
+    try:
+        body = response.json()
+    except ValueError:
+        return False
+    if not isinstance(body, dict):
+        return False
+    if body.get("errcode") in WEBHOOK_THROTTLE_ERRCODES:
+        return True
+    code = str(body.get("code", ""))
+    return code in OPENAPI_THROTTLE_CODES or "QpsLimit" in code
+
+
+def _retry_after(response: Any, attempt: int) -> float:
+    """退避时间：优先使用 Retry-After 头，否则指数退避 1s, 2s, 4s..."""
+    value = response.headers.get("Retry-After") if response.headers else None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return float(2 ** (attempt - 1))
+
+
+def _should_retry(limiter: RateLimiter, response: Any, attempt: int, label: str,
+                  deadline: Optional[Deadline], logical) -> Optional[float]:
+    """限流时暂停限流器并返回退避时间；不再重试时返回 None"""
+    wait = _retry_after(response, attempt)
+    limiter.penalize(wait)
+    if attempt > DINGTALK_THROTTLE_RETRIES:
+        logger.error(f"{label}被钉钉限流，已重试 {DINGTALK_THROTTLE_RETRIES} 次，放弃发送")
+        return None
+    if deadline is not None and deadline.remaining() <= wait:
+        logger.error(f"{label}被钉钉限流，剩余处理预算不足以退避重试")
+        return None
+    if not logical.retry():
+        return None
+    logger.warning(f"{label}被钉钉限流({limiter.name})，{wait:.1f}s 后重试 ({attempt}/{DINGTALK_THROTTLE_RETRIES})")
+    return wait
+
+
+def call_with_throttle_retry(limiter: RateLimiter, url: str, send: Callable[[], Any],
+                             label: str, deadline: Optional[Deadline] = None) -> Any:
+    """
+    经限流器发送请求，遇到限流响应时退避重试
+
+    Args:
+        limiter: 限流器
+        url: 请求地址（用于重试预算）
+        send: 实际发送函数，返回响应对象
+        label: 日志标签
+        deadline: 消息处理截止时间(可选)
+
+    Returns:
+        最后一次的响应对象
+    """
+    attempt = 0
+    with retry_budgets.request(url) as logical:
+        while True:
+            limiter.acquire(deadline)
+            response = send()
+            if not is_throttled(response):
+                return response
+            attempt += 1
+            # 退避由限流器暂停实现，下一次 acquire 会等待到暂停结束
+            if _should_retry(limiter, response, attempt, label, deadline, logical) is None:
+                return response
+
+
+async def call_with_throttle_retry_async(limiter: RateLimiter, url: str, send: Callable[[], Awaitable[Any]],
+                                         label: str, deadline: Optional[Deadline] = None) -> Any:
+    """协程版本的 call_with_throttle_retry"""
+    attempt = 0
+    with retry_budgets.request(url) as logical:
+        while True:
+            await limiter.acquire_async(deadline)
+            response = await send()
+            if not is_throttled(response):
+                return response
+            attempt += 1
+            if _should_retry(limiter, response, attempt, label, deadline, logical) is None:
+                return response
+
+
+# 全局限流器：OpenAPI（api.dingtalk.com / oapi.dingtalk.com）与 session webhook 分开限流
+openapi_limiter = RateLimiter("钉钉 OpenAPI", DINGTALK_OPENAPI_QPS)
+webhook_limiter = RateLimiter("钉钉 Webhook", DINGTALK_WEBHOOK_QPS)
+
+
+def log_stats():
+    """输出限流器统计，存在排队或限流时以 WARNING 级别输出"""
+    for limiter in (openapi_limiter, webhook_limiter):
+        s = limiter.stats()
+        level = logging.WARNING if s["waiting"] or s["throttled"] else logging.INFO
+        logger.log(level, f"限流[{limiter.name}]: 排队={s['waiting']}, 已放行={s['acquired']}, 被限流={s['throttled']}")
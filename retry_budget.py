@@ -0,0 +1,202 @@
+"""
+全局重试预算
+按上游主机维护令牌桶：每个逻辑请求存入 ratio 个令牌，每次重试消耗 1 个令牌，
+令牌不足时放弃重试。上游故障期间重试量被限制在正常流量的固定比例内，
+避免一次请求在多层重试叠加下放大为十几次上游调用。
+"""
+import contextvars
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+from config import (
+    RETRY_BUDGET_RATIO,
+    RETRY_BUDGET_MIN_PER_SEC,
+    RETRY_BUDGET_MAX_TOKENS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class RetryBudget:
+    """单个上游主机的重试预算（令牌桶）"""
+
+    def __init__(self, name: str, ratio: float, min_per_sec: float, max_tokens: float):
+        """
+        Args:
+            name: 上游名称（主机名）
+            ratio: 允许的重试比例，每个请求存入的令牌数
+            min_per_sec: 每秒保底补充的令牌数，保证低流量时仍能重试
+            max_tokens: 令牌上限，限制故障开始时的突发重试量
+        """
+        self.name = name
+        self.ratio = ratio
+        self.min_per_sec = min_per_sec
+        self.max_tokens = max_tokens
+        self._lock = threading.Lock()
+        self._tokens = max_tokens
+        self._updated_at = time.monotonic()
+        self._requests = 0
+        self._retries = 0
+        self._denied = 0
+        self._attempts = Counter()
+
+    def _refill(self, deposit: float = 0.0):
+        """按时间补充保底令牌并存入 deposit，调用方需持有锁"""
+        now = time.monotonic()
+        self._tokens = min(
+            self.max_tokens,
+            self._tokens + (now - self._updated_at) * self.min_per_sec + deposit
+        )
+        self._updated_at = now
+
+    def record_request(self):
+        """记录一个新的逻辑请求"""
+        with self._lock:
+            self._requests += 1
+            self._refill(self.ratio)
+
+    def try_retry(self) -> bool:
+        """
+        申请一次重试
+
+        Returns:
+            True 表示允许重试（已扣除令牌），False 表示预算耗尽
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self._retries += 1
+                return True
+            self._denied += 1
+            return False
+
+    def record_attempts(self, attempts: int):
+        """记录一个逻辑请求最终的上游调用次数"""
+        with self._lock:
+            self._attempts[attempts] += 1
+
+    def snapshot(self) -> dict:
+        """返回统计快照"""
+        with self._lock:
+            self._refill()
+            return {
+                "requests": self._requests,
+                "retries": self._retries,
+                "denied": self._denied,
+                "tokens": round(self._tokens, 2),
+                "attempts": dict(sorted(self._attempts.items())),
+            }
+
+
+class LogicalRequest:
+    """一个逻辑请求，跨所有重试层累计上游调用次数"""
+
+    def __init__(self, budget: RetryBudget, counted: bool = True):
+        self.budget = budget
+        self.counted = counted
+        self.attempts = 1
+
+    def retry(self) -> bool:
+        """申请重试；允许时计入调用次数。不计入统计的请求（探测）直接放弃重试"""
+        if not self.counted:
+            return False
+        if self.budget.try_retry():
+            self.attempts += 1
+            return True
+        logger.warning(f"重试预算耗尽，放弃重试: {self.budget.name} (已调用 {self.attempts} 次)")
+        return False
+
+
+_current: contextvars.ContextVar[Optional[LogicalRequest]] = contextvars.ContextVar(
+    "retry_budget_request", default=None
+)
+
+
+class RetryBudgets:
+    """所有上游主机的重试预算注册表"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._budgets: Dict[str, RetryBudget] = {}
+
+    @staticmethod
+    def _host(url_or_host: str) -> str:
+        if "://" in url_or_host:
+            return urlsplit(url_or_host).hostname or url_or_host
+        return url_or_host
+
+    def get(self, url_or_host: str) -> RetryBudget:
+        """获取 URL 或主机名对应的预算（惰性创建）"""
+        host = self._host(url_or_host)
+        with self._lock:
+            budget = self._budgets.get(host)
+            if budget is None:
+                budget = RetryBudget(host, RETRY_BUDGET_RATIO, RETRY_BUDGET_MIN_PER_SEC, RETRY_BUDGET_MAX_TOKENS)
+                self._budgets[host] = budget
+            return budget
+
+    def current(self, url_or_host: str) -> Optional[LogicalRequest]:
+        """当前上下文中属于该主机的逻辑请求"""
+        request = _current.get()
+        if request is not None and request.budget is self.get(url_or_host):
+            return request
+        return None
+
+    @contextmanager
+    def request(self, url: str, count: bool = True):
+        """
+        标记一个逻辑请求的范围
+
+        嵌套使用时（业务层重试循环内部再经过传输层）复用外层的逻辑请求，
+        各层的重试都从同一个预算中扣除并计入同一个调用次数。
+
+        Args:
+            url: 请求地址
+            count: False 时不存入令牌、不计入请求数和调用次数分布，且不重试，
+                用于连接保活等探测请求，避免空闲探测抬高预算、掩盖真实重试率
+
+        Yields:
+            LogicalRequest
+        """
+        existing = self.current(url)
+        if existing is not None:
+            yield existing
+            return
+
+        budget = self.get(url)
+        if count:
+            budget.record_request()
+        request = LogicalRequest(budget, counted=count)
+        token = _current.set(request)
+        try:
+            yield request
+        finally:
+            _current.reset(token)
+            if count:
+                budget.record_attempts(request.attempts)
+
+    def snapshot(self) -> dict:
+        """返回 {主机: 统计}"""
+        with self._lock:
+            budgets = list(self._budgets.values())
+        return {b.name: b.snapshot() for b in budgets}
+
+    def log_stats(self):
+        """输出重试预算统计，出现拒绝时以 WARNING 级别输出"""
+        for host, s in self.snapshot().items():
+            level = logging.WARNING if s["denied"] else logging.INFO
+            logger.log(
+                level,
+                f"重试预算 {host}: 请求={s['requests']}, 重试={s['retries']}, 拒绝={s['denied']}, "
+                f"剩余令牌={s['tokens']}, 调用次数分布={s['attempts']}"
+            )
+
+
+# 全局单例
+retry_budgets = RetryBudgets()
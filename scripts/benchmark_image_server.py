@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+图片服务器负载基准测试
+
+在同一组图片上比较旧实现（单线程 HTTPServer + SimpleHTTPRequestHandler）与
+当前 image_server 的吞吐与延迟；--slow-clients 模拟慢速下载大图的客户端，
+观察其对其他请求的阻塞。两个服务器都在独立子进程中运行
+
+用法:
+    python scripts/benchmark_image_server.py [--requests 2000] [--concurrency 32] [--slow-clients 2]
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import aiohttp
+
+ROOT = Path(__file__).resolve().parent.parent
+
+LEGACY_SERVER = """
+import sys
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+
+class Handler(SimpleHTTPRequestHandler):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, directory=sys.argv[1], **kwargs)
+
+    def log_message(self, *args):
+        pass
+
+HTTPServer(("127.0.0.1", int(sys.argv[2])), Handler).serve_forever()
+"""
+
+CURRENT_SERVER = """
+import logging, sys
+sys.path.insert(0, sys.argv[3])
+from aiohttp import web
+from image_server import ImageServer
+
+logging.disable(logging.INFO)
+web.run_app(ImageServer(sys.argv[1]).make_app(), host="127.0.0.1", port=int(sys.argv[2]), print=None)
+"""
+
+# 文件名 -> 大小：预览图、常见生成图与大图
+FILES = {"small.png": 64 * 1024, "medium.png": 1024 * 1024, "large.png": 8 * 1024 * 1024}
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _start(code: str, directory: str) -> tuple:
+    port = _free_port()
+    proc = subprocess.Popen([sys.executable, "-c", code, directory, str(port), str(ROOT)])
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return proc, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("服务器启动超时")
+
+
+async def _slow_client(session: aiohttp.ClientSession, url: str, stop: asyncio.Event):
+    """每 50ms 读取 16KB，模拟弱网下载大图"""
+    while not stop.is_set():
+        try:
+            async with session.get(url) as resp:
+                while not stop.is_set() and await resp.content.read(16 * 1024):
+                    await asyncio.sleep(0.05)
+        except aiohttp.ClientError:
+            await asyncio.sleep(0.1)
+
+
+async def _load(base: str, total: int, concurrency: int, slow_clients: int) -> dict:
+    latencies, errors = [], 0
+    names = ["small.png", "small.png", "small.png", "medium.png"]
+    queue = iter(range(total))
+    stop = asyncio.Event()
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=30)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async def worker():
+            nonlocal errors
+            for i in queue:
+                start = time.perf_counter()
+                try:
+                    async with session.get(f"{base}/{names[i % len(names)]}") as resp:
+                        await resp.read()
+                        if resp.status != 200:
+                            errors += 1
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        slow = [asyncio.create_task(_slow_client(session, f"{base}/large.png", stop)) for _ in range(slow_clients)]
+        await asyncio.sleep(0.2 if slow_clients else 0)
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        for task in slow:
+            task.cancel()
+        await asyncio.gather(*slow, return_exceptions=True)
+
+    latencies.sort()
+    return {
+        "rps": total / elapsed,
+        "p50": statistics.median(latencies) * 1000,
+        "p99": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="图片服务器负载基准测试")
+    parser.add_argument("--requests", type=int, default=2000, help="请求总数")
+    parser.add_argument("--concurrency", type=int, default=32, help="并发客户端数")
+    parser.add_argument("--slow-clients", type=int, default=2, help="同时慢速下载大图的客户端数")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, size in FILES.items():
+            Path(directory, name).write_bytes(os.urandom(size))
+
+        print(f"{args.requests} 个请求, 并发 {args.concurrency}, 慢客户端 {args.slow_clients}")
+        print(f"{'实现':<10}{'请求/秒':>10}{'p50(ms)':>10}{'p99(ms)':>10}{'失败':>6}")
+        for label, code in (("旧实现", LEGACY_SERVER), ("当前实现", CURRENT_SERVER)):
+            proc, base = _start(code, directory)
+            try:
+                result = asyncio.run(_load(base, args.requests, args.concurrency, args.slow_clients))
+            finally:
+                proc.terminate()
+                proc.wait()
+            print(f"{label:<10}{result['rps']:>10.0f}{result['p50']:>10.1f}{result['p99']:>10.1f}{result['errors']:>6}")
+
+
+if __name__ == "__main__":
+    main()
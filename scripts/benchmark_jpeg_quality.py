@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+JPEG 质量选择基准测试
+
+在生成的图片集上比较二分搜索（search_quality）与复杂度特征预测（predict_quality）
+的编码次数、耗时和结果大小；--fit 用同一图片集重新拟合 image_compressor.SIZE_MODEL
+
+用法:
+    python scripts/benchmark_jpeg_quality.py [--count 48] [--budgets 200,500] [--fit]
+"""
+import argparse
+import math
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from image_compressor import (  # noqa: E402
+    QUALITY_MAX,
+    QUALITY_MIN,
+    _encode,
+    _quant_scale,
+    complexity_features,
+    predict_quality,
+    search_quality,
+)
+
+SIZES = [(640, 480), (1024, 1024), (1600, 1200), (2048, 1536)]
+
+
+def generate_corpus(count: int, seed: int = 0):
+    """生成复杂度各异的图片：渐变、噪声、模糊噪声、几何图形、细线纹理及其组合"""
+    rng = np.random.default_rng(seed)
+    images = []
+    for i in range(count):
+        width, height = SIZES[i % len(SIZES)]
+        kind = i % 6
+        yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+        base = np.stack([
+            255 * xx / width,
+            255 * yy / height,
+            np.full_like(xx, rng.uniform(0, 255)),
+        ], axis=-1)
+
+        if kind == 0:  # 平滑渐变
+            pixels = base
+        elif kind == 1:  # 渐变 + 噪声
+            pixels = base + rng.normal(0, rng.uniform(5, 60), base.shape)
+        elif kind == 2:  # 模糊噪声（类似照片纹理）
+            noise = Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+            pixels = np.asarray(noise.filter(ImageFilter.GaussianBlur(rng.uniform(0.5, 4))), dtype=np.float32)
+        else:
+            pixels = base
+        img = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+        if kind in (3, 5):  # 几何图形（类似插画/截图）
+            draw = ImageDraw.Draw(img)
+            for _ in range(int(rng.integers(10, 200))):
+                x0, y0 = rng.integers(0, width), rng.integers(0, height)
+                x1, y1 = x0 + rng.integers(5, width // 3), y0 + rng.integers(5, height // 3)
+                color = tuple(int(c) for c in rng.integers(0, 256, 3))
+                (draw.rectangle if rng.random() < 0.5 else draw.ellipse)([x0, y0, x1, y1], fill=color)
+        if kind in (4, 5):  # 细线纹理（类似文字/线稿）
+            draw = ImageDraw.Draw(img)
+            for _ in range(int(rng.integers(200, 3000))):
+                x0, y0 = rng.integers(0, width), rng.integers(0, height)
+                x1, y1 = x0 + rng.integers(-40, 40), y0 + rng.integers(-40, 40)
+                draw.line([x0, y0, x1, y1], fill=tuple(int(c) for c in rng.integers(0, 256, 3)), width=1)
+        images.append(img)
+    return images
+
+
+def fit(images):
+    """最小二乘拟合 log(bpp) = w0 + w1*log(梯度能量) + w2*熵 + w3*log(量化缩放系数)"""
+    rows, targets = [], []
+    for img in images:
+        gradient, entropy = complexity_features(img)
+        pixels = img.size[0] * img.size[1]
+        for quality in range(QUALITY_MIN, QUALITY_MAX + 1, 5):
+            size = len(_encode(img, quality))
+            rows.append([1.0, math.log(gradient + 1e-3), entropy, math.log(_quant_scale(quality))])
+            targets.append(math.log(size * 8 / pixels))
+    coef, *_ = np.linalg.lstsq(np.array(rows), np.array(targets), rcond=None)
+    residual = np.array(rows) @ coef - np.array(targets)
+    print(f"SIZE_MODEL = ({', '.join(f'{c:.4f}' for c in coef)})")
+    print(f"体积预测误差: 中位数 {np.median(np.abs(residual)) * 100:.1f}%, "
+          f"P90 {np.percentile(np.abs(residual), 90) * 100:.1f}% (对数误差)")
+
+
+def benchmark(images, budgets_kb):
+    """比较两种方法的编码次数、耗时与结果大小"""
+    for budget_kb in budgets_kb:
+        budget = budget_kb * 1024
+        stats = {"search": [0, 0.0, 0, 0], "predict": [0, 0.0, 0, 0]}  # 编码次数, 耗时, 结果字节, 超预算次数
+        for img in images:
+            for name, method in (("search", search_quality), ("predict", predict_quality)):
+                start = time.perf_counter()
+                data, encodes = method(img, budget)
+                elapsed = time.perf_counter() - start
+                s = stats[name]
+                s[0] += encodes
+                s[1] += elapsed
+                if data is None:
+                    s[3] += 1
+                else:
+                    s[2] += len(data)
+
+        n = len(images)
+        print(f"\n预算 {budget_kb}KB, 图片 {n} 张")
+        print(f"{'方法':<10}{'平均编码次数':>12}{'平均耗时(ms)':>14}{'平均大小(KB)':>14}{'未命中':>8}")
+        for name, (encodes, elapsed, total, misses) in stats.items():
+            hits = max(1, n - misses)
+            print(f"{name:<10}{encodes / n:>12.2f}{elapsed / n * 1000:>14.1f}{total / hits / 1024:>14.1f}{misses:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=48, help="生成图片数量")
+    parser.add_argument("--budgets", default="200,500", help="大小上限(KB)，逗号分隔")
+    parser.add_argument("--fit", action="store_true", help="重新拟合体积模型系数")
+    args = parser.parse_args()
+
+    images = generate_corpus(args.count)
+    if args.fit:
+        fit(images)
+    benchmark(images, [int(b) for b in args.budgets.split(",")])
+
+
+if __name__ == "__main__":
+    main()
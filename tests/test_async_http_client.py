@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""测试异步 HTTP 客户端：错误状态码、按状态码重试、限流重试与协程消息投递"""
+import asyncio
+import io
+import json
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import requests
+from PIL import Image
+
+import bot
+import dingtalk_sender as sender_module
+from async_http_client import AsyncResponse, async_http_client
+from bot import MyCallbackHandler
+from delivery_router import DeliveryTarget
+from dingtalk_sender import dingtalk_sender
+from image_cache import ImageCache
+
+HITS = {}
+BODIES = {}
+
+
+def _png() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8), "red").save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+PNG = _png()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def _reply(self, status, body=b""):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        HITS[self.path] = HITS.get(self.path, 0) + 1
+        if self.path == "/flaky" and HITS[self.path] == 1:
+            self._reply(503)
+        elif self.path == "/img.png":
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(PNG)))
+            self.send_header("Content-Type", "image/png")
+            self.end_headers()
+            self.wfile.write(PNG)
+        else:
+            self._reply(200, b'{"ok": true}')
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        HITS[self.path] = HITS.get(self.path, 0) + 1
+        BODIES[self.path] = (dict(self.headers), json.loads(body) if body.startswith(b"{") else body)
+        if self.path == "/bad-request":
+            self._reply(400, b'{"errcode": 400, "errmsg": "invalid"}')
+        elif self.path == "/files":
+            host = self.headers["Host"]
+            self._reply(200, json.dumps({"downloadUrl": f"http://{host}/img.png"}).encode())
+        elif self.path == "/throttled" and HITS[self.path] == 1:
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        else:
+            self._reply(200, json.dumps({"errcode": 0, "errmsg": "ok"}).encode())
+
+    def log_message(self, *args):
+        pass
+
+
+def _run(scenario):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    HITS.clear()
+    BODIES.clear()
+
+    async def main():
+        try:
+            await scenario(f"http://127.0.0.1:{server.server_address[1]}")
+        finally:
+            await async_http_client.close()
+
+    try:
+        asyncio.run(main())
+    finally:
+        server.shutdown()
+
+
+def test_raise_for_status_is_formattable():
+    """4xx/5xx 抛出 requests.HTTPError，可直接格式化进日志"""
+    response = AsyncResponse(400, {}, b"invalid", "http://example.com/hook")
+    try:
+        response.raise_for_status()
+        assert False, "应当抛出异常"
+    except requests.HTTPError as e:
+        assert "400 Client Error" in str(e) and e.response is response
+    AsyncResponse(200, {}, b"", "http://example.com/hook").raise_for_status()
+    print("✅ 错误状态码异常")
+
+
+def test_retries_idempotent_requests():
+    """GET 遇到 503 按重试策略重试后成功"""
+    async def scenario(base):
+        response = await async_http_client.get(f"{base}/flaky", timeout=10)
+        assert response.status_code == 200 and response.json() == {"ok": True}
+        assert HITS["/flaky"] == 2
+
+    _run(scenario)
+    print("✅ 按状态码重试")
+
+
+def test_webhook_reply_async_handles_http_errors():
+    """协程 webhook 回复：HTTP 4xx 记录日志并返回 None，成功时返回响应 JSON"""
+    async def scenario(base):
+        handler = MyCallbackHandler()
+        payload = {"msgtype": "text", "text": {"content": "hi"}}
+        assert await handler._send_webhook_message_async(f"{base}/bad-request", payload, "文本消息") is None
+        assert HITS["/bad-request"] == 1  # POST 不按状态码重试
+        result = await handler._send_webhook_message_async(f"{base}/hook", payload, "文本消息")
+        assert result == {"errcode": 0, "errmsg": "ok"}
+
+    _run(scenario)
+    print("✅ 协程 webhook 回复")
+
+
+def test_webhook_reply_async_retries_throttled():
+    """被限流(429)时按 Retry-After 退避后重试"""
+    async def scenario(base):
+        handler = MyCallbackHandler()
+        result = await handler._send_webhook_message_async(f"{base}/throttled", {"msgtype": "text"}, "文本消息")
+        assert result == {"errcode": 0, "errmsg": "ok"} and HITS["/throttled"] == 2
+
+    _run(scenario)
+    print("✅ 协程限流重试")
+
+
+def _openapi(base):
+    """把 OpenAPI 发送接口指向本地服务器，token 固定"""
+    return [
+        mock.patch.object(sender_module, "BATCH_SEND_URL", f"{base}/batch"),
+        mock.patch.object(sender_module, "GROUP_SEND_URL", f"{base}/group"),
+        mock.patch.object(dingtalk_sender, "_outbound", None),
+        mock.patch.object(dingtalk_sender._token_manager, "get_async", mock.AsyncMock(return_value="tok")),
+    ]
+
+
+def test_deliver_async_routes_by_webhook_expiry():
+    """webhook 有效时走协程 webhook，过期后经异步客户端调用 OpenAPI（群聊/单聊接口）"""
+    async def scenario(base):
+        handler = MyCallbackHandler()
+        payload = {"msgtype": "text", "text": {"content": "hi"}}
+        live = DeliveryTarget("cid", "uid", webhook_url=f"{base}/hook", webhook_expires_at=time.time() + 3600)
+        expired = DeliveryTarget("cid", "uid", webhook_url=f"{base}/hook", webhook_expires_at=time.time() - 1)
+        expired_group = DeliveryTarget("gid", "uid", conversation_type="2", webhook_url=f"{base}/hook",
+                                       webhook_expires_at=time.time() - 1)
+        patches = _openapi(base)
+        for patch in patches:
+            patch.start()
+        try:
+            with mock.patch("asyncio.BaseEventLoop.run_in_executor", side_effect=AssertionError("不应占用线程池")):
+                assert await handler._deliver_async(live, payload, "文本消息") == {"errcode": 0, "errmsg": "ok"}
+                assert await handler._deliver_async(expired, payload, "文本消息") is True
+                assert await handler._deliver_async(expired_group, payload, "文本消息") is True
+        finally:
+            for patch in reversed(patches):
+                patch.stop()
+        assert HITS == {"/hook": 1, "/batch": 1, "/group": 1}
+        headers, body = BODIES["/batch"]
+        assert headers["x-acs-dingtalk-access-token"] == "tok" and body["userIds"] == ["uid"]
+        assert json.loads(body["msgParam"]) == {"content": "hi"}
+        assert BODIES["/group"][1]["openConversationId"] == "gid"
+
+    _run(scenario)
+    print("✅ 协程投递路由")
+
+
+def test_download_image_async():
+    """协程下载：由 downloadCode 换取下载链接后流式下载，按内容哈希登记到图片缓存"""
+    async def scenario(base):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = ImageCache(directory=tmp)
+            handler = MyCallbackHandler()
+            with mock.patch.object(bot, "MESSAGE_FILE_DOWNLOAD_URL", f"{base}/files"), \
+                    mock.patch.object(bot, "IMAGE_DIR", tmp), mock.patch.object(bot, "image_cache", cache), \
+                    mock.patch.object(dingtalk_sender._token_manager, "get_async",
+                                      mock.AsyncMock(return_value="tok")):
+                paths = await handler._download_images_async(["code-a", "code-a"])
+                assert len(paths) == 2 and paths[0] == paths[1]
+                assert open(paths[0], "rb").read() == PNG
+                # 同一 downloadCode 再次下载直接命中缓存
+                assert await handler._download_image_async("code-a") == paths[0]
+            assert BODIES["/files"][1] == {"robotCode": bot.DINGTALK_CLIENT_ID, "downloadCode": "code-a"}
+            assert HITS["/files"] == HITS["/img.png"] <= 2
+
+    _run(scenario)
+    print("✅ 协程图片下载")
+
+
+if __name__ == "__main__":
+    test_raise_for_status_is_formattable()
+    test_retries_idempotent_requests()
+    test_webhook_reply_async_handles_http_errors()
+    test_webhook_reply_async_retries_throttled()
+    test_deliver_async_routes_by_webhook_expiry()
+    test_download_image_async()
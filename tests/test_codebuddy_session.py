@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""测试 CodeBuddy 按钉钉会话隔离的后端会话：sessionId / resume、状态不一致时的回退与淘汰"""
+import threading
+from unittest import mock
+
+import requests
+
+import codebuddy_client as module
+from codebuddy_client import CodebuddyClient
+
+
+def _response(status=200, body=b'{"content": "ok"}'):
+    response = requests.Response()
+    response.status_code = status
+    response._content = body
+    response.url = "http://codebuddy.test/chat"
+    return response
+
+
+def _client(*responses, max_sessions=10):
+    """返回 (客户端, 记录请求载荷的列表)；responses 依次作为每次请求的结果（异常则抛出）"""
+    client = CodebuddyClient()
+    client.max_sessions = max_sessions
+    payloads = []
+    queue = list(responses)
+
+    def post(url, headers=None, json=None, timeout=None):
+        payloads.append(dict(json))
+        result = queue.pop(0) if queue else _response()
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    patches = [
+        mock.patch.object(module.http_client.codebuddy_session, "post", side_effect=post),
+        mock.patch.object(module, "CODEBUDDY_CONTINUE", True),
+        mock.patch.object(module, "CODEBUDDY_SESSION_SCOPE", "conversation"),
+        mock.patch("time.sleep"),
+    ]
+    return client, payloads, patches
+
+
+def _run(client, patches, *calls):
+    for patch in patches:
+        patch.start()
+    try:
+        return [client.chat(text, conversation_id=cid, retry_count=1) for text, cid in calls]
+    finally:
+        for patch in reversed(patches):
+            patch.stop()
+
+
+def test_sessions_scoped_per_conversation():
+    """每个钉钉会话独立：首轮 sessionId 创建，之后 resume 同一会话"""
+    client, payloads, patches = _client()
+    assert _run(client, patches, ("a1", "conv-a"), ("b1", "conv-b"), ("a2", "conv-a")) == ["ok"] * 3
+    a_id = payloads[0]["sessionId"]
+    assert "resume" not in payloads[0] and "continue" not in payloads[0]
+    assert payloads[1]["sessionId"] != a_id
+    assert payloads[2]["resume"] == a_id and "sessionId" not in payloads[2]
+    print("✅ 会话隔离与 resume")
+
+
+def test_timeout_after_send_resumes_on_retry():
+    """首轮读超时（后端可能已创建会话）后重试改用 resume"""
+    client, payloads, patches = _client(requests.exceptions.ReadTimeout("slow"))
+    assert _run(client, patches, ("hi", "conv")) == ["ok"]
+    assert "sessionId" in payloads[0] and payloads[1]["resume"] == payloads[0]["sessionId"]
+    print("✅ 超时后改用 resume")
+
+
+def test_session_state_mismatch_falls_back():
+    """resume 不存在的会话或重复创建会话返回 4xx 时切换方式重试一次"""
+    client, payloads, patches = _client(_response(409, b'{"error": "session exists"}'))
+    assert _run(client, patches, ("hi", "conv")) == ["ok"]
+    assert "sessionId" in payloads[0] and payloads[1]["resume"] == payloads[0]["sessionId"]
+
+    client, payloads, patches = _client(_response(), _response(404, b'{"error": "no session"}'))
+    assert _run(client, patches, ("one", "conv"), ("two", "conv")) == ["ok", "ok"]
+    assert "resume" in payloads[1] and payloads[2]["sessionId"] == payloads[0]["sessionId"]
+
+    client, payloads, patches = _client(_response(400), _response(400))
+    result = _run(client, patches, ("bad", "conv"))[0]
+    assert "HTTP 400" in result and len(payloads) == 2  # 只回退一次
+    print("✅ 会话状态不一致时回退")
+
+
+def test_eviction_skips_sessions_in_use():
+    """超过上限时淘汰最久未使用的空闲会话，正在处理请求的会话保留"""
+    client, payloads, patches = _client(max_sessions=2)
+    for patch in patches:
+        patch.start()
+    try:
+        busy = client._get_session("busy")  # 模拟正在处理的请求
+        client.chat("x", conversation_id="idle")
+        client.chat("y", conversation_id="new")
+        assert list(client._sessions) == ["busy", "new"]
+
+        client.chat("z", conversation_id="newer")
+        assert list(client._sessions) == ["busy", "newer"]
+        client._release_session(busy)
+        client.chat("w", conversation_id="newest")
+        assert list(client._sessions) == ["newer", "newest"]
+    finally:
+        for patch in reversed(patches):
+            patch.stop()
+    print("✅ 淘汰跳过使用中的会话")
+
+
+def test_same_conversation_serialized():
+    """同一会话的并发请求串行执行"""
+    client, payloads, patches = _client()
+    active, peak = 0, 0
+    lock = threading.Lock()
+    original = client._chat_with_retry
+
+    def tracked(*args, **kwargs):
+        nonlocal active, peak
+        with lock:
+            active += 1
+            peak = max(peak, active)
+        try:
+            return original(*args, **kwargs)
+        finally:
+            with lock:
+                active -= 1
+
+    for patch in patches:
+        patch.start()
+    try:
+        with mock.patch.object(client, "_chat_with_retry", side_effect=tracked):
+            threads = [threading.Thread(target=client.chat, args=(f"m{i}",), kwargs={"conversation_id": "c"})
+                       for i in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+    finally:
+        for patch in reversed(patches):
+            patch.stop()
+    assert peak == 1 and client._sessions["c"].active == 0
+    print("✅ 同一会话串行")
+
+
+if __name__ == "__main__":
+    test_sessions_scoped_per_conversation()
+    test_timeout_after_send_resumes_on_retry()
+    test_session_state_mismatch_falls_back()
+    test_eviction_skips_sessions_in_use()
+    test_same_conversation_serialized()
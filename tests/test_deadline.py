@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""测试消息处理截止时间"""
+import time
+
+from deadline import Deadline, DeadlineExceeded, timeout_for
+
+
+def test_timeout_capped_by_remaining_budget():
+    """阶段超时取 min(阶段上限, 剩余预算)"""
+    deadline = Deadline(5)
+    assert deadline.timeout(120) <= 5
+    assert deadline.timeout(1) == 1
+    assert 0 < deadline.remaining() <= 5
+    print("✅ 阶段超时受剩余预算限制")
+
+
+def test_expired_deadline_raises():
+    """预算耗尽后不再发起新的阶段"""
+    deadline = Deadline(0.01)
+    time.sleep(0.02)
+    assert deadline.expired()
+    assert deadline.remaining() == 0
+    try:
+        deadline.timeout(30, "下载图片")
+    except DeadlineExceeded as e:
+        assert "下载图片" in str(e)
+    else:
+        raise AssertionError("预算耗尽后应抛出 DeadlineExceeded")
+    print("✅ 预算耗尽后抛出 DeadlineExceeded")
+
+
+def test_timeout_for_without_deadline():
+    """未传入截止时间时沿用默认超时"""
+    assert timeout_for(None, 30) == 30
+    assert timeout_for(Deadline(10), 30) <= 10
+    print("✅ 未传入截止时间时使用默认值")
+
+
+if __name__ == "__main__":
+    test_timeout_capped_by_remaining_budget()
+    test_expired_deadline_raises()
+    test_timeout_for_without_deadline()
+    print("✅ 所有测试通过")
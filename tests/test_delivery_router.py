@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""测试按 webhook 有效期选择投递方式"""
+from unittest import mock
+
+from delivery_router import (
+    DeliveryRouter,
+    DeliveryTarget,
+    ROUTE_GROUP,
+    ROUTE_OTO,
+    ROUTE_WEBHOOK,
+    to_openapi_message,
+)
+
+
+def _target(conversation_type='1', expires_at=1000.0):
+    return DeliveryTarget(
+        conversation_id="cid", user_id="uid", conversation_type=conversation_type,
+        webhook_url="https://oapi.dingtalk.com/robot/sendBySession?session=x", webhook_expires_at=expires_at,
+    )
+
+
+def test_route_by_expiry():
+    """有效期内走 webhook，进入提前量后群聊走群消息接口、单聊走单聊接口"""
+    router = DeliveryRouter(expiry_margin=60)
+    assert router.route(_target(), now=900) == ROUTE_WEBHOOK
+    assert router.route(_target(), now=950) == ROUTE_OTO
+    assert router.route(_target('2'), now=950) == ROUTE_GROUP
+    # 未知过期时间时保持原有行为，没有 webhook 时只能走 OpenAPI
+    assert router.route(_target(expires_at=None), now=10 ** 10) == ROUTE_WEBHOOK
+    no_webhook = DeliveryTarget(conversation_id="cid", user_id="uid")
+    assert router.route(no_webhook) == ROUTE_OTO
+    assert router.stats() == {ROUTE_WEBHOOK: 2, ROUTE_GROUP: 1, ROUTE_OTO: 2}
+    print("✅ 按 webhook 有效期选择投递方式")
+
+
+def test_to_openapi_message():
+    """webhook payload 转换为 OpenAPI 消息模板"""
+    assert to_openapi_message({'msgtype': 'text', 'text': {'content': 'hi'}}) == ('text', {"content": "hi"})
+    feed = {'msgtype': 'feedCard', 'feedCard': {'links': [
+        {'title': 'T', 'messageURL': 'http://x/a.jpg', 'picURL': 'http://x/a.jpg'}
+    ]}}
+    assert to_openapi_message(feed) == ('link', {
+        "title": "T", "text": "T", "picUrl": "http://x/a.jpg", "messageUrl": "http://x/a.jpg"
+    })
+    print("✅ webhook payload 转换为 OpenAPI 模板")
+
+
+def test_send_openapi_uses_group_api_for_group_chat():
+    """群聊过期后发到群，而不是发给单个用户"""
+    router = DeliveryRouter()
+    payload = {'msgtype': 'markdown', 'markdown': {'title': 'T', 'text': 'body'}}
+    with mock.patch("delivery_router.dingtalk_sender") as sender:
+        sender.send_group_message.return_value = True
+        assert router.send_openapi(_target('2'), payload)
+        sender.send_group_message.assert_called_once_with(
+            "cid", 'markdown', {"title": "T", "text": "body"}, deadline=None
+        )
+        sender.send_message.assert_not_called()
+
+        router.send_openapi(_target('1'), payload)
+        sender.send_message.assert_called_once_with(
+            "cid", "uid", 'markdown', {"title": "T", "text": "body"}, deadline=None
+        )
+    print("✅ 群聊走群消息接口，单聊走单聊接口")
+
+
+if __name__ == "__main__":
+    test_route_by_expiry()
+    test_to_openapi_message()
+    test_send_openapi_uses_group_api_for_group_chat()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""测试磁盘清理：配额、保留时间、pin 与淘汰回调"""
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from disk_janitor import DirectoryPolicy, DiskJanitor
+
+
+def _write(directory, name, size, age):
+    """写入文件并把最近使用时间设为 age 秒前"""
+    path = Path(directory) / name
+    path.write_bytes(b'0' * size)
+    used_at = time.time() - age
+    os.utime(path, (used_at, used_at))
+    return str(path)
+
+
+def test_quota_evicts_least_recently_used():
+    """超出配额时按最久未使用淘汰，并报告回收字节数"""
+    with tempfile.TemporaryDirectory() as directory:
+        old = _write(directory, "old.jpg", 100, 3000)
+        middle = _write(directory, "middle.jpg", 100, 2000)
+        new = _write(directory, "new.jpg", 100, 1000)
+        janitor = DiskJanitor([DirectoryPolicy(Path(directory), max_bytes=250)], grace_seconds=60)
+        evicted = []
+        janitor.add_listener(evicted.append)
+
+        assert janitor.run_once() == 100
+        assert evicted == [old]
+        assert os.path.exists(middle) and os.path.exists(new)
+        assert janitor.stats()["reclaimed_bytes"] == 100
+    print("✅ 超出配额时淘汰最久未使用的文件")
+
+
+def test_age_limit_pins_and_grace():
+    """过期文件被删除；pin 住的文件与刚写入的文件保留；下载中的临时文件不受影响"""
+    with tempfile.TemporaryDirectory() as directory:
+        expired = _write(directory, "expired.jpg", 10, 7200)
+        in_use = _write(directory, "in_use.jpg", 10, 7200)
+        fresh = _write(directory, "fresh.jpg", 10, 1)
+        partial = _write(directory, ".abc.part", 10, 600)
+        stale = _write(directory, ".def.part", 10, 7200)
+        janitor = DiskJanitor([DirectoryPolicy(Path(directory), max_bytes=1, max_age=3600)], grace_seconds=60)
+
+        with janitor.pinned(in_use):
+            janitor.run_once()
+        assert not os.path.exists(expired) and not os.path.exists(stale)
+        assert os.path.exists(in_use) and os.path.exists(fresh) and os.path.exists(partial)
+        assert janitor.stats()["pinned"] == 0
+
+        janitor.run_once()
+        assert not os.path.exists(in_use)
+    print("✅ 保留时间、pin 与写入保护")
+
+
+def test_image_cache_discard():
+    """清理删除的缓存图片从缓存索引中移除"""
+    import hashlib
+    from image_cache import ImageCache
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ImageCache(directory, ttl_seconds=3600, max_bytes=1 << 20)
+        tmp = _write(directory, "download.part", 100, 0)
+        path = cache.put("code", tmp, hashlib.sha256(b'0' * 100).hexdigest())
+        os.utime(path, (time.time() - 7200,) * 2)
+
+        janitor = DiskJanitor([DirectoryPolicy(Path(directory), max_age=3600)], grace_seconds=60)
+        janitor.add_listener(cache.discard)
+        janitor.run_once()
+        assert cache.stats()["bytes"] == 0 and cache.stats()["files"] == 0
+        assert cache.get("code") is None
+    print("✅ 淘汰回调同步缓存索引")
+
+
+def test_pin_protects_files_from_image_cache():
+    """disk_janitor.pinned() 保护的文件在图片缓存按大小淘汰时也保留"""
+    import hashlib
+    from disk_janitor import disk_janitor
+    from image_cache import ImageCache
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ImageCache(directory, ttl_seconds=3600, max_bytes=100)
+        tmp = _write(directory, "a.part", 100, 0)
+        in_use = cache.put("a", tmp, hashlib.sha256(b'0' * 100).hexdigest())
+        with disk_janitor.pinned(in_use):
+            for i in range(3):
+                data = bytes([i + 1]) * 100
+                tmp = Path(directory) / f"{i}.part"
+                tmp.write_bytes(data)
+                cache.put(f"code-{i}", str(tmp), hashlib.sha256(data).hexdigest())
+            assert os.path.exists(in_use) and cache.get("a") == in_use
+        assert disk_janitor.stats()["pinned"] == 0
+    print("✅ pin 同时保护文件不被图片缓存淘汰")
+
+
+def test_singleton_covers_cache_directories():
+    """全局清理覆盖所有会持续增长的图片目录，且每个目录都有配额"""
+    from config import IMAGE_DIR, IMAGEGEN_DIR
+    from disk_janitor import disk_janitor
+    from image_compressor import COMPRESSED_DIR
+    from image_variants import VARIANT_DIR
+
+    paths = {policy.path for policy in disk_janitor.policies}
+    assert {IMAGE_DIR, IMAGEGEN_DIR, VARIANT_DIR, COMPRESSED_DIR} <= paths
+    assert all(policy.max_bytes > 0 for policy in disk_janitor.policies)
+    print("✅ 清理覆盖所有缓存目录")
+
+
+if __name__ == "__main__":
+    test_quota_evicts_least_recently_used()
+    test_age_limit_pins_and_grace()
+    test_image_cache_discard()
+    test_pin_protects_files_from_image_cache()
+    test_singleton_covers_cache_directories()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""测试流式下载原语：大小限制、哈希、格式识别与原子写入"""
+import asyncio
+import hashlib
+import io
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+from async_http_client import async_http_client
+from downloader import DownloadError, download_file, download_file_async, sniff_image_format
+
+
+def _png_bytes():
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), (200, 10, 10)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+PNG = _png_bytes()
+BODIES = {"/image": PNG, "/big": b'\xff\xd8\xff' + b'0' * 300000, "/text": b"<html>not an image</html>"}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = BODIES[self.path]
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _serve():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def test_sniff_image_format():
+    """按文件头识别真实格式"""
+    assert sniff_image_format(PNG[:32]) == "png"
+    assert sniff_image_format(b'\xff\xd8\xff\xe0') == "jpeg"
+    assert sniff_image_format(b'RIFF\x00\x00\x00\x00WEBPVP8 ') == "webp"
+    assert sniff_image_format(b'\x00\x00\x00\x1cftypavif') == "avif"
+    assert sniff_image_format(b'<html>') is None
+    print("✅ 文件头格式识别")
+
+
+def test_download_file_sync():
+    """同步下载：扩展名按真实格式、哈希正确；超限或非图片时不留下任何文件"""
+    server, base = _serve()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            result = download_file(f"{base}/image", directory, "generated")
+            assert result.path == os.path.join(directory, "generated.png")
+            assert result.sha256 == hashlib.sha256(PNG).hexdigest() and result.size == len(PNG)
+
+            for path, max_bytes in (("/big", 100000), ("/text", 100000)):
+                try:
+                    download_file(f"{base}{path}", directory, max_bytes=max_bytes)
+                    assert False, "应当失败"
+                except DownloadError:
+                    pass
+            assert os.listdir(directory) == ["generated.png"]
+    finally:
+        server.shutdown()
+    print("✅ 同步流式下载")
+
+
+def test_download_file_async():
+    """协程下载与同步版本行为一致，finalize 可接管最终文件"""
+    server, base = _serve()
+
+    async def run(directory):
+        try:
+            stored = []
+
+            def finalize(tmp_path, result):
+                path = os.path.join(directory, f"{result.sha256}{result.ext}")
+                os.replace(tmp_path, path)
+                stored.append(path)
+                return path
+
+            result = await download_file_async(f"{base}/image", directory, finalize=finalize)
+            assert stored == [result.path] and result.path.endswith(".png")
+            try:
+                await download_file_async(f"{base}/big", directory, max_bytes=100000)
+                assert False, "应当失败"
+            except DownloadError:
+                pass
+            assert os.listdir(directory) == [os.path.basename(result.path)]
+        finally:
+            await async_http_client.close()
+
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            asyncio.run(run(directory))
+    finally:
+        server.shutdown()
+    print("✅ 协程流式下载")
+
+
+if __name__ == "__main__":
+    test_sniff_image_format()
+    test_download_file_sync()
+    test_download_file_async()
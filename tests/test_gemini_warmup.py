@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""测试 VOD 连接预热：使用 SDK 内部 Session，取不到时跳过"""
+from types import SimpleNamespace
+from unittest import mock
+
+from gemini_image_generator import GeminiImageGenerator
+
+
+def _generator(client):
+    generator = GeminiImageGenerator()
+    generator.enabled = True
+    generator.api_endpoint = "vod.tencentcloudapi.com"
+    return generator, mock.patch.object(generator, "_create_vod_client", return_value=client)
+
+
+def test_warm_up_uses_sdk_session():
+    """SDK 暴露内部 Session 时用它发起 HEAD"""
+    session = mock.Mock()
+    generator, patch = _generator(SimpleNamespace(request=SimpleNamespace(conn=SimpleNamespace(_session=session))))
+    with patch:
+        generator.warm_up(timeout=3)
+    session.head.assert_called_once_with("https://vod.tencentcloudapi.com/", timeout=3)
+    print("✅ 使用 SDK 内部 Session 预热")
+
+
+def test_warm_up_skips_when_sdk_internals_change():
+    """SDK 内部结构变化时跳过预热而不抛异常"""
+    for client in (SimpleNamespace(), SimpleNamespace(request=SimpleNamespace(conn=SimpleNamespace()))):
+        generator, patch = _generator(client)
+        with patch:
+            generator.warm_up(timeout=3)
+    print("✅ SDK 内部结构变化时跳过预热")
+
+
+if __name__ == "__main__":
+    test_warm_up_uses_sdk_session()
+    test_warm_up_skips_when_sdk_internals_change()
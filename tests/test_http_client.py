@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""测试连接池统计（取用/等待/新建/丢弃计数）、按配置的连接池大小与重试预算"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import requests
+
+import http_client as module
+from http_client import BudgetedRetry, InstrumentedHTTPAdapter, PoolStats, http_client, pool_timeout_for
+from retry_budget import RetryBudget, RetryBudgets
+
+HITS = {}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 保持长连接，连接可被连接池复用
+
+    def do_GET(self):
+        HITS[self.path] = HITS.get(self.path, 0) + 1
+        if self.path == "/slow":
+            time.sleep(0.2)
+        elif self.path == "/hang":
+            time.sleep(1.0)
+        status = 503 if self.path == "/down" else 200
+        self.send_response(status)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+def _serve():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    HITS.clear()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def _session(stats, **kwargs):
+    session = requests.Session()
+    adapter = InstrumentedHTTPAdapter(stats=stats, **kwargs)
+    session.mount("http://", adapter)
+    return session, adapter
+
+
+def _concurrent_get(session, url, count):
+    errors = []
+
+    def get():
+        try:
+            assert session.get(url, timeout=10).status_code == 200
+        except Exception as e:  # 在主线程中断言
+            errors.append(e)
+
+    threads = [threading.Thread(target=get) for _ in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors, errors
+
+
+def test_blocking_pool_counts_waits():
+    """block 模式下并发超过连接池大小时排队等待，连接只新建 maxsize 个"""
+    server, base = _serve()
+    try:
+        stats = PoolStats("test")
+        session, _ = _session(stats, pool_connections=1, pool_maxsize=2, pool_block=True,
+                              max_retries=BudgetedRetry(total=0))
+        _concurrent_get(session, f"{base}/slow", 6)
+        s = stats.snapshot()["127.0.0.1"]
+        assert s["checkouts"] == 6 and HITS["/slow"] == 6
+        assert s["created"] == 2 and s["discarded"] == 0
+        assert s["waits"] >= 1 and s["wait_seconds"] > 0
+    finally:
+        server.shutdown()
+    print("✅ block 模式等待计数")
+
+
+def test_non_blocking_pool_counts_discards():
+    """非 block 模式下超出连接池大小的连接照常新建，归还时丢弃"""
+    server, base = _serve()
+    try:
+        stats = PoolStats("test")
+        session, _ = _session(stats, pool_connections=1, pool_maxsize=1, pool_block=False,
+                              max_retries=BudgetedRetry(total=0))
+        _concurrent_get(session, f"{base}/slow", 4)
+        s = stats.snapshot()["127.0.0.1"]
+        assert s["checkouts"] == 4 and s["waits"] == 0
+        assert s["created"] == 4 and s["discarded"] == 3
+    finally:
+        server.shutdown()
+    print("✅ 非 block 模式丢弃计数")
+
+
+def test_host_maxsize_overrides_pool_size():
+    """按主机配置的连接池大小覆盖默认值，其他主机不受影响"""
+    server, base = _serve()
+    try:
+        stats = PoolStats("test")
+        session, adapter = _session(stats, host_maxsize={"127.0.0.1": 1}, pool_connections=2,
+                                    pool_maxsize=4, pool_block=True, max_retries=BudgetedRetry(total=0))
+        assert adapter.poolmanager.connection_from_url(base).pool.maxsize == 1
+        assert adapter.poolmanager.connection_from_url("http://localhost:1").pool.maxsize == 4
+        _concurrent_get(session, f"{base}/slow", 3)
+        s = stats.snapshot()["127.0.0.1"]
+        assert s["checkouts"] == 3 and s["created"] == 1 and s["waits"] >= 1
+    finally:
+        server.shutdown()
+    print("✅ 按主机覆盖连接池大小")
+
+
+def test_blocked_checkout_times_out():
+    """连接池被占满时等待空闲连接不超过请求的连接超时，超时按 ConnectTimeout 抛出"""
+    assert pool_timeout_for((2, 600)) == 2 and pool_timeout_for(0.5) == 0.5
+    assert pool_timeout_for(600) == module.HTTP_POOL_TIMEOUT and pool_timeout_for(None) == module.HTTP_POOL_TIMEOUT
+    server, base = _serve()
+    try:
+        stats = PoolStats("test")
+        session, _ = _session(stats, pool_connections=1, pool_maxsize=1, pool_block=True,
+                              max_retries=BudgetedRetry(total=0))
+        holder = threading.Thread(target=session.get, args=(f"{base}/hang",), kwargs={"timeout": 10})
+        holder.start()
+        while not HITS.get("/hang"):
+            time.sleep(0.01)
+        start = time.monotonic()
+        try:
+            session.get(f"{base}/slow", timeout=(0.2, 10))
+            assert False, "应当抛出异常"
+        except requests.exceptions.ConnectTimeout:
+            pass
+        assert 0.15 < time.monotonic() - start < 0.8
+        assert "/slow" not in HITS  # 请求未发出
+        holder.join()
+        assert session.get(f"{base}/slow", timeout=(0.2, 10)).status_code == 200  # 连接归还后恢复
+        assert stats.snapshot()["127.0.0.1"]["created"] == 1
+    finally:
+        server.shutdown()
+    print("✅ 等待空闲连接超时")
+
+
+def test_sessions_sized_from_config():
+    """全局客户端各 Session 的连接池大小与 block 模式来自配置"""
+    expected = {
+        "dingtalk": (http_client.dingtalk_session, module.HTTP_POOL_MAXSIZE_DINGTALK),
+        "codebuddy": (http_client.codebuddy_session, module.HTTP_POOL_MAXSIZE_CODEBUDDY),
+        "download": (http_client.download_session, module.HTTP_POOL_MAXSIZE_DOWNLOAD),
+    }
+    for name, (session, maxsize) in expected.items():
+        adapter = session.get_adapter("https://example.com")
+        assert isinstance(adapter, InstrumentedHTTPAdapter)
+        assert adapter._pool_maxsize == maxsize and adapter._pool_block == module.HTTP_POOL_BLOCK
+        assert adapter.host_maxsize == module.HTTP_POOL_HOST_MAXSIZE
+        assert adapter.stats is http_client._stats[name]
+    assert set(http_client.pool_stats()) == set(expected)
+    print("✅ 连接池大小来自配置")
+
+
+def test_retry_stops_when_budget_exhausted():
+    """传输层重试从主机预算中扣除，预算耗尽时不再重试"""
+    server, base = _serve()
+    budgets = RetryBudgets()
+    budgets._budgets["127.0.0.1"] = RetryBudget("127.0.0.1", ratio=0, min_per_sec=0, max_tokens=1)
+    try:
+        session, _ = _session(PoolStats("test"), max_retries=BudgetedRetry(
+            total=3, backoff_factor=0, status_forcelist=[503]))
+        with mock.patch.object(module, "retry_budgets", budgets):
+            try:
+                session.get(f"{base}/down", timeout=10)
+                assert False, "应当抛出异常"
+            except requests.exceptions.RetryError:
+                pass
+        assert HITS["/down"] == 2  # 1 次请求 + 预算内的 1 次重试
+        s = budgets.snapshot()["127.0.0.1"]
+        assert s["retries"] == 1 and s["denied"] == 1 and s["attempts"] == {2: 1}
+    finally:
+        server.shutdown()
+    print("✅ 重试受预算限制")
+
+
+if __name__ == "__main__":
+    test_blocking_pool_counts_waits()
+    test_non_blocking_pool_counts_discards()
+    test_host_maxsize_overrides_pool_size()
+    test_blocked_checkout_times_out()
+    test_sessions_sized_from_config()
+    test_retry_stops_when_budget_exhausted()
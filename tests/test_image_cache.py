@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""测试收到图片的内容寻址缓存"""
+import hashlib
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from disk_janitor import disk_janitor
+from image_cache import ImageCache
+
+
+def _write_tmp(directory, data):
+    path = Path(directory) / f"{time.monotonic_ns()}.part"
+    path.write_bytes(data)
+    return str(path), hashlib.sha256(data).hexdigest()
+
+
+def test_code_and_content_dedup():
+    """同一 downloadCode 命中缓存；不同 downloadCode 的相同内容只保存一份"""
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ImageCache(directory, ttl_seconds=3600, max_bytes=1 << 20)
+        assert cache.get("code-a") is None
+
+        tmp, digest = _write_tmp(directory, b"same image")
+        path_a = cache.put("code-a", tmp, digest)
+        assert os.path.basename(path_a) == f"{digest}.jpg"
+        assert cache.get("code-a") == path_a
+
+        tmp, digest = _write_tmp(directory, b"same image")
+        path_b = cache.put("code-b", tmp, digest)
+        assert path_b == path_a
+        assert not os.path.exists(tmp)
+        assert sorted(os.listdir(directory)) == [f"{digest}.jpg"]
+        assert cache.stats()["hits"] == 1 and cache.stats()["files"] == 1
+    print("✅ downloadCode 命中且相同内容只保存一份")
+
+
+def test_size_limit_evicts_least_recently_used():
+    """超出总大小上限时淘汰最久未使用的文件"""
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ImageCache(directory, ttl_seconds=3600, max_bytes=250)
+        paths = []
+        for i in range(3):
+            tmp, digest = _write_tmp(directory, bytes([i]) * 100)
+            paths.append(cache.put(f"code-{i}", tmp, digest))
+            if i == 1:
+                assert cache.get("code-0")  # code-0 最近使用过，code-1 最久未用
+        assert os.path.exists(paths[0]) and os.path.exists(paths[2])
+        assert not os.path.exists(paths[1])
+        assert cache.get("code-1") is None
+        assert cache.stats()["bytes"] == 200
+    print("✅ 超出大小上限时按最久未使用淘汰")
+
+
+def test_ttl_expiry_and_reload():
+    """过期条目不再命中；重启后登记目录中已有的缓存文件"""
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ImageCache(directory, ttl_seconds=0.05, max_bytes=1 << 20)
+        tmp, digest = _write_tmp(directory, b"short lived")
+        path = cache.put("code", tmp, digest)
+        time.sleep(0.1)
+        assert cache.get("code") is None
+        assert not os.path.exists(path)
+
+        tmp, digest = _write_tmp(directory, b"persistent")
+        ImageCache(directory, ttl_seconds=3600, max_bytes=1 << 20).put(None, tmp, digest)
+        assert ImageCache(directory, ttl_seconds=3600, max_bytes=1 << 20).stats()["files"] == 1
+    print("✅ 过期淘汰与重启后登记")
+
+
+def test_pinned_files_are_not_deleted():
+    """正被使用（已 pin）的文件不因大小上限或过期被删除，解除 pin 后再淘汰"""
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ImageCache(directory, ttl_seconds=3600, max_bytes=150)
+        tmp, digest = _write_tmp(directory, b"a" * 100)
+        in_use = cache.put("code-a", tmp, digest)
+        with disk_janitor.pinned(in_use):
+            tmp, digest = _write_tmp(directory, b"b" * 100)
+            newer = cache.put("code-b", tmp, digest)
+            assert os.path.exists(in_use) and cache.get("code-a") == in_use
+        tmp, digest = _write_tmp(directory, b"c" * 100)
+        cache.put("code-c", tmp, digest)
+        assert not os.path.exists(in_use) and not os.path.exists(newer)
+        assert cache.stats()["bytes"] == 100
+
+        cache = ImageCache(directory, ttl_seconds=0.05, max_bytes=1 << 20)
+        tmp, digest = _write_tmp(directory, b"short lived")
+        path = cache.put("code", tmp, digest)
+        time.sleep(0.1)
+        with disk_janitor.pinned(path):
+            assert cache.get("code") is None  # 过期只移除记录
+            assert os.path.exists(path)
+    print("✅ 已 pin 的文件不被删除")
+
+
+if __name__ == "__main__":
+    test_code_and_content_dedup()
+    test_size_limit_evicts_least_recently_used()
+    test_ttl_expiry_and_reload()
+    test_pinned_files_are_not_deleted()
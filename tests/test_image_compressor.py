@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""测试进程池图片压缩与压缩缓存"""
+import os
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+
+from PIL import Image
+
+import dingtalk_sender as sender_module
+import image_compressor
+from deadline import Deadline, DeadlineExceeded
+from image_compressor import ImageCompressor, predict_quality
+
+
+def _noisy_png(path: Path, size=(1600, 1200)):
+    """生成难以压缩的噪声图"""
+    Image.frombytes('RGB', size, os.urandom(size[0] * size[1] * 3)).save(path)
+
+
+def test_compress_within_budget_and_cached():
+    """压缩结果满足大小上限，同一内容再次压缩直接命中缓存"""
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        source = tmp / "noise.png"
+        _noisy_png(source)
+
+        compressor = ImageCompressor(cache_dir=tmp / "compressed", workers=1)
+        try:
+            first = compressor.compress(str(source), max_size_kb=300)
+            assert first != str(source)
+            assert os.path.getsize(first) <= 300 * 1024
+            mtime = os.path.getmtime(first)
+
+            second = compressor.compress(str(source), max_size_kb=300)
+            assert second == first
+            assert os.path.getmtime(second) == mtime
+        finally:
+            compressor.close()
+    print("✅ 压缩满足大小上限并命中缓存")
+
+
+def test_predicted_quality_fits_budget_in_few_encodes():
+    """按复杂度特征预测质量，纯噪声这类极端图片也最多三次编码即满足预算"""
+    size = (800, 600)
+    img = Image.frombytes('RGB', size, os.urandom(size[0] * size[1] * 3))
+    data, encodes = predict_quality(img, 200 * 1024)
+    assert data is not None and len(data) <= 200 * 1024
+    assert 1 <= encodes <= 3
+    print("✅ 预测质量满足预算")
+
+
+def test_prediction_unavailable_without_features():
+    """无法计算特征（如未安装 NumPy）时交由二分搜索处理"""
+    original = image_compressor.complexity_features
+    image_compressor.complexity_features = lambda img: None
+    try:
+        assert predict_quality(Image.new('RGB', (64, 64)), 1024) == (None, 0)
+    finally:
+        image_compressor.complexity_features = original
+    print("✅ 无特征时回退")
+
+
+def test_compress_wait_bounded_by_deadline():
+    """等待压缩不超过消息剩余预算：超时回退原图，预算已耗尽时直接抛出"""
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        source = tmp / "noise.png"
+        _noisy_png(source)
+
+        compressor = ImageCompressor(cache_dir=tmp / "compressed", workers=1)
+        try:
+            start = time.monotonic()
+            result = compressor.compress(str(source), max_size_kb=300, deadline=Deadline(0.2))
+            assert result == str(source)
+            assert time.monotonic() - start < 1.0
+
+            expired = Deadline(0)
+            try:
+                compressor.compress(str(source), max_size_kb=300, deadline=expired)
+                assert False, "应当抛出异常"
+            except DeadlineExceeded:
+                pass
+        finally:
+            compressor.close()
+    print("✅ 压缩等待受截止时间限制")
+
+
+def test_send_image_passes_deadline_to_compressor():
+    """发送图片时上传前的压缩沿用消息的截止时间"""
+    with tempfile.TemporaryDirectory() as tmp:
+        source = Path(tmp) / "big.png"
+        source.write_bytes(b"x" * 600 * 1024)
+        deadline = Deadline(30)
+        sender = sender_module.dingtalk_sender
+        calls = []
+
+        def get_media_id(path, media_type, deadline=None, prepare=None):
+            prepare(path)
+            return "media-id"
+
+        with mock.patch.object(sender._media_cache, "get_media_id", side_effect=get_media_id), \
+                mock.patch.object(sender_module.image_compressor, "compress",
+                                  side_effect=lambda path, **kw: calls.append(kw) or path), \
+                mock.patch.object(sender, "_dispatch", return_value=True):
+            assert sender.send_image_message("cid", "uid", str(source), deadline=deadline)
+        assert calls and calls[0]["deadline"] is deadline
+    print("✅ 发送图片时压缩沿用截止时间")
+
+
+if __name__ == "__main__":
+    test_compress_within_budget_and_cached()
+    test_compress_wait_bounded_by_deadline()
+    test_send_image_passes_deadline_to_compressor()
+    test_predicted_quality_fits_budget_in_few_encodes()
+    test_prediction_unavailable_without_features()
+    print("✅ 所有测试通过")
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""测试富文本消息多图提取与并发下载"""
+import asyncio
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from dingtalk_stream.chatbot import ChatbotMessage
+
+import bot
+from bot import MyCallbackHandler
+
+
+def _rich_text(*items):
+    return ChatbotMessage.from_dict({'msgtype': 'richText', 'content': {'richText': list(items)}})
+
+
+def test_extract_all_image_codes():
+    """提取富文本中的所有图片并去重"""
+    message = _rich_text({'text': '比较这些图'}, {'downloadCode': 'a'}, {'downloadCode': 'b'}, {'downloadCode': 'a'})
+    assert MyCallbackHandler._extract_image_codes(message) == ['a', 'b']
+    print("✅ 提取富文本中的所有图片")
+
+
+def test_download_images_concurrently_in_order():
+    """多张图片并发下载，结果保持原顺序并跳过失败的图片"""
+    handler = MyCallbackHandler()
+    active, peak = 0, 0
+    lock = threading.Lock()
+
+    def fake_download(code, deadline=None):
+        nonlocal active, peak
+        with lock:
+            active += 1
+            peak = max(peak, active)
+        time.sleep(0.2)
+        with lock:
+            active -= 1
+        return None if code == 'bad' else f"/tmp/{code}.jpg"
+
+    codes = ['a', 'b', 'bad', 'c', 'd', 'e']
+    with mock.patch.object(handler, "_download_image", side_effect=fake_download), \
+            mock.patch("bot.IMAGE_DOWNLOAD_CONCURRENCY", 3):
+        start = time.monotonic()
+        paths = handler._download_images(codes)
+        elapsed = time.monotonic() - start
+
+    assert paths == ["/tmp/a.jpg", "/tmp/b.jpg", "/tmp/c.jpg", "/tmp/d.jpg", "/tmp/e.jpg"]
+    assert peak == 3  # 受单条消息并发上限约束
+    assert elapsed < 0.2 * len(codes) / 2
+    print(f"✅ {len(codes)} 张图片并发下载耗时 {elapsed:.2f}s")
+
+
+def test_download_images_async_concurrently_in_order():
+    """协程版本：在事件循环中并发下载，结果保持原顺序，并发数受上限约束"""
+    handler = MyCallbackHandler()
+    active, peak = 0, 0
+
+    async def fake_download(code, deadline=None):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.2)
+        active -= 1
+        return None if code == 'bad' else f"/tmp/{code}.jpg"
+
+    codes = ['a', 'b', 'bad', 'c', 'd', 'e']
+    with mock.patch.object(handler, "_download_image_async", side_effect=fake_download), \
+            mock.patch("bot.IMAGE_DOWNLOAD_CONCURRENCY", 3):
+        paths = asyncio.run(handler._download_images_async(codes))
+
+    assert paths == ["/tmp/a.jpg", "/tmp/b.jpg", "/tmp/c.jpg", "/tmp/d.jpg", "/tmp/e.jpg"]
+    assert peak == 3
+    print("✅ 协程并发下载")
+
+
+def test_image_generation_uses_coroutines():
+    """生图请求：源图片下载、生成与回复都走协程接口"""
+    handler = MyCallbackHandler()
+    message = ChatbotMessage.from_dict({'msgtype': 'text', 'text': {'content': '画一只猫'}})
+    with tempfile.TemporaryDirectory() as tmp:
+        generated = os.path.join(tmp, "gen.png")
+        with open(generated, "wb") as f:
+            f.write(b"png")
+        with mock.patch.object(bot.image_generator, "generate_image_to_image",
+                               side_effect=AssertionError("不应调用同步接口")), \
+                mock.patch.object(bot.image_generator, "generate_image_to_image_async",
+                                  mock.AsyncMock(return_value=(generated, "Gemini"))) as generate, \
+                mock.patch.object(handler, "_download_image_async", mock.AsyncMock(return_value="/tmp/src.png")), \
+                mock.patch.object(handler, "_prepare_generated_image"), \
+                mock.patch.object(handler, "reply_feed_card_async", mock.AsyncMock()) as reply:
+            asyncio.run(handler._process_image_generation_async(message, "把它变成猫", "image-to-image", "code"))
+    assert generate.await_args.args[1] == "/tmp/src.png"
+    assert reply.await_args.kwargs["image_url"].endswith("/gen.png")
+    print("✅ 生图走协程接口")
+
+
+if __name__ == "__main__":
+    test_extract_all_image_codes()
+    test_download_images_concurrently_in_order()
+    test_download_images_async_concurrently_in_order()
+    test_image_generation_uses_coroutines()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""测试图片分析前的预处理：格式识别、分辨率限制与副本缓存"""
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+from PIL import Image
+
+import image_preprocessor as module
+from disk_janitor import disk_janitor
+from image_cache import ImageCache
+from image_preprocessor import ImagePreprocessor
+
+
+def test_large_photo_gets_bounded_analysis_copy():
+    """超出分辨率的图片生成 JPEG 分析副本并复用，原图保持不变"""
+    with tempfile.TemporaryDirectory() as directory:
+        original = Path(directory) / "photo.jpg"
+        Image.new('RGB', (3000, 2000), (10, 120, 200)).save(original, format='JPEG', quality=95)
+        before = original.read_bytes()
+        preprocessor = ImagePreprocessor(directory, max_dimension=800)
+
+        path = preprocessor.prepare(str(original))
+        digest = hashlib.sha256(before).hexdigest()
+        assert path == str(preprocessor.analysis_path(digest))
+        with Image.open(path) as img:
+            assert img.format == 'JPEG' and max(img.size) == 800
+        assert original.read_bytes() == before
+
+        assert preprocessor.prepare(str(original)) == path
+        assert not [name for name in os.listdir(directory) if name.endswith(".part")]
+    print("✅ 大图生成限制分辨率的分析副本")
+
+
+def test_wrong_extension_and_passthrough():
+    """扩展名与内容不符时生成副本；已达标的小图直接使用原图"""
+    with tempfile.TemporaryDirectory() as directory:
+        mislabeled = Path(directory) / "image.jpg"
+        Image.new('RGBA', (100, 100), (255, 0, 0, 128)).save(mislabeled, format='PNG')
+        small = Path(directory) / "small.png"
+        Image.new('RGB', (100, 100)).save(small, format='PNG')
+        preprocessor = ImagePreprocessor(directory, max_dimension=800)
+
+        fixed = preprocessor.prepare(str(mislabeled))
+        assert fixed != str(mislabeled)
+        with Image.open(fixed) as img:
+            assert img.format == 'JPEG' and img.mode == 'RGB'
+        assert preprocessor.prepare(str(small)) == str(small)
+        assert preprocessor.prepare_all([str(small), str(mislabeled)]) == [str(small), fixed]
+    print("✅ 纠正扩展名与小图直通")
+
+
+def test_unreadable_file_falls_back_to_original():
+    """无法识别的文件退回原路径"""
+    with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as f:
+        f.write(b"not an image")
+    try:
+        assert ImagePreprocessor(tempfile.gettempdir()).prepare(f.name) == f.name
+    finally:
+        os.remove(f.name)
+    print("✅ 无法识别时使用原图")
+
+
+def test_analysis_only_releases_original():
+    """只做分析时生成副本后删除缓存中的原图；pin 住或不需要副本的原图保留"""
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ImageCache(directory, ttl_seconds=3600, max_bytes=1 << 30)
+        preprocessor = ImagePreprocessor(directory, max_dimension=800)
+
+        def download(code, size, color):
+            tmp = Path(directory) / f"{code}.part"
+            Image.new('RGB', size, color).save(tmp, format='JPEG', quality=95)
+            return cache.put(code, str(tmp), hashlib.sha256(tmp.read_bytes()).hexdigest())
+
+        with mock.patch.object(module, "image_cache", cache):
+            big = download("big", (3000, 2000), (10, 120, 200))
+            copy = preprocessor.prepare(big, keep_original=False)
+            assert copy != big and os.path.exists(copy) and not os.path.exists(big)
+            assert cache.get("big") is None and cache.stats()["files"] == 0
+            assert preprocessor.prepare(big, keep_original=False) == copy  # 原图已删除时复用副本
+
+            pinned = download("pinned", (3000, 2000), (200, 10, 10))
+            with disk_janitor.pinned(pinned):
+                preprocessor.prepare(pinned, keep_original=False)
+            assert os.path.exists(pinned)
+
+            small = download("small", (100, 100), (0, 0, 0))
+            assert preprocessor.prepare(small, keep_original=False) == small and os.path.exists(small)
+
+            kept = download("kept", (3000, 2000), (10, 200, 10))
+            preprocessor.prepare(kept)
+            assert os.path.exists(kept)
+    print("✅ 只做分析时删除原图")
+
+
+if __name__ == "__main__":
+    test_large_photo_gets_bounded_analysis_copy()
+    test_wrong_extension_and_passthrough()
+    test_unreadable_file_falls_back_to_original()
+    test_analysis_only_releases_original()
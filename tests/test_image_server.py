@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""测试图片服务器：条件请求、Range、HEAD、路径安全、内存缓存、缩放版本与 Accept 协商"""
+import asyncio
+import os
+import socket
+import tempfile
+from pathlib import Path
+
+import aiohttp
+from aiohttp.test_utils import TestClient, TestServer
+from PIL import Image
+
+from config import IMAGE_SERVER_URL
+from disk_janitor import disk_janitor
+from hot_cache import HotObjectCache
+from image_server import ImageServer, accepts, parse_accept
+from image_variants import VariantStore, thumbnail_url
+
+BODY = bytes(range(256)) * 40
+
+
+def _run(scenario, cache_bytes=0, sibling_formats=()):
+    """在临时图片目录上启动服务器并执行测试场景（默认关闭内存缓存，覆盖 sendfile 路径）"""
+    async def main(directory):
+        variants = VariantStore(Path(directory) / ".variants", widths=(240, 480), workers=0,
+                                sibling_formats=sibling_formats)
+        server = ImageServer(directory, HotObjectCache(cache_bytes, cache_bytes), variants)
+        client = TestClient(TestServer(server.make_app()))
+        await client.start_server()
+        try:
+            await scenario(client, server, Path(directory))
+        finally:
+            await client.close()
+
+    with tempfile.TemporaryDirectory() as directory:
+        (Path(directory) / "image.png").write_bytes(BODY)
+        (Path(directory) / ".tmp.part").write_bytes(b"partial")
+        Image.new('RGBA', (1200, 800), (0, 128, 255, 200)).save(Path(directory) / "generated.png")
+        asyncio.run(main(directory))
+
+
+def test_conditional_requests():
+    """返回强 ETag；If-None-Match / If-Modified-Since 命中时返回 304"""
+    async def scenario(client, server, directory):
+        resp = await client.get("/image.png")
+        assert resp.status == 200 and await resp.read() == BODY
+        etag = resp.headers["ETag"]
+        assert not etag.startswith("W/")
+        assert resp.headers["Cache-Control"] and resp.headers["Access-Control-Allow-Origin"] == "*"
+
+        resp = await client.get("/image.png", headers={"If-None-Match": etag})
+        assert resp.status == 304
+        resp = await client.get("/image.png", headers={"If-Modified-Since": resp.headers["Last-Modified"]})
+        assert resp.status == 304
+
+    _run(scenario)
+    print("✅ ETag 与条件请求")
+
+
+def test_range_and_head():
+    """Range 返回 206 与对应片段；HEAD 只返回头部"""
+    async def scenario(client, server, directory):
+        resp = await client.get("/image.png", headers={"Range": "bytes=100-199"})
+        assert resp.status == 206 and await resp.read() == BODY[100:200]
+        assert resp.headers["Content-Range"] == f"bytes 100-199/{len(BODY)}"
+
+        resp = await client.head("/image.png")
+        assert resp.status == 200 and int(resp.headers["Content-Length"]) == len(BODY)
+        assert await resp.read() == b""
+
+    _run(scenario)
+    print("✅ Range 与 HEAD")
+
+
+def test_rejects_hidden_and_outside_paths():
+    """不提供隐藏文件、目录外文件与目录列表"""
+    async def scenario(client, server, directory):
+        assert (await client.get("/.tmp.part")).status == 404
+        assert (await client.get("/missing.png")).status == 404
+        assert (await client.get("/%2e%2e/etc/passwd")).status == 404
+        resp = await client.get("/")
+        assert resp.status == 200 and "image.png" not in await resp.text()
+
+    _run(scenario)
+    print("✅ 路径安全")
+
+
+def test_hot_cache_hits_match_file_responses():
+    """内存命中与读盘返回相同的 ETag、条件请求与 Range 结果；文件改写后失效"""
+    async def scenario(client, server, directory):
+        first = await client.get("/image.png")
+        body, etag = await first.read(), first.headers["ETag"]
+        second = await client.get("/image.png")
+        assert await second.read() == body == BODY and second.headers["ETag"] == etag
+        assert second.headers["Content-Type"] == "image/png"
+
+        assert (await client.get("/image.png", headers={"If-None-Match": etag})).status == 304
+        resp = await client.get("/image.png", headers={"Range": "bytes=-56"})
+        assert resp.status == 206 and await resp.read() == BODY[-56:]
+        assert resp.headers["Content-Range"] == f"bytes {len(BODY) - 56}-{len(BODY) - 1}/{len(BODY)}"
+        assert (await client.get("/image.png", headers={"Range": f"bytes={len(BODY)}-"})).status == 416
+
+        stats = (await (await client.get("/-/stats")).json())["hot_cache"]
+        assert stats["hits"] == 4 and stats["misses"] == 1 and stats["objects"] == 1
+
+        path = directory / "image.png"
+        path.write_bytes(b"new content")
+        os.utime(path, ns=(1, 1))
+        resp = await client.get("/image.png")
+        assert await resp.read() == b"new content" and resp.headers["ETag"] != etag
+
+        server.cache.invalidate(path)
+        assert server.cache.stats()["objects"] == 0
+
+    _run(scenario, cache_bytes=1 << 20)
+    print("✅ 内存热点缓存")
+
+
+def test_hot_cache_counts_oversized_as_bypass():
+    """超过单个文件上限的请求计入 bypass，不拉低命中率"""
+    with tempfile.TemporaryDirectory() as directory:
+        small, large = Path(directory) / "small.png", Path(directory) / "large.png"
+        small.write_bytes(b"s" * 100)
+        large.write_bytes(b"l" * 10000)
+        cache = HotObjectCache(1 << 20, 1000)
+        for _ in range(3):
+            assert cache.get(large, large.stat()) is None
+            if cache.get(small, small.stat()) is None:
+                cache.load(small)
+        stats = cache.stats()
+        assert stats["bypass"] == 3 and stats["misses"] == 1 and stats["hits"] == 2
+        assert stats["hit_ratio"] == round(2 / 3, 4)
+    print("✅ 大文件计入 bypass")
+
+
+def test_resized_variants():
+    """白名单宽度返回缓存到磁盘的 JPEG 缩放版本，其他宽度返回 400"""
+    async def scenario(client, server, directory):
+        resp = await client.get("/generated.png?w=480")
+        assert resp.status == 200 and resp.headers["Content-Type"] == "image/jpeg"
+        data = await resp.read()
+        variant = server.variants.variant_path("generated.png", 480)
+        assert variant.read_bytes() == data
+        assert Image.open(variant).size == (480, 320)
+
+        mtime = variant.stat().st_mtime_ns
+        resp = await client.get("/generated.png?w=480", headers={"If-None-Match": resp.headers["ETag"]})
+        assert resp.status == 304 and variant.stat().st_mtime_ns == mtime
+        assert server.variants.stats()["rendered"] == 1
+
+        assert (await client.get("/generated.png?w=500")).status == 400
+        assert (await client.get("/generated.png?w=abc")).status == 400
+        resp = await client.get("/image.png?w=240")  # 不是图片，退回原文件
+        assert resp.status == 200 and await resp.read() == BODY
+
+    _run(scenario)
+    print("✅ 缩放版本")
+
+
+def test_variant_paths_do_not_collide():
+    """扩展名不同或路径仅分隔符不同的图片使用各自的缩放版本"""
+    store = VariantStore(Path("/tmp/variants"), widths=(240,), workers=0, sibling_formats=())
+    names = ["foo.png", "foo.jpg", "a/b.png", "a_b.png"]
+    assert len({store.variant_path(name, 240) for name in names}) == len(names)
+    sources = [Path("/images/foo.png"), Path("/images/a/foo.png")]
+    assert len({store.sibling_path(source, "webp") for source in sources}) == len(sources)
+
+    async def scenario(client, server, directory):
+        Image.new('RGB', (600, 400), (255, 0, 0)).save(directory / "foo.png")
+        Image.new('RGB', (600, 400), (0, 0, 255)).save(directory / "foo.jpg")
+        for name, color in (("foo.png", (255, 0, 0)), ("foo.jpg", (0, 0, 255))):
+            resp = await client.get(f"/{name}?w=240")
+            assert resp.status == 200
+            variant = server.variants.variant_path(name, 240)
+            assert variant.read_bytes() == await resp.read()
+            pixel = Image.open(variant).convert('RGB').getpixel((10, 10))
+            assert all(abs(a - b) < 16 for a, b in zip(pixel, color))
+
+    _run(scenario)
+    print("✅ 缩放版本不会串用")
+
+
+def test_prepared_siblings_found_through_symlinks():
+    """图片目录是符号链接时，按链接路径预先编码的版本也能被服务器（按真实路径）找到"""
+    async def main(real, link):
+        variants = VariantStore(Path(real) / ".variants", widths=(240,), workers=0, sibling_formats=("webp",))
+        futures = variants.schedule_siblings(Path(link) / "generated.png") or []
+        await asyncio.gather(*(asyncio.wrap_future(f) for f in futures))
+        server = ImageServer(link, HotObjectCache(0, 0), variants)
+        client = TestClient(TestServer(server.make_app()))
+        await client.start_server()
+        try:
+            resp = await client.get("/generated.png", headers={"Accept": "image/webp"})
+            assert resp.headers["Content-Type"] == "image/webp"
+            assert variants.stats()["rendered"] == 1  # 未重新编码
+        finally:
+            await client.close()
+
+    with tempfile.TemporaryDirectory() as real, tempfile.TemporaryDirectory() as parent:
+        Image.new('RGBA', (1200, 800), (0, 128, 255, 200)).save(Path(real) / "generated.png")
+        link = os.path.join(parent, "imagegen")
+        os.symlink(real, link)
+        asyncio.run(main(real, link))
+    print("✅ 符号链接目录下复用预先编码的版本")
+
+
+def test_thumbnail_url():
+    """只为本图片服务器上的图片生成缩略图 URL"""
+    assert thumbnail_url(f"{IMAGE_SERVER_URL}/a.png", 480) == f"{IMAGE_SERVER_URL}/a.png?w=480"
+    assert thumbnail_url(f"{IMAGE_SERVER_URL}/a.png", 0) == f"{IMAGE_SERVER_URL}/a.png"
+    assert thumbnail_url(f"{IMAGE_SERVER_URL}/a.png", 123) == f"{IMAGE_SERVER_URL}/a.png"
+    assert thumbnail_url("https://example.com/a.png", 480) == "https://example.com/a.png"
+    print("✅ 缩略图 URL")
+
+
+def test_parse_accept():
+    """Accept 请求头解析与匹配优先级"""
+    accepted = parse_accept("image/avif;q=0, image/webp,image/*;q=0.8, */*;q=0.5")
+    assert not accepts(accepted, "image/avif")
+    assert accepts(accepted, "image/webp") and accepts(accepted, "image/png")
+    assert not accepts(parse_accept(""), "image/webp")
+    # 只发 */* 或不带 q 值的 image/* 的客户端不算接受编码版本
+    assert not accepts(parse_accept("*/*"), "image/webp")
+    assert not accepts(parse_accept("image/*, */*;q=0.8"), "image/avif")
+    print("✅ Accept 解析")
+
+
+def test_accept_negotiation():
+    """编码版本在后台生成；之后按 Accept 返回可接受的最小版本，并设置 Vary: Accept"""
+    async def scenario(client, server, directory):
+        source = directory / "generated.png"
+        resp = await client.get("/generated.png", headers={"Accept": "image/avif,image/webp,*/*"})
+        assert resp.headers["Content-Type"] == "image/png" and resp.headers["Vary"] == "Accept"
+        png_etag = resp.headers["ETag"]
+        futures = server.variants.schedule_siblings(source) or []
+        await asyncio.gather(*(asyncio.wrap_future(f) for f in futures))
+        sizes = {fmt: path.stat().st_size for fmt, path in server.variants.siblings(source)}
+        assert set(sizes) == {"webp", "avif"}
+
+        resp = await client.get("/generated.png", headers={"Accept": "image/avif,image/webp,*/*"})
+        best = min(sizes, key=sizes.get)
+        assert resp.headers["Content-Type"] == f"image/{best}" and len(await resp.read()) == sizes[best]
+        assert resp.headers["ETag"] != png_etag and resp.headers["Vary"] == "Accept"
+
+        resp = await client.get("/generated.png", headers={"Accept": "image/webp,image/png"})
+        assert resp.headers["Content-Type"] == ("image/webp" if sizes["webp"] < source.stat().st_size else "image/png")
+        resp = await client.get("/generated.png", headers={"Accept": "image/png"})
+        assert resp.headers["Content-Type"] == "image/png"
+        for accept in ("*/*", ""):  # 预览抓取、curl 等非浏览器客户端
+            resp = await client.get("/generated.png", headers={"Accept": accept})
+            assert resp.headers["Content-Type"] == "image/png" and resp.headers["Vary"] == "Accept"
+
+    _run(scenario, sibling_formats=("webp", "avif"))
+    print("✅ Accept 协商")
+
+
+def test_embedded_start_stop():
+    """在已有事件循环中启动与停止（机器人内置模式）；预先读入缓存的图片首次请求即命中"""
+    async def main(directory):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        variants = VariantStore(directory / ".variants", widths=(240,), workers=0, sibling_formats=())
+        server = ImageServer(directory, HotObjectCache(1 << 20, 1 << 20), variants)
+        await server.start("127.0.0.1", port)
+        try:
+            assert server.cache.invalidate in disk_janitor._listeners
+            server.cache.load(directory / "image.png")
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"http://127.0.0.1:{port}/image.png") as resp:
+                    assert resp.status == 200 and await resp.read() == BODY
+            stats = server.cache.stats()
+            assert stats["hits"] == 1 and stats["misses"] == 0
+        finally:
+            await server.stop()
+        assert server.cache.invalidate not in disk_janitor._listeners
+
+    with tempfile.TemporaryDirectory() as directory:
+        (Path(directory) / "image.png").write_bytes(BODY)
+        asyncio.run(main(Path(directory)))
+    print("✅ 内置模式启动与停止")
+
+
+if __name__ == "__main__":
+    test_conditional_requests()
+    test_range_and_head()
+    test_rejects_hidden_and_outside_paths()
+    test_hot_cache_hits_match_file_responses()
+    test_hot_cache_counts_oversized_as_bypass()
+    test_resized_variants()
+    test_variant_paths_do_not_collide()
+    test_prepared_siblings_found_through_symlinks()
+    test_thumbnail_url()
+    test_parse_accept()
+    test_accept_negotiation()
+    test_embedded_start_stop()
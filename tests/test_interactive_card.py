@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""测试互动卡片的投放与原地更新"""
+import threading
+import time
+from unittest import mock
+
+from delivery_router import DeliveryTarget
+from interactive_card import InteractiveCard, CARD_CREATE_URL, CARD_UPDATE_URL, STATUS_DONE
+
+
+def _card(conversation_type='1', min_interval=60):
+    target = DeliveryTarget(conversation_id="cid", user_id="uid", conversation_type=conversation_type)
+    return InteractiveCard(target, "标题", template_id="tpl", min_interval=min_interval)
+
+
+def test_create_targets_group_or_user():
+    """群聊投放到群会话，单聊投放到用户"""
+    for conversation_type, space in (('2', "dtv1.card//IM_GROUP.cid"), ('1', "dtv1.card//IM_ROBOT.uid")):
+        card = _card(conversation_type)
+        with mock.patch.object(card, "_call", return_value=True) as call:
+            assert card.create("处理中")
+        method, url, payload = call.call_args[0][:3]
+        assert (method, url) == ("POST", CARD_CREATE_URL)
+        assert payload["openSpaceId"] == space
+        assert payload["cardData"]["cardParamMap"]["content"] == "处理中"
+    print("✅ 卡片投放到正确的会话")
+
+
+def test_progress_throttled_but_final_always_sent():
+    """进度更新受最小间隔限制，最终结果总会更新，结束后不再接受进度"""
+    card = _card(min_interval=60)
+    with mock.patch.object(card, "_call", return_value=True) as call:
+        card.create("处理中")
+        assert not card.update("已处理 1 秒")  # 间隔过短被跳过
+        assert card.finish("最终结果")
+        assert not card.update("迟到的进度", force=True)
+    method, url, payload = call.call_args[0][:3]
+    assert (method, url) == ("PUT", CARD_UPDATE_URL)
+    assert payload["cardData"]["cardParamMap"] == {"title": "标题", "content": "最终结果", "status": STATUS_DONE}
+    assert card.updates == 1
+    print("✅ 进度更新节流，最终结果总会更新")
+
+
+def test_update_requires_created_card():
+    """投放失败的卡片不会被更新"""
+    card = _card()
+    with mock.patch.object(card, "_call", return_value=False):
+        assert not card.create("处理中")
+        assert not card.finish("最终结果")
+    print("✅ 投放失败时不更新")
+
+
+def test_final_update_sent_after_inflight_progress():
+    """进行中的进度更新完成后才发出最终结果，最终结果不会被覆盖"""
+    card = _card(min_interval=0)
+    sent = []
+    progress_started = threading.Event()
+
+    def call(method, url, payload, label, deadline):
+        status = payload["cardData"]["cardParamMap"]["status"] if method == "PUT" else "create"
+        if status == "processing":
+            progress_started.set()
+            time.sleep(0.3)  # 慢速的进度 PUT
+        sent.append(status)
+        return True
+
+    with mock.patch.object(card, "_call", side_effect=call):
+        card.create("处理中")
+        progress = threading.Thread(target=card.update, args=("已处理 1 秒",))
+        progress.start()
+        progress_started.wait(5)
+        assert card.finish("最终结果")
+        progress.join()
+        assert not card.update("迟到的进度")
+    assert sent == ["create", "processing", STATUS_DONE]
+    print("✅ 最终结果总是最后一次更新")
+
+
+if __name__ == "__main__":
+    test_create_targets_group_or_user()
+    test_progress_throttled_but_final_always_sent()
+    test_update_requires_created_card()
+    test_final_update_sent_after_inflight_progress()
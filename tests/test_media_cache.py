@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""测试图片 media_id 缓存"""
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from media_cache import MediaCache
+
+
+def test_uploads_once_per_content_and_persists():
+    """相同内容只上传一次，缓存在重启后仍然可用"""
+    uploads = []
+
+    def upload(file_path, media_type, deadline=None):
+        uploads.append(file_path)
+        return f"@media{len(uploads)}"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        first = tmp / "a.png"
+        copy = tmp / "b.png"
+        first.write_bytes(b"same image")
+        copy.write_bytes(b"same image")
+        cache_file = tmp / "cache" / "media_ids.json"
+
+        cache = MediaCache(upload, cache_file, ttl_seconds=3600)
+        assert cache.get_media_id(str(first)) == "@media1"
+        assert cache.get_media_id(str(copy)) == "@media1"
+        assert len(uploads) == 1
+
+        reloaded = MediaCache(upload, cache_file, ttl_seconds=3600)
+        assert reloaded.get_media_id(str(copy)) == "@media1"
+        assert len(uploads) == 1
+    print("✅ 相同内容只上传一次")
+
+
+def test_prepare_only_on_miss():
+    """压缩等预处理只在未命中缓存时执行"""
+    prepared = []
+
+    def prepare(path):
+        prepared.append(path)
+        return path
+
+    with tempfile.TemporaryDirectory() as tmp:
+        image = Path(tmp) / "a.png"
+        image.write_bytes(b"image")
+        cache = MediaCache(lambda *a, **k: "@media", Path(tmp) / "ids.json", ttl_seconds=3600)
+        cache.get_media_id(str(image), prepare=prepare)
+        cache.get_media_id(str(image), prepare=prepare)
+    assert len(prepared) == 1
+    print("✅ 命中缓存时跳过预处理")
+
+
+def test_key_locks_released_after_upload():
+    """上传失败、抛异常或成功后都不遗留按内容的锁；失败后可重新上传"""
+    results = [None, RuntimeError("boom"), "@media"]
+    calls = []
+
+    def upload(*args, **kwargs):
+        calls.append(args)
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    with tempfile.TemporaryDirectory() as tmp:
+        image = Path(tmp) / "a.png"
+        image.write_bytes(b"image")
+        cache = MediaCache(upload, Path(tmp) / "ids.json", ttl_seconds=3600)
+        assert cache.get_media_id(str(image)) is None
+        assert cache._key_locks == {}
+        try:
+            cache.get_media_id(str(image))
+            assert False, "应当抛出异常"
+        except RuntimeError:
+            pass
+        assert cache._key_locks == {}
+        assert cache.get_media_id(str(image)) == "@media"
+        assert cache._key_locks == {} and len(calls) == 3
+    print("✅ 上传失败不遗留锁")
+
+
+def test_concurrent_waiters_share_upload():
+    """并发请求同一内容时只上传一次，全部结束后锁被移除"""
+    calls = []
+
+    def upload(*args, **kwargs):
+        calls.append(args)
+        time.sleep(0.1)
+        return "@media"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        image = Path(tmp) / "a.png"
+        image.write_bytes(b"image")
+        cache = MediaCache(upload, Path(tmp) / "ids.json", ttl_seconds=3600)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_media_id(str(image))))
+                   for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert results == ["@media"] * 4 and len(calls) == 1
+        assert cache._key_locks == {}
+    print("✅ 并发请求只上传一次")
+
+
+if __name__ == "__main__":
+    test_uploads_once_per_content_and_persists()
+    test_prepare_only_on_miss()
+    test_key_locks_released_after_upload()
+    test_concurrent_waiters_share_upload()
+    print("✅ 所有测试通过")
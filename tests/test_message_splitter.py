@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""测试按字节分割长消息"""
+from message_splitter import number_parts, split_message
+
+
+def _size(text):
+    return len(text.encode('utf-8'))
+
+
+def test_short_message_unchanged():
+    """未超出上限时原样返回"""
+    assert split_message("你好", 10) == ["你好"]
+    assert list(number_parts(["你好"])) == [("", "你好")]
+    print("✅ 短消息原样返回")
+
+
+def test_splits_by_bytes_and_prefers_headings():
+    """按 UTF-8 字节数分割，并优先在标题处断开"""
+    content = "".join(f"## 第{k}节\n\n" + "段落内容。" * 30 + "\n\n" for k in range(6))
+    parts = split_message(content, 1000)
+    assert all(_size(p) <= 1000 for p in parts)
+    assert len(parts) > 1
+    assert all(p.startswith("## 第") for p in parts)
+    assert "".join(p.replace("\n", "") for p in parts) == content.replace("\n", "")
+    print("✅ 按字节分割并优先在标题处断开")
+
+
+def test_code_fence_closed_and_reopened():
+    """代码块被切断时闭合后在下一条重新打开"""
+    content = "说明\n\n```python\n" + "".join(f"x = {j}\n" for j in range(300)) + "```\n\n结束\n"
+    parts = split_message(content, 800)
+    assert len(parts) > 2
+    for part in parts:
+        assert _size(part) <= 800
+        assert part.count("```") % 2 == 0, part
+    assert all(p.startswith("```python\n") for p in parts[1:])
+    assert parts[-1].endswith("结束")
+    print("✅ 代码块跨条时闭合并重开")
+
+
+def test_overlong_line_split_on_char_boundary():
+    """超长单行按字节切开且不切断多字节字符"""
+    content = "汉" * 5000
+    parts = split_message(content, 4000)
+    assert all(_size(p) <= 4000 for p in parts)
+    assert "".join(parts) == content
+    print("✅ 超长单行按字符边界切开")
+
+
+def test_number_parts():
+    """多条时编号"""
+    assert [label for label, _ in number_parts(["a", "b", "c"])] == ["(1/3)", "(2/3)", "(3/3)"]
+    print("✅ 分段编号")
+
+
+def test_trailing_blank_lines_not_sent_as_part():
+    """断点后只剩空行时不产生空白分段，编号只统计有内容的分段"""
+    for blank in ("\n", " \n", "\t\n"):
+        content = "a" * 90 + "\n" + blank * 30
+        parts = split_message(content, 100)
+        assert len(parts) == 1 and parts[0].startswith("a" * 90), parts
+        assert _size(parts[0]) <= 100
+        assert [label for label, _ in number_parts(parts)] == [""]
+    print("✅ 末尾空行不产生空分段")
+
+
+if __name__ == "__main__":
+    test_short_message_unchanged()
+    test_splits_by_bytes_and_prefers_headings()
+    test_code_fence_closed_and_reopened()
+    test_overlong_line_split_on_char_boundary()
+    test_number_parts()
+    test_trailing_blank_lines_not_sent_as_part()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""测试主动消息合并发送队列"""
+import threading
+import time
+from unittest import mock
+
+from deadline import Deadline
+from dingtalk_sender import dingtalk_sender
+from outbound_queue import OutboundItem, OutboundQueue
+
+
+def test_group_merges_identical_content_preserving_order():
+    """相同内容合并为一个批次，每个用户的消息顺序不变"""
+    items = [
+        OutboundItem("a", "sampleText", "X"),
+        OutboundItem("b", "sampleText", "Y"),
+        OutboundItem("a", "sampleText", "Y"),
+        OutboundItem("b", "sampleText", "X"),
+        OutboundItem("c", "sampleText", "X"),
+    ]
+    batches = OutboundQueue.group(items)
+    sent = [(b.msg_param, [i.user_id for i in b.items]) for b in batches]
+    # b 的 X 在 Y 之后提交，不能并入第一个 X 批次
+    assert sent == [("X", ["a"]), ("Y", ["b", "a"]), ("X", ["b", "c"])]
+    print("✅ 合并后用户消息顺序不变")
+
+
+def test_group_respects_max_users():
+    """单批次用户数不超过上限"""
+    items = [OutboundItem(f"u{i}", "sampleText", "X") for i in range(5)]
+    batches = OutboundQueue.group(items, max_users=2)
+    assert [len(b.items) for b in batches] == [2, 2, 1]
+    print("✅ 单批次用户数受限")
+
+
+def test_queue_sends_one_call_per_window():
+    """窗口内发给多个用户的相同内容只调用一次接口"""
+    calls = []
+    lock = threading.Lock()
+
+    deadlines = []
+
+    def send_batch(user_ids, msg_key, msg_param, timeout, deadline):
+        with lock:
+            calls.append(sorted(user_ids))
+            deadlines.append(deadline)
+        return True
+
+    outbound = OutboundQueue(send_batch, window_seconds=0.2)
+    tight, loose = Deadline(30), Deadline(60)
+    futures = [outbound.submit(uid, "sampleText", '{"content": "hi"}', deadline=deadline)
+               for uid, deadline in (("a", loose), ("b", tight), ("c", None))]
+    assert all(f.result(timeout=5) for f in futures)
+    assert calls == [["a", "b", "c"]]
+    assert deadlines == [tight]  # 等待 token 与限流时使用批次内最早的截止时间
+    assert outbound.stats() == {"messages": 3, "calls": 1}
+    print("✅ 相同内容合并为一次调用")
+
+
+def test_slow_batch_does_not_stall_other_senders():
+    """排在慢批次之后的消息等待有上限，超时后撤回且不再发送"""
+    release = threading.Event()
+    calls = []
+
+    def send_batch(user_ids, msg_key, msg_param, timeout, deadline):
+        calls.append(list(user_ids))
+        release.wait(5)
+        return True
+
+    outbound = OutboundQueue(send_batch, window_seconds=0.05)
+    with mock.patch.object(dingtalk_sender, "_outbound", outbound):
+        slow = threading.Thread(target=dingtalk_sender._dispatch, args=("slow", "sampleText", '"A"', 0.3))
+        slow.start()
+        time.sleep(0.1)
+        started = time.monotonic()
+        assert dingtalk_sender._dispatch("other", "sampleText", '"B"', 0.3) is False
+        assert time.monotonic() - started < 1.5
+        release.set()
+        slow.join(5)
+        time.sleep(0.2)
+    assert calls == [["slow"]]
+    print("✅ 慢批次不阻塞其他消息")
+
+
+if __name__ == "__main__":
+    test_group_merges_identical_content_preserving_order()
+    test_group_respects_max_users()
+    test_queue_sends_one_call_per_window()
+    test_slow_batch_does_not_stall_other_senders()
+    print("✅ 所有测试通过")
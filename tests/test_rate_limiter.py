@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""测试钉钉接口限流"""
+import time
+
+from rate_limiter import RateLimiter, call_with_throttle_retry, is_throttled
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, body=None, headers=None):
+        self.status_code = status_code
+        self._body = body if body is not None else {}
+        self.headers = headers or {}
+
+    def json(self):
+        return self._body
+
+
+def test_recognizes_throttling_responses():
+    """识别 HTTP 429、OpenAPI QpsLimit 错误码与 webhook errcode"""
+    assert is_throttled(FakeResponse(429))
+    assert is_throttled(FakeResponse(403, {"code": "Forbidden.AccessDenied.QpsLimitForApi"}))
+    assert is_throttled(FakeResponse(200, {"errcode": 130101, "errmsg": "send too fast"}))
+    assert not is_throttled(FakeResponse(200, {"errcode": 0}))
+    assert not is_throttled(FakeResponse(400, {"code": "invalidParameter"}))
+    print("✅ 限流响应识别正确")
+
+
+def test_limiter_spaces_calls():
+    """超出突发上限后按速率放行"""
+    limiter = RateLimiter("test", rate=20, burst=1)
+    start = time.monotonic()
+    for _ in range(3):
+        limiter.acquire()
+    assert time.monotonic() - start >= 0.09
+    print("✅ 调用按速率放行")
+
+
+def test_retries_after_throttling():
+    """被限流后按 Retry-After 退避并重试"""
+    limiter = RateLimiter("test", rate=100)
+    responses = [FakeResponse(429, headers={"Retry-After": "0.05"}), FakeResponse(200, {"errcode": 0})]
+    result = call_with_throttle_retry(
+        limiter, "https://throttle.example.com/", lambda: responses.pop(0), "测试"
+    )
+    assert result.status_code == 200
+    assert limiter.stats()["throttled"] == 1
+    print("✅ 限流后退避重试成功")
+
+
+if __name__ == "__main__":
+    test_recognizes_throttling_responses()
+    test_limiter_spaces_calls()
+    test_retries_after_throttling()
+    print("✅ 所有测试通过")
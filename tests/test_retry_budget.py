@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""测试全局重试预算"""
+from retry_budget import RetryBudget, RetryBudgets
+
+
+def test_budget_caps_retries():
+    """令牌耗尽后拒绝重试，新请求按比例补充令牌"""
+    budget = RetryBudget("example.com", ratio=0.5, min_per_sec=0, max_tokens=2)
+    assert budget.try_retry()
+    assert budget.try_retry()
+    assert not budget.try_retry()
+
+    budget.record_request()
+    budget.record_request()
+    assert budget.try_retry()
+    assert not budget.try_retry()
+
+    stats = budget.snapshot()
+    assert stats["requests"] == 2
+    assert stats["retries"] == 3
+    assert stats["denied"] == 2
+    print("✅ 重试量受预算限制")
+
+
+def test_nested_layers_share_logical_request():
+    """业务层与传输层嵌套时共用一个逻辑请求，调用次数合并统计"""
+    budgets = RetryBudgets()
+    with budgets.request("https://example.com/a") as outer:
+        assert outer.retry()
+        with budgets.request("https://example.com/b") as inner:
+            assert inner is outer
+            assert inner.retry()
+        # 不同主机是独立的逻辑请求
+        with budgets.request("https://other.example.com/") as other:
+            assert other is not outer
+
+    stats = budgets.snapshot()
+    assert stats["example.com"]["requests"] == 1
+    assert stats["example.com"]["attempts"] == {3: 1}
+    assert stats["other.example.com"]["attempts"] == {1: 1}
+    print("✅ 嵌套重试层共享预算与调用次数")
+
+
+def test_uncounted_probe_leaves_budget_untouched():
+    """探测请求不存入令牌、不计入调用次数分布，也不重试"""
+    budgets = RetryBudgets()
+    budget = budgets.get("example.com")
+    budget._tokens = 0
+    with budgets.request("https://example.com/", count=False) as probe:
+        with budgets.request("https://example.com/x") as inner:
+            assert inner is probe  # 嵌套的传输层复用探测请求
+        assert budgets.current("example.com") is probe
+        assert not probe.retry()
+
+    stats = budgets.snapshot()["example.com"]
+    assert stats["requests"] == 0 and stats["attempts"] == {}
+    assert stats["retries"] == 0 and stats["denied"] == 0 and stats["tokens"] == 0
+    assert budgets.current("example.com") is None
+    print("✅ 探测请求不计入重试预算")
+
+
+if __name__ == "__main__":
+    test_budget_caps_retries()
+    test_nested_layers_share_logical_request()
+    test_uncounted_probe_leaves_budget_untouched()
+    print("✅ 所有测试通过")
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""测试 access token 后台刷新"""
+import threading
+import time
+
+from token_manager import AccessTokenManager
+
+
+def test_cold_start_single_flight():
+    """冷启动时并发调用只触发一次获取"""
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        time.sleep(0.1)
+        return "token-1", 7200
+
+    manager = AccessTokenManager(fetch)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(manager.get())) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    manager.close()
+
+    assert results == ["token-1"] * 5
+    assert len(calls) == 1
+    print("✅ 冷启动只获取一次 token")
+
+
+def test_refresh_in_background_with_server_lifetime():
+    """按服务端有效期进入刷新窗口后，调用方拿到旧 token，刷新在后台完成"""
+    tokens = iter(["token-1", "token-2"])
+    release = threading.Event()
+
+    def fetch():
+        token = next(tokens)
+        if token == "token-2":
+            release.wait(2)
+        return token, 0.2  # 有效期 0.2s，刷新窗口为后一半
+
+    manager = AccessTokenManager(fetch, refresh_margin=300)
+    assert manager.get() == "token-1"
+    time.sleep(0.12)
+
+    start = time.monotonic()
+    assert manager.get() == "token-1"  # 刷新进行中，不等待
+    assert time.monotonic() - start < 0.05
+
+    release.set()
+    time.sleep(0.05)
+    assert manager.get() == "token-2"
+    manager.close()
+    print("✅ 后台刷新不阻塞调用方")
+
+
+if __name__ == "__main__":
+    test_cold_start_single_flight()
+    test_refresh_in_background_with_server_lifetime()
+    print("✅ 所有测试通过")
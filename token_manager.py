@@ -0,0 +1,149 @@
+"""
+access token 管理
+按服务端返回的有效期在过期前后台刷新；当前 token 有效时调用方从不等待刷新，
+冷启动或 token 已过期时所有调用方共享同一次刷新请求
+"""
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Callable, Optional, Tuple
+
+from deadline import Deadline, DeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+# 获取 token 的函数: () -> (access_token, 有效期秒数)
+FetchTokenFunc = Callable[[], Tuple[str, float]]
+
+
+class AccessTokenManager:
+    """带后台刷新与单飞请求的 access token 缓存"""
+
+    RETRY_INTERVAL = 30  # 后台刷新失败后的重试间隔(秒)
+
+    def __init__(self, fetch: FetchTokenFunc, refresh_margin: float = 300, name: str = "access token"):
+        """
+        Args:
+            fetch: 获取 token 的函数
+            refresh_margin: 提前刷新的时间(秒)，不超过有效期的一半
+            name: 名称（用于日志）
+        """
+        self._fetch = fetch
+        self.refresh_margin = refresh_margin
+        self.name = name
+        self._lock = threading.Lock()
+        self._token: Optional[str] = None
+        self._expires_at = 0.0  # time.monotonic()
+        self._refresh_at = 0.0
+        self._inflight: Optional[Future] = None
+        self._timer: Optional[threading.Timer] = None
+        self._closed = False
+
+    def _valid(self) -> bool:
+        """当前 token 是否仍有效（调用方需持有锁）"""
+        return self._token is not None and time.monotonic() < self._expires_at
+
+    def get(self, deadline: Optional[Deadline] = None) -> str:
+        """
+        获取 token
+
+        当前 token 有效时立即返回（进入刷新窗口时顺带触发后台刷新）；
+        否则等待进行中的刷新完成
+
+        Args:
+            deadline: 消息处理截止时间(可选)，限制等待刷新的时间
+
+        Returns:
+            access token
+        """
+        token = self._cached()
+        if token is not None:
+            return token
+        future = self._start_refresh()
+        timeout = None if deadline is None else deadline.remaining()
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            raise DeadlineExceeded(f"等待 {self.name} 刷新超出处理预算")
+
+    async def get_async(self, deadline: Optional[Deadline] = None) -> str:
+        """协程版本的 get，等待刷新时不占用线程"""
+        token = self._cached()
+        if token is not None:
+            return token
+        future = asyncio.wrap_future(self._start_refresh())
+        timeout = None if deadline is None else deadline.remaining()
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(f"等待 {self.name} 刷新超出处理预算")
+
+    def _cached(self) -> Optional[str]:
+        """返回仍有效的 token；进入刷新窗口时触发后台刷新"""
+        with self._lock:
+            if not self._valid():
+                return None
+            token = self._token
+            stale = time.monotonic() >= self._refresh_at
+        if stale:
+            self._start_refresh()
+        return token
+
+    def _start_refresh(self) -> Future:
+        """启动一次刷新；已有进行中的刷新时直接复用"""
+        with self._lock:
+            if self._inflight is not None:
+                return self._inflight
+            future = Future()
+            self._inflight = future
+        threading.Thread(target=self._refresh, args=(future,), name="token-refresh", daemon=True).start()
+        return future
+
+    def _refresh(self, future: Future):
+        """执行刷新（在独立线程中）"""
+        try:
+            token, expire_in = self._fetch()
+        except Exception as e:
+            logger.error(f"刷新 {self.name} 失败: {e}")
+            with self._lock:
+                self._inflight = None
+                still_valid = self._valid()
+                if still_valid:
+                    # 旧 token 仍可用，推迟下次刷新，避免每次调用都触发失败的刷新
+                    self._refresh_at = time.monotonic() + self.RETRY_INTERVAL
+            if still_valid:
+                self._schedule(self.RETRY_INTERVAL)
+            future.set_exception(e)
+            return
+
+        margin = min(self.refresh_margin, expire_in / 2)
+        now = time.monotonic()
+        with self._lock:
+            self._token = token
+            self._expires_at = now + expire_in
+            self._refresh_at = now + expire_in - margin
+            self._inflight = None
+        logger.info(f"成功获取 {self.name}，有效期 {expire_in:.0f}s，将在 {expire_in - margin:.0f}s 后后台刷新")
+        self._schedule(expire_in - margin)
+        future.set_result(token)
+
+    def _schedule(self, delay: float):
+        """安排下一次后台刷新"""
+        with self._lock:
+            if self._closed:
+                return
+            if self._timer:
+                self._timer.cancel()
+            self._timer = threading.Timer(delay, self._start_refresh)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def close(self):
+        """停止后台刷新"""
+        with self._lock:
+            self._closed = True
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
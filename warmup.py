@@ -0,0 +1,130 @@
+"""
+启动预热
+在开始接收消息前获取 access_token，并建立到各上游主机的长连接（DNS 解析、TCP/TLS 握手），
+使第一条消息的延迟与稳态一致
+"""
+import asyncio
+import logging
+import time
+from typing import List, Tuple
+from urllib.parse import urlsplit
+
+from config import (
+    CODEBUDDY_API_URL,
+    WARMUP_TIMEOUT,
+)
+from http_client import http_client
+from async_http_client import async_http_client
+from dingtalk_sender import dingtalk_sender
+from gemini_image_generator import gemini_image_generator
+from retry_budget import retry_budgets
+
+logger = logging.getLogger(__name__)
+
+DINGTALK_API_ORIGIN = "https://api.dingtalk.com"
+DINGTALK_OAPI_ORIGIN = "https://oapi.dingtalk.com"
+
+
+def _origin(url: str) -> str:
+    """提取 scheme://host[:port]"""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _targets() -> List[Tuple[str, str, object]]:
+    """
+    需要预热的 (名称, 地址, requests Session) 列表
+
+    与业务请求使用同一个 Session，预热建立的连接会留在对应连接池中被复用
+    """
+    codebuddy_origin = _origin(CODEBUDDY_API_URL)
+    return [
+        ("钉钉 OpenAPI", DINGTALK_API_ORIGIN, http_client.dingtalk_session),
+        ("钉钉 OAPI", DINGTALK_OAPI_ORIGIN, http_client.dingtalk_session),
+        ("CodeBuddy", codebuddy_origin, http_client.codebuddy_session),
+    ]
+
+
+def _head(session, url: str, timeout: float):
+    """发起一次 HEAD 请求，只关心连接是否建立，不关心状态码；探测不计入重试预算"""
+    with retry_budgets.request(url, count=False):
+        session.head(url, timeout=timeout, allow_redirects=False).close()
+
+
+async def _head_async(url: str, timeout: float):
+    """通过异步连接器发起一次 HEAD 请求；探测不计入重试预算"""
+    with retry_budgets.request(url, count=False):
+        await async_http_client.request("HEAD", url, timeout=timeout, allow_redirects=False)
+
+
+async def _timed(label: str, func, *args) -> bool:
+    """在线程池中执行预热步骤并记录耗时，失败只记录警告"""
+    start = time.monotonic()
+    try:
+        await asyncio.to_thread(func, *args)
+        logger.info(f"预热 {label} 完成: {time.monotonic() - start:.2f}s")
+        return True
+    except Exception as e:
+        logger.warning(f"预热 {label} 失败({time.monotonic() - start:.2f}s): {e}")
+        return False
+
+
+async def _timed_async(label: str, url: str) -> bool:
+    """通过异步连接器预热并记录耗时"""
+    start = time.monotonic()
+    try:
+        await _head_async(url, WARMUP_TIMEOUT)
+        logger.info(f"预热 {label}(异步) 完成: {time.monotonic() - start:.2f}s")
+        return True
+    except Exception as e:
+        logger.warning(f"预热 {label}(异步) 失败({time.monotonic() - start:.2f}s): {e}")
+        return False
+
+
+async def warm_up() -> float:
+    """
+    执行预热：获取 access_token，并为同步连接池、异步连接器和 VOD 客户端各建立一条连接
+
+    各步骤并发执行，单步失败不影响启动
+
+    Returns:
+        总耗时(秒)
+    """
+    start = time.monotonic()
+    targets = _targets()
+
+    steps = [_timed("access_token", dingtalk_sender._get_access_token)]
+    for label, url, session in targets:
+        steps.append(_timed(label, _head, session, url, WARMUP_TIMEOUT))
+        steps.append(_timed_async(label, url))
+    if gemini_image_generator.is_enabled():
+        steps.append(_timed("腾讯云 VOD", gemini_image_generator.warm_up, WARMUP_TIMEOUT))
+
+    results = await asyncio.gather(*steps)
+    elapsed = time.monotonic() - start
+    logger.info(f"启动预热完成: {sum(results)}/{len(results)} 项成功, 耗时 {elapsed:.2f}s")
+    return elapsed
+
+
+async def keep_warm(interval: float):
+    """
+    定期对各主机发起 HEAD 探测，防止空闲连接被服务端断开
+
+    仅复用已有连接，不刷新 access_token（由发送逻辑按需刷新）
+
+    Args:
+        interval: 探测间隔(秒)，应小于服务端空闲断开时间
+    """
+    logger.info(f"连接保活已启动，间隔 {interval}s")
+    while True:
+        await asyncio.sleep(interval)
+        steps = []
+        for label, url, session in _targets():
+            steps.append(asyncio.to_thread(_head, session, url, WARMUP_TIMEOUT))
+            steps.append(_head_async(url, WARMUP_TIMEOUT))
+        if gemini_image_generator.is_enabled():
+            steps.append(asyncio.to_thread(gemini_image_generator.warm_up, WARMUP_TIMEOUT))
+        results = await asyncio.gather(*steps, return_exceptions=True)
+        failed = [r for r in results if isinstance(r, Exception)]
+        if failed:
+            logger.debug(f"连接保活: {len(failed)}/{len(results)} 项失败: {failed[0]}")